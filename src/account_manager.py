@@ -0,0 +1,163 @@
+import os
+import json
+import logging
+from pathlib import Path
+import contextvars
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from instagram_poster import InstagramPoster
+from quota_accountant import QuotaAccountant
+from metrics import QUOTA_REMAINING
+
+logger = logging.getLogger('AccountManager')
+
+class AccountConfig:
+    """Settings for a single Instagram account"""
+    def __init__(self, name: str, instagram_account_id: str, access_token: str):
+        self.name = name
+        self.instagram_account_id = instagram_account_id
+        self.access_token = access_token
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'AccountConfig':
+        # Tokens can live in the environment instead of the accounts file
+        access_token = data.get('access_token')
+        if not access_token and data.get('access_token_env'):
+            access_token = os.getenv(data['access_token_env'])
+        if not data.get('instagram_account_id') or not access_token:
+            raise ValueError(f"Account '{data.get('name')}' needs instagram_account_id and an access token")
+        return cls(
+            name=data.get('name') or data['instagram_account_id'],
+            instagram_account_id=data['instagram_account_id'],
+            access_token=access_token,
+        )
+
+def load_account_configs(accounts_file: str = None) -> list:
+    """Load account configs from ACCOUNTS_FILE, falling back to the single account in .env"""
+    accounts_file = accounts_file or os.getenv("ACCOUNTS_FILE")
+    project_root = Path(__file__).parent.parent
+    path = Path(accounts_file) if accounts_file else project_root / "accounts.json"
+    # Relative paths are relative to the project root, wherever the bot is started from
+    if not path.is_absolute():
+        path = project_root / path
+
+    if path.exists():
+        with open(path, 'r') as f:
+            data = json.load(f)
+        configs = [AccountConfig.from_dict(entry) for entry in data]
+        names = [config.name for config in configs]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate account names in {path}")
+        logger.info(f"Loaded {len(configs)} account(s) from {path}")
+        return configs
+    if accounts_file:
+        raise FileNotFoundError(f"ACCOUNTS_FILE {path} does not exist")
+
+    config = AccountConfig(
+        name="default",
+        instagram_account_id=os.getenv("INSTAGRAM_ACCOUNT_ID"),
+        access_token=os.getenv("INSTAGRAM_ACCESS_TOKEN"),
+    )
+    if not config.instagram_account_id or not config.access_token:
+        raise ValueError(f"No accounts file at {path}, and INSTAGRAM_ACCOUNT_ID and "
+                         "INSTAGRAM_ACCESS_TOKEN are not both set in .env")
+    return [config]
+
+class AccountManager:
+    """Owns one InstagramPoster per account plus the pools they share"""
+    def __init__(self, configs: list = None, quota: QuotaAccountant = None, history_dir: str = None):
+        self.configs = configs if configs is not None else load_account_configs()
+        if not self.configs:
+            raise ValueError("At least one Instagram account must be configured")
+
+        # One HTTP connection pool shared by every account
+        pool_size = max(10, len(self.configs) * 4)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Local sliding-window record of publishes, shared by all accounts
+        self.quota = quota or QuotaAccountant(limit=InstagramPoster.PUBLISHING_LIMIT)
+
+        self.posters = {
+            config.name: InstagramPoster(
+                instagram_account_id=config.instagram_account_id,
+                access_token=config.access_token,
+                session=self.session,
+                name=config.name,
+                quota=self.quota,
+            )
+            for config in self.configs
+        }
+
+        # Rendering is CPU bound and holds the GIL, so it gets its own processes;
+        # posting mostly waits on the network and stays on threads
+        render_workers = int(os.getenv("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+        # Imported here so tools that only post don't load the image stack
+        from image_generator import init_worker
+        if os.getenv("RENDER_EXECUTOR", "process") == "process":
+            # Spawn rather than fork, since the parent is already running threads
+            self.render_pool = ProcessPoolExecutor(
+                max_workers=render_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(history_dir,)
+            )
+        else:
+            self.render_pool = ThreadPoolExecutor(max_workers=render_workers, thread_name_prefix='render',
+                                                  initializer=init_worker, initargs=(history_dir,))
+        self.post_pool = ThreadPoolExecutor(max_workers=len(self.configs), thread_name_prefix='post')
+
+    def __len__(self):
+        return len(self.configs)
+
+    def get_poster(self, name: str) -> InstagramPoster:
+        return self.posters[name]
+
+    def partition_by_quota(self, accounts: list = None) -> tuple:
+        """Split accounts into those with publishing quota left and those without"""
+        accounts = accounts if accounts is not None else self.configs
+        available, throttled = [], []
+        for config in accounts:
+            remaining = self.posters[config.name].remaining_quota()
+            QUOTA_REMAINING.set(remaining, account=config.name)
+            if remaining > 0:
+                available.append(config)
+            else:
+                logger.warning(f"Account '{config.name}' has no publishing quota left")
+                throttled.append(config)
+        return available, throttled
+
+    def available_accounts(self) -> list:
+        """Accounts that still have publishing quota left"""
+        return self.partition_by_quota()[0]
+
+    def quota_summary(self) -> dict:
+        return {name: poster.remaining_quota() for name, poster in self.posters.items()}
+
+    def fan_out(self, job, accounts: list = None) -> dict:
+        """Run job(config) for every account concurrently and collect the results by account name"""
+        accounts = accounts if accounts is not None else self.available_accounts()
+        # Each job runs in a copy of the caller's context, so it stays part of the caller's profiled run
+        futures = {
+            config.name: self.post_pool.submit(contextvars.copy_context().run, job, config)
+            for config in accounts
+        }
+
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                logger.error(f"Job for account '{name}' failed: {str(e)}")
+                results[name] = False
+        return results
+
+    def shutdown(self):
+        self.post_pool.shutdown(wait=True)
+        self.render_pool.shutdown(wait=True)
+        self.session.close()
+        self.quota.close()
@@ -0,0 +1,229 @@
+import os
+import time
+import html
+import queue
+import logging
+import threading
+from datetime import datetime
+import pytz
+from metrics import count_api_call, RETRIES
+
+logger = logging.getLogger('AlertQueue')
+
+SENDER = "Quotable Science <quotes@srijit.co>"
+SUBJECT_PREFIX = "[Quotable Science]"
+
+class ResendTransport:
+    name = 'resend'
+
+    def __init__(self, api_key: str, recipients: list, sender: str = SENDER):
+        self.api_key = api_key
+        self.recipients = recipients
+        self.sender = sender
+
+    def send(self, subject: str, body: str, alerts: list):
+        import resend
+        resend.api_key = self.api_key
+        resend.Emails.send({
+            "from": self.sender,
+            "to": self.recipients,
+            "subject": subject,
+            "html": body,
+        })
+
+class SmtpTransport:
+    name = 'smtp'
+
+    def __init__(self, host: str, port: int, recipients: list, sender: str = SENDER,
+                 username: str = None, password: str = None, starttls: bool = True):
+        self.host = host
+        self.port = port
+        self.recipients = recipients
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+
+    def send(self, subject: str, body: str, alerts: list):
+        import smtplib
+        from email.message import EmailMessage
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        message['Subject'] = subject
+        message.set_content("This alert is best viewed as HTML.")
+        message.add_alternative(body, subtype='html')
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(message)
+
+class WebhookTransport:
+    name = 'webhook'
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def send(self, subject: str, body: str, alerts: list):
+        import requests
+        response = requests.post(self.url, json={
+            'subject': subject,
+            'html': body,
+            'alerts': alerts,
+        }, timeout=30)
+        response.raise_for_status()
+
+def transport_from_env():
+    """Build the transport named by ALERT_TRANSPORT, or None if alerting isn't configured"""
+    recipients = [email.strip() for email in os.getenv("MONITORING_EMAIL", "").split(',') if email.strip()]
+    kind = os.getenv("ALERT_TRANSPORT") or ('resend' if os.getenv("RESEND_API_KEY") else None)
+    if kind == 'webhook':
+        url = os.getenv("ALERT_WEBHOOK_URL")
+        return WebhookTransport(url) if url else None
+    if not recipients:
+        return None
+    if kind == 'smtp':
+        return SmtpTransport(
+            host=os.getenv("SMTP_HOST", "localhost"),
+            port=int(os.getenv("SMTP_PORT", 587)),
+            recipients=recipients,
+            sender=os.getenv("ALERT_FROM", SENDER),
+            username=os.getenv("SMTP_USERNAME"),
+            password=os.getenv("SMTP_PASSWORD"),
+            starttls=os.getenv("SMTP_STARTTLS", "1") != "0",
+        )
+    if kind == 'resend' and os.getenv("RESEND_API_KEY"):
+        return ResendTransport(os.getenv("RESEND_API_KEY"), recipients, sender=os.getenv("ALERT_FROM", SENDER))
+    return None
+
+class AlertQueue:
+    """Non-blocking alert delivery
+
+    submit() only enqueues. A background worker waits ALERT_WINDOW_SECONDS after the
+    first alert, folds everything that arrived meanwhile into one digest (identical
+    alerts are counted, not repeated) and sends it, retrying with exponential backoff.
+    """
+    def __init__(self, transport, window: float = None, max_attempts: int = None, retry_delay: float = None):
+        self.transport = transport
+        self.window = float(window if window is not None else os.getenv('ALERT_WINDOW_SECONDS', 300))
+        self.max_attempts = int(max_attempts if max_attempts is not None else os.getenv('ALERT_MAX_ATTEMPTS', 5))
+        self.retry_delay = float(retry_delay if retry_delay is not None else os.getenv('ALERT_RETRY_SECONDS', 30))
+        self.ist_timezone = pytz.timezone('Asia/Kolkata')
+        self._queue = queue.Queue()
+        self._closing = threading.Event()
+        self._worker = threading.Thread(target=self._run, name='alert-queue', daemon=True)
+        self._worker.start()
+
+    def submit(self, subject: str, content: str):
+        """Queue an alert; never blocks on delivery"""
+        self._queue.put({'subject': subject, 'content': content, 'at': time.time()})
+
+    def close(self, timeout: float = 30):
+        """Send whatever is queued right away and stop the worker"""
+        self._closing.set()
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            batch = [first] if first else []
+            # Collect everything that arrives within the window, unless we're shutting down
+            deadline = time.monotonic() + self.window
+            while not self._closing.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    alert = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if alert:
+                    batch.append(alert)
+            # Drain anything left once closing
+            while self._closing.is_set():
+                try:
+                    alert = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if alert:
+                    batch.append(alert)
+            if batch:
+                self._deliver(batch)
+            if self._closing.is_set():
+                return
+
+    def _group(self, batch: list) -> list:
+        """Distinct alerts with how often and when each was seen"""
+        groups = {}
+        for alert in batch:
+            key = (alert['subject'], alert['content'])
+            group = groups.setdefault(key, {
+                'subject': alert['subject'],
+                'content': alert['content'],
+                'count': 0,
+                'first_seen': alert['at'],
+                'last_seen': alert['at'],
+            })
+            group['count'] += 1
+            group['last_seen'] = max(group['last_seen'], alert['at'])
+        return sorted(groups.values(), key=lambda group: group['first_seen'])
+
+    def _format_time(self, timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp, self.ist_timezone).strftime("%I:%M %p IST, %d %b %Y")
+
+    def render(self, batch: list) -> tuple:
+        """Subject, HTML body and grouped alerts for a batch: the alert itself if there's one, else a digest"""
+        groups = self._group(batch)
+        if len(groups) == 1 and groups[0]['count'] == 1:
+            group = groups[0]
+            subject = f"{SUBJECT_PREFIX} {group['subject']}"
+            body = f"""
+                <h2>{group['subject']}</h2>
+                <p><strong>Time:</strong> {self._format_time(group['first_seen'])}</p>
+                <p>{group['content']}</p>
+                <hr>
+                <p><em>This is an automated message from your monitoring service.</em></p>
+                """
+            return subject, body, groups
+
+        subject = f"{SUBJECT_PREFIX} {len(batch)} alerts ({len(groups)} distinct) since {self._format_time(groups[0]['first_seen'])}"
+        sections = []
+        for group in groups:
+            seen = self._format_time(group['first_seen'])
+            if group['count'] > 1:
+                seen += f" to {self._format_time(group['last_seen'])}"
+            sections.append(f"""
+                <h3>{group['subject']} &times; {group['count']}</h3>
+                <p><strong>Seen:</strong> {html.escape(seen)}</p>
+                <p>{group['content']}</p>
+                """)
+        body = f"""
+            <h2>Alert digest: {len(batch)} alerts</h2>
+            {''.join(sections)}
+            <hr>
+            <p><em>This is an automated message from your monitoring service.</em></p>
+            """
+        return subject, body, groups
+
+    def _deliver(self, batch: list):
+        subject, body, groups = self.render(batch)
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.transport.send(subject, body, groups)
+                count_api_call('alerts', self.transport.name, 'ok')
+                logger.info(f"Sent alert: {subject}")
+                return
+            except Exception as e:
+                count_api_call('alerts', self.transport.name, 'error')
+                logger.warning(f"Alert delivery attempt {attempt}/{self.max_attempts} failed: {str(e)}")
+                if attempt == self.max_attempts:
+                    break
+                RETRIES.inc(operation='alert_send')
+                # Back off, but cut the wait short if we are shutting down
+                if self._closing.wait(delay * 2 ** (attempt - 1)):
+                    delay = 0
+        logger.error(f"Dropping alert after {self.max_attempts} attempts: {subject}")
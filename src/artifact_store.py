@@ -0,0 +1,57 @@
+import os
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger('ArtifactStore')
+
+class ArtifactStore:
+    """Size-capped directory for rendered images that should survive a restart
+
+    Only used when PERSIST_ARTIFACTS=1; otherwise images go from the renderer to
+    the upload in memory. The oldest files are evicted once the cap is exceeded.
+    """
+    def __init__(self, directory: str = None, max_bytes: int = None):
+        self.directory = Path(directory) if directory else Path(__file__).parent.parent / "history" / "artifacts"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes if max_bytes is not None else float(os.getenv('ARTIFACT_MAX_MB', 200)) * 1024 * 1024)
+        self._lock = threading.Lock()
+
+    def put(self, name: str, data: bytes) -> str:
+        """Write an artifact atomically and return its path"""
+        path = self.directory / name
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with self._lock:
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            self._evict(keep=path)
+        return str(path)
+
+    def read(self, path: str):
+        """The artifact's bytes, or None if it has been evicted or removed"""
+        try:
+            return Path(path).read_bytes()
+        except OSError:
+            return None
+
+    def remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep: Path):
+        files = []
+        for path in self.directory.iterdir():
+            if path.is_file() and not path.name.startswith('.'):
+                stat = path.stat()
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            logger.info(f"Evicting {path.name} to stay under {self.max_bytes // (1024 * 1024)} MB")
+            path.unlink()
+            total -= size
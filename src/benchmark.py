@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Offline benchmark suite for the render pipeline
+
+Times each rendering stage at several resolutions without touching Gemini,
+imgbb or Instagram, compares the results with a stored baseline and exits
+non-zero when any stage regresses beyond the threshold.
+
+    python benchmark.py                      # compare against the baseline
+    python benchmark.py --update-baseline    # record a new baseline
+    python benchmark.py --resolutions 540 --repeat 5 --threshold 0.3
+    python benchmark.py --parity             # check the kernel backends against the original code
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+from pathlib import Path
+import numpy as np
+from scipy.ndimage import gaussian_filter
+import kernels
+from image_generator import ImageGenerator
+
+BASELINE_FILE = Path(__file__).parent.parent / "benchmarks" / "baseline.json"
+
+STAGES = ['gradient', 'gradient_direct', 'blur', 'text_layout', 'encode_png', 'encode_jpeg', 'render_quote_image']
+
+SAMPLE_QUOTE = ("The first principle is that you must not fool yourself, "
+                "and you are the easiest person to fool")
+SAMPLE_AUTHOR = "Richard Feynman"
+
+def make_generator(size: int) -> ImageGenerator:
+    generator = ImageGenerator()
+    generator.WIDTH = size
+    generator.HEIGHT = size
+    return generator
+
+def stage_cases(size: int) -> dict:
+    """Map of stage name to a zero-argument callable rendering that stage at the given size"""
+    generator = make_generator(size)
+    quote, author = generator.format_quote(SAMPLE_QUOTE, SAMPLE_AUTHOR)
+    field = np.random.rand(size, size)
+    background = generator.generate_blobby_gradient()
+    # Same render without the noise atlas, evaluating and blurring noise every time
+    direct = make_generator(size)
+    direct.noise_atlas = None
+
+    def encode(fmt):
+        def run():
+            buffer = io.BytesIO()
+            background.save(buffer, fmt, quality=95)
+        return run
+
+    def full_render():
+        # What render_quote_image does in a worker: render and encode in memory, nothing on disk
+        generator.encode(generator.render(SAMPLE_QUOTE, SAMPLE_AUTHOR))
+
+    return {
+        'gradient': generator.generate_blobby_gradient,
+        'gradient_direct': direct.generate_blobby_gradient,
+        'blur': lambda: gaussian_filter(field, sigma=30),
+        'text_layout': lambda: generator.draw_quote(background.copy(), quote, author),
+        'encode_png': encode('PNG'),
+        'encode_jpeg': encode('JPEG'),
+        'render_quote_image': full_render,
+    }
+
+def time_case(func, repeat: int) -> dict:
+    # Render stages print debug output; keep the report readable
+    samples = []
+    stdout = sys.stdout
+    for _ in range(repeat):
+        sys.stdout = io.StringIO()
+        try:
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+        finally:
+            sys.stdout = stdout
+    return {'min': min(samples), 'median': statistics.median(samples)}
+
+def run_benchmarks(resolutions, stages, repeat: int) -> dict:
+    results = {}
+    for size in resolutions:
+        cases = stage_cases(size)
+        for stage in stages:
+            key = f"{stage}@{size}"
+            results[key] = time_case(cases[stage], repeat)
+            print(f"{key:<28} min {results[key]['min'] * 1000:10.1f} ms   median {results[key]['median'] * 1000:10.1f} ms")
+    return results
+
+def check_parity(size: int) -> list:
+    """Compare every kernel backend with the original pnoise2 loop and array expressions
+
+    Returns the names of the checks that failed.
+    """
+    backends = [kernels.get('numpy')]
+    try:
+        backends.append(kernels.get('numba'))
+    except ImportError:
+        print("Numba is not installed, checking the NumPy kernels only")
+    rng = np.random.default_rng(0)
+    field = rng.random((size, size), dtype=np.float32)
+    bases = rng.random((4, size, size), dtype=np.float32) + 0.01
+    colors = rng.random((4, 3), dtype=np.float32)
+    grain = rng.standard_normal((size, size, 3), dtype=np.float32)
+    # Every reference is the original image_generator expression, in float64
+    weights = kernels.reference_normalize_sum(bases.astype(np.float64))
+
+    reference = {
+        'pnoise_field': kernels.reference_pnoise_field(size, size, 6.0, 5, 2, 0.5, 2.0),
+        'normalize_range': kernels.reference_normalize_range(field.astype(np.float64)),
+        'normalize_sum': weights,
+        'mix': kernels.reference_mix(weights, colors.astype(np.float64), grain.astype(np.float64), 0.035),
+    }
+    # Float kernels must match closely; 8-bit output may differ by one level from rounding
+    tolerance = {'pnoise_field': 1e-6, 'normalize_range': 1e-6, 'normalize_sum': 1e-6, 'mix': 1}
+    failures = []
+    for backend in backends:
+        outputs = {
+            'pnoise_field': backend.pnoise_field(size, size, 6.0, 5, 2, 0.5, 2.0),
+            'normalize_range': backend.normalize_range(field.copy()),
+            'normalize_sum': backend.normalize_sum(bases.copy()),
+            'mix': backend.mix(weights.astype(np.float32), colors, grain, 0.035),
+        }
+        for check, output in outputs.items():
+            error = float(np.abs(output.astype(np.float64) - reference[check]).max())
+            status = 'ok' if error <= tolerance[check] else 'MISMATCH'
+            print(f"{backend.name:<6} {check:<16} max error {error:.2e}  {status}")
+            if status != 'ok':
+                failures.append(f"{backend.name}.{check}")
+    return failures
+
+def load_baseline(path: Path) -> dict:
+    if not path.exists():
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f).get('results', {})
+
+def save_baseline(path: Path, results: dict):
+    path.parent.mkdir(exist_ok=True)
+    data = {
+        'machine': platform.platform(),
+        'python': platform.python_version(),
+        'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print(f"Baseline written to {path}")
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Stages whose best time is more than threshold slower than the baseline's"""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result['min'] / baseline[key]['min']
+        status = 'REGRESSION' if ratio > 1 + threshold else 'ok'
+        print(f"{key:<28} {ratio:6.2f}x baseline  {status}")
+        if status != 'ok':
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Render pipeline benchmarks')
+    parser.add_argument('--resolutions', default='540,1080', help='Comma-separated square sizes to render')
+    parser.add_argument('--stages', default=None, help='Comma-separated subset of stages to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage; the fastest is compared')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before failing (0.2 = 20%%)')
+    parser.add_argument('--baseline', default=str(BASELINE_FILE), help='Baseline JSON file')
+    parser.add_argument('--update-baseline', action='store_true', help='Record these results as the new baseline')
+    parser.add_argument('--kernels', choices=['numpy', 'numba'], default=None,
+                        help='Kernel backend to time (default: RENDER_KERNELS, else Numba when installed)')
+    parser.add_argument('--parity', action='store_true', help='Check the kernel backends against the reference and exit')
+    parser.add_argument('--parity-size', type=int, default=256, help='Square size used by --parity')
+    args = parser.parse_args()
+
+    if args.parity:
+        failures = check_parity(args.parity_size)
+        if failures:
+            print(f"\nParity check failed: {', '.join(failures)}")
+            return 1
+        print("\nAll kernels match the reference")
+        return 0
+    if args.kernels:
+        os.environ['RENDER_KERNELS'] = args.kernels
+    print(f"Kernels: {kernels.get().name}")
+
+    resolutions = [int(size) for size in args.resolutions.split(',')]
+    stages = args.stages.split(',') if args.stages else STAGES
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(resolutions, stages, args.repeat)
+    baseline_path = Path(args.baseline)
+    baseline = load_baseline(baseline_path)
+
+    if args.update_baseline or not baseline:
+        if not baseline:
+            print("No baseline found, recording this run as the baseline")
+        save_baseline(baseline_path, {**baseline, **results})
+        return 0
+
+    print()
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import random
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger('CaptionEngine')
+
+# Instagram ignores everything past 30 hashtags and truncates captions beyond 2200 characters
+MAX_HASHTAGS = 30
+MAX_CAPTION = 2200
+
+FIELD_HASHTAGS = {
+    'physics': ['#physics', '#quantumphysics', '#astrophysics', '#theoreticalphysics', '#physicsfun',
+                '#relativity', '#particlephysics', '#physicist'],
+    'mathematics': ['#mathematics', '#math', '#maths', '#mathematician', '#numbertheory', '#geometry',
+                    '#mathisfun', '#puremath'],
+    'chemistry': ['#chemistry', '#chemist', '#organicchemistry', '#periodictable', '#molecules',
+                  '#chemistrylab', '#elements'],
+    'biology': ['#biology', '#evolution', '#genetics', '#naturalhistory', '#lifescience', '#biologist',
+                '#dna'],
+    'astronomy': ['#astronomy', '#cosmos', '#space', '#universe', '#stargazing', '#astronomer',
+                  '#cosmology', '#galaxy'],
+    'computer_science': ['#computerscience', '#programming', '#coding', '#algorithms', '#softwareengineering',
+                         '#computing', '#developer', '#artificialintelligence'],
+    'engineering': ['#engineering', '#engineer', '#innovation', '#design', '#technology', '#invention',
+                    '#mechanicalengineering'],
+    'science': ['#science', '#scientist', '#research', '#discovery', '#curiosity', '#scientificmethod',
+                '#stem', '#knowledge'],
+}
+
+# Added to every post, rotated like the rest
+GENERAL_HASHTAGS = ['#quotes', '#sciencequotes', '#quoteoftheday', '#inspiration', '#wisdom', '#thinkdeep',
+                    '#learning', '#education', '#philosophy', '#motivation', '#dailyquotes', '#mindset']
+
+# Authors the bot quotes often: their field and their own tags
+AUTHORS = {
+    'albert einstein': ('physics', ['#einstein', '#alberteinstein']),
+    'richard feynman': ('physics', ['#feynman', '#richardfeynman']),
+    'niels bohr': ('physics', ['#nielsbohr']),
+    'isaac newton': ('physics', ['#isaacnewton', '#newton']),
+    'max planck': ('physics', ['#maxplanck']),
+    'werner heisenberg': ('physics', ['#heisenberg']),
+    'erwin schrödinger': ('physics', ['#schrodinger']),
+    'paul dirac': ('physics', ['#pauldirac']),
+    'stephen hawking': ('physics', ['#stephenhawking', '#hawking']),
+    'nikola tesla': ('engineering', ['#nikolatesla', '#tesla']),
+    'marie curie': ('chemistry', ['#mariecurie', '#womeninscience']),
+    'rosalind franklin': ('chemistry', ['#rosalindfranklin', '#womeninscience']),
+    'linus pauling': ('chemistry', ['#linuspauling']),
+    'dmitri mendeleev': ('chemistry', ['#mendeleev']),
+    'charles darwin': ('biology', ['#charlesdarwin', '#darwin']),
+    'carl sagan': ('astronomy', ['#carlsagan', '#sagan']),
+    'galileo galilei': ('astronomy', ['#galileo']),
+    'johannes kepler': ('astronomy', ['#kepler']),
+    'vera rubin': ('astronomy', ['#verarubin', '#womeninscience']),
+    'carl friedrich gauss': ('mathematics', ['#gauss']),
+    'leonhard euler': ('mathematics', ['#euler']),
+    'srinivasa ramanujan': ('mathematics', ['#ramanujan']),
+    'henri poincaré': ('mathematics', ['#poincare']),
+    'david hilbert': ('mathematics', ['#hilbert']),
+    'emmy noether': ('mathematics', ['#emmynoether', '#womeninscience']),
+    'alan turing': ('computer_science', ['#alanturing', '#turing']),
+    'ada lovelace': ('computer_science', ['#adalovelace', '#womeninstem']),
+    'grace hopper': ('computer_science', ['#gracehopper', '#womeninstem']),
+    'edsger w. dijkstra': ('computer_science', ['#dijkstra']),
+    'donald knuth': ('computer_science', ['#donaldknuth']),
+}
+
+# Used when the author isn't in AUTHORS: the field whose words appear most in the quote
+FIELD_KEYWORDS = {
+    'physics': ('physics', 'energy', 'quantum', 'particle', 'light', 'gravity', 'relativity', 'atom',
+                'force', 'motion', 'time', 'mass'),
+    'mathematics': ('mathematic', 'number', 'proof', 'theorem', 'equation', 'geometry', 'infinity',
+                    'infinite', 'algebra', 'calculus'),
+    'chemistry': ('chemi', 'molecule', 'element', 'reaction', 'compound', 'bond'),
+    'biology': ('life', 'evolution', 'species', 'cell', 'gene', 'organism', 'nature'),
+    'astronomy': ('star', 'universe', 'cosmos', 'galaxy', 'planet', 'sky', 'space'),
+    'computer_science': ('computer', 'program', 'software', 'algorithm', 'machine', 'code', 'computing'),
+    'engineering': ('engineer', 'design', 'build', 'invent', 'technology'),
+}
+
+TEMPLATES = [
+    "“{quote}”\n— {author}\n\n{reflection}\n\n{call_to_action}\n\n{hashtags}",
+    "{reflection}\n\n“{quote}” — {author}\n\n{call_to_action}\n\n{hashtags}",
+    "“{quote}”\n\n{author} on {topic}. {reflection}\n\n{call_to_action}\n.\n.\n.\n{hashtags}",
+]
+
+# {quotes} is the numbered list of every quote in the carousel
+CAROUSEL_TEMPLATES = [
+    "{quotes}\n\n{reflection}\n\n{call_to_action}\n\n{hashtags}",
+    "{count} thoughts on {topic}, swipe through.\n\n{quotes}\n\n{reflection}\n\n{call_to_action}\n.\n.\n.\n{hashtags}",
+]
+
+REFLECTIONS = {
+    'physics': ["Physics rewards the patient observer: the simplest questions hide the deepest laws.",
+                "Every law of nature started as someone refusing to accept 'that's just how it is'."],
+    'mathematics': ["Mathematics is where certainty lives, and where it is hardest won.",
+                    "Behind every elegant proof is a long list of ideas that didn't work."],
+    'chemistry': ["Everything you touch is chemistry, quietly rearranging itself.",
+                  "The periodic table is a map drawn by centuries of careful doubt."],
+    'biology': ["Life is the universe's most intricate experiment, still running.",
+                "Every living thing carries a history billions of years long."],
+    'astronomy': ["Look up: the light reaching you tonight left its star long before you were born.",
+                  "The cosmos is vast, and yet we can measure it from a small blue dot."],
+    'computer_science': ["Every program is an argument with a very literal machine.",
+                         "Computation turned logic into something you can run."],
+    'engineering': ["Engineering is science with a deadline and consequences.",
+                    "Ideas become real only when someone works out how to build them."],
+    'science': ["Science is less a body of facts than a way of asking better questions.",
+                "Curiosity, tested carefully, is the most powerful tool we have."],
+}
+
+CALLS_TO_ACTION = [
+    "What does this mean to you? Tell us in the comments.",
+    "Save this for the next time you need perspective, and share it with a curious friend.",
+    "Agree or disagree? Let's discuss below.",
+    "Follow for a daily dose of science and wonder.",
+    "Tag someone who needs to read this today.",
+]
+
+TOPICS = {
+    'physics': 'the laws of nature', 'mathematics': 'mathematics', 'chemistry': 'the nature of matter',
+    'biology': 'life', 'astronomy': 'the cosmos', 'computer_science': 'computation',
+    'engineering': 'building things', 'science': 'science',
+}
+
+class CaptionEngine:
+    """Composes Instagram captions locally from templates and a hashtag index
+
+    Gemini only supplies the quote and author. The field is looked up from the
+    author, or guessed from the quote's words, and picks the reflection and most
+    hashtags. Within each pool the least recently used hashtags are chosen, so
+    consecutive posts don't repeat the same set; usage is kept in history/.
+
+    A `describe(quote, author)` callable, when given, writes the reflection
+    instead (the rich captions option); if it fails the local one is used.
+    """
+    def __init__(self, state_file: str = None, hashtag_count: int = None, describe=None):
+        self.state_file = Path(state_file) if state_file else Path(__file__).parent.parent / "history" / "caption_state.json"
+        self.state_file.parent.mkdir(exist_ok=True)
+        self.hashtag_count = min(int(hashtag_count or os.getenv('CAPTION_HASHTAGS', 15)), MAX_HASHTAGS)
+        self.describe = describe
+        # Accounts post concurrently and share the rotation
+        self._lock = threading.Lock()
+        self._state = self._load()
+
+    def _load(self) -> dict:
+        if not self.state_file.exists():
+            return {'posts': 0, 'hashtags': {}, 'templates': {}}
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read caption state, starting fresh: {e}")
+            return {'posts': 0, 'hashtags': {}, 'templates': {}}
+
+    def _save(self):
+        tmp_path = self.state_file.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    @staticmethod
+    def field_for(quote: str, author: str) -> str:
+        """The author's field if known, otherwise the one whose keywords the quote uses most"""
+        known = AUTHORS.get(' '.join(author.lower().split()))
+        if known:
+            return known[0]
+        words = re.findall(r"[a-z]+", quote.lower())
+        scores = {
+            field: sum(word.startswith(keyword) for word in words for keyword in keywords)
+            for field, keywords in FIELD_KEYWORDS.items()
+        }
+        field = max(scores, key=scores.get)
+        return field if scores[field] else 'science'
+
+    def _least_used(self, pool: list, count: int, used: dict) -> list:
+        # Random tie-break so tags never used before don't always come out in list order
+        ranked = sorted(pool, key=lambda tag: (used.get(tag, -1), random.random()))
+        return ranked[:count]
+
+    def hashtags(self, field: str, authors: list) -> list:
+        """The post's hashtags: the authors' own, then the field's and general ones, least recently used first"""
+        used = self._state['hashtags']
+        tags = []
+        for author in authors:
+            for tag in AUTHORS.get(' '.join(author.lower().split()), (None, []))[1]:
+                if tag not in tags:
+                    tags.append(tag)
+        # Leave room for field and general tags when a carousel quotes several known authors
+        tags = tags[:self.hashtag_count // 2 if len(authors) > 1 else self.hashtag_count]
+        field_pool = [tag for tag in FIELD_HASHTAGS[field] if tag not in tags]
+        # About a third each from the field, science in general and the general pool, leaving
+        # spare tags in every pool to rotate through
+        tags += self._least_used(field_pool, -(-(self.hashtag_count - len(tags)) // 3), used)
+        if field != 'science':
+            science_pool = [tag for tag in FIELD_HASHTAGS['science'] if tag not in tags]
+            tags += self._least_used(science_pool, (self.hashtag_count - len(tags)) // 2, used)
+        general_pool = [tag for tag in GENERAL_HASHTAGS if tag not in tags]
+        tags += self._least_used(general_pool, self.hashtag_count - len(tags), used)
+        return tags
+
+    def _pick(self, kind: str, options: list) -> str:
+        """The least recently used of options, tracked under kind"""
+        used = self._state['templates']
+        index = min(range(len(options)), key=lambda i: (used.get(f"{kind}:{i}", -1), random.random()))
+        used[f"{kind}:{index}"] = self._state['posts']
+        return options[index]
+
+    def _rich_reflection(self, quote: str, author: str) -> str:
+        if not self.describe:
+            return None
+        try:
+            return (self.describe(quote, author) or '').strip() or None
+        except Exception as e:
+            logger.warning(f"Rich caption failed, using a local one: {e}")
+            return None
+
+    def _compose(self, templates: list, template_kind: str, field: str, authors: list,
+                 reflection: str, **values) -> str:
+        with self._lock:
+            self._state['posts'] += 1
+            reflection = reflection or self._pick(f"reflection:{field}", REFLECTIONS[field])
+            tags = self.hashtags(field, authors)
+            for tag in tags:
+                self._state['hashtags'][tag] = self._state['posts']
+            caption = self._pick(template_kind, templates).format(
+                topic=TOPICS[field],
+                reflection=reflection,
+                call_to_action=self._pick('call_to_action', CALLS_TO_ACTION),
+                hashtags=' '.join(tags),
+                **values,
+            )
+            try:
+                self._save()
+            except Exception as e:
+                logger.warning(f"Could not save caption state: {e}")
+        return caption[:MAX_CAPTION]
+
+    def compose(self, quote: str, author: str) -> str:
+        """A full caption for the quote, recording which hashtags and templates it used"""
+        field = self.field_for(quote, author)
+        # Outside the lock: a rich caption is an API call
+        reflection = self._rich_reflection(quote, author)
+        return self._compose(TEMPLATES, 'template', field, [author], reflection, quote=quote, author=author)
+
+    def compose_carousel(self, quotes: list) -> str:
+        """One caption for a carousel, listing every quote; counts as a single post in the rotation
+
+        The field is the one most of the quotes share (the first quote's on a tie),
+        and a rich reflection, if enabled, is written for the first quote.
+        """
+        fields = [self.field_for(quote_data['quote'], quote_data['author']) for quote_data in quotes]
+        field = max(fields, key=fields.count)
+        reflection = self._rich_reflection(quotes[0]['quote'], quotes[0]['author'])
+        quote_list = "\n".join(
+            f"{i}. “{quote_data['quote']}” — {quote_data['author']}"
+            for i, quote_data in enumerate(quotes, start=1)
+        )
+        return self._compose(CAROUSEL_TEMPLATES, 'carousel_template', field,
+                             [quote_data['author'] for quote_data in quotes], reflection,
+                             quotes=quote_list, count=len(quotes))
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+from PIL import Image
+
+# The table is built from every STEP-th pixel: backgrounds are blurred, so a
+# coarser grid gives the same region averages at a fraction of the cost
+STEP = 4
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+
+def relative_luminance(luma):
+    """Approximate WCAG relative luminance from 0-255 luma"""
+    return (np.asarray(luma, dtype=np.float64) / 255) ** 2.2
+
+_LUMINANCE = relative_luminance(np.arange(256))
+
+def contrast_ratio(color: tuple, luminance: float) -> float:
+    """WCAG contrast ratio between a text colour and a background luminance"""
+    text = float(relative_luminance(0.299 * color[0] + 0.587 * color[1] + 0.114 * color[2]))
+    lighter, darker = max(text, luminance), min(text, luminance)
+    return (lighter + 0.05) / (darker + 0.05)
+
+class ContrastEngine:
+    """Luminance statistics for any rectangle of a background in constant time
+
+    Builds summed-area tables of luminance and squared luminance once, so the mean
+    and spread behind each text line cost four lookups each. style() turns those
+    into a text colour plus, where the background behind a line is too uneven for
+    that colour alone, a shadow or a translucent scrim.
+    """
+    def __init__(self, background: Image.Image, min_ratio: float = None):
+        # Large text (55 px) needs a WCAG ratio of 3 to be readable
+        self.min_ratio = float(min_ratio if min_ratio is not None else os.getenv('CONTRAST_MIN_RATIO', 3.0))
+        self.width, self.height = background.size
+        # Sampled in C; 'L' is the same Rec. 601 luma
+        sampled = background.resize((max(self.width // STEP, 1), max(self.height // STEP, 1)), Image.NEAREST)
+        luminance = _LUMINANCE[np.asarray(sampled.convert('L'))]
+        self._sums = self._table(luminance)
+        self._squares = self._table(luminance * luminance)
+
+    @staticmethod
+    def _table(values: np.ndarray) -> np.ndarray:
+        table = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+        table[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+        return table
+
+    def _cells(self, box: tuple) -> tuple:
+        """Box in pixels to table cells, clamped to the image and at least one cell"""
+        left, top, right, bottom = box
+        rows, cols = self._sums.shape[0] - 1, self._sums.shape[1] - 1
+        x0 = min(max(int(left) // STEP, 0), cols - 1)
+        y0 = min(max(int(top) // STEP, 0), rows - 1)
+        x1 = min(max(-(-int(right) // STEP), x0 + 1), cols)
+        y1 = min(max(-(-int(bottom) // STEP), y0 + 1), rows)
+        return x0, y0, x1, y1
+
+    def _sum(self, table: np.ndarray, cells: tuple) -> float:
+        x0, y0, x1, y1 = cells
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    def stats(self, box: tuple) -> tuple:
+        """Mean and standard deviation of relative luminance inside (left, top, right, bottom)"""
+        cells = self._cells(box)
+        count = (cells[2] - cells[0]) * (cells[3] - cells[1])
+        mean = self._sum(self._sums, cells) / count
+        variance = max(self._sum(self._squares, cells) / count - mean * mean, 0.0)
+        return mean, variance ** 0.5
+
+    def color_for(self, box: tuple) -> tuple:
+        """Black or white, whichever contrasts more with the region's average"""
+        mean, _ = self.stats(box)
+        return BLACK if contrast_ratio(BLACK, mean) >= contrast_ratio(WHITE, mean) else WHITE
+
+    def _style(self, fill: tuple, mean: float, spread: float) -> dict:
+        # Black text is hurt by dark patches, white text by light ones
+        worst = mean - 2 * spread if fill == BLACK else mean + 2 * spread
+        ratio = contrast_ratio(fill, min(max(worst, 0.0), 1.0))
+        return {'fill': fill, 'shadow': None, 'scrim': None, 'ratio': ratio}
+
+    def style(self, box: tuple, preferred: tuple = None) -> dict:
+        """How to draw text over box: its fill and, if needed, a shadow or scrim colour
+
+        Contrast is judged against the unfavourable end of the box's luminance
+        (mean +/- 2 sd), so a line crossing a light and a dark blob is caught even if
+        its average is fine. The preferred fill (e.g. the colour of the rest of the
+        quote) is kept when it is readable; otherwise the other colour is used if that
+        is, and failing both the better one gets a shadow, or a scrim when even a
+        shadow wouldn't be enough.
+        """
+        mean, spread = self.stats(box)
+        preferred = preferred or self.color_for(box)
+        other = WHITE if preferred == BLACK else BLACK
+        style = self._style(preferred, mean, spread)
+        if style['ratio'] >= self.min_ratio:
+            return style
+        alternative = self._style(other, mean, spread)
+        if alternative['ratio'] >= self.min_ratio:
+            return alternative
+        style = max(style, alternative, key=lambda candidate: candidate['ratio'])
+        opposite = WHITE if style['fill'] == BLACK else BLACK
+        if style['ratio'] >= self.min_ratio / 2:
+            style['shadow'] = opposite
+        else:
+            style['scrim'] = opposite
+        return style
@@ -6,20 +6,22 @@ import json
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from metrics import timed
+import prompts
 import shutil
 
 class DatabaseSync:
-    def __init__(self):
+    def __init__(self, history_dir=None):
         load_dotenv()
         
         # Local paths
-        self.history_dir = Path(__file__).parent.parent / "history"
+        self.history_dir = Path(history_dir or Path(__file__).parent.parent / "history")
         self.history_file = self.history_dir / "chat_history.pkl"
         self.temp_backup_path = self.history_file.with_suffix('.pkl.backup')
         
-        # Supabase setup
-        self.supabase: Client = create_client(
+        # Supabase setup; imported here since the client is slow to import
+        from supabase import create_client
+        self.supabase = create_client(
             os.getenv("SUPABASE_URL"),
             os.getenv("SUPABASE_KEY")
         )
@@ -82,6 +84,12 @@ class DatabaseSync:
         except Exception as e:
             print(f"Error pushing to cloud: {e}")
 
+    def close(self):
+        """Close the Supabase client's HTTP connections"""
+        self.supabase.postgrest.aclose()
+        self.supabase.auth.close()
+
+    @timed('supabase_sync')
     def sync_databases(self):
         """Synchronize local and cloud databases"""
         local_history = self.load_local_history()
@@ -155,49 +163,13 @@ class DatabaseSync:
         except Exception as e:
             print(f"Error during pruning: {e}")
 
-    def get_model_prompt(self) -> str:
-        """Get the standard model prompt"""
-        return """You are managing an Instagram account that posts daily, aesthetic, and thought-provoking science-related quotes.        
-    Your goal is to create content that both inspires and educates, while optimizing for maximum reach and engagement. 
-    Select powerful quotes from the realms of science, computer science, physics, chemistry, or engineering—without diluting 
-    their depth or complexity to suit general audience comprehension. Let the gravity and intellectual rigor of the quotes shine through.
-    Try not to post things that do not align with your audience's interests. Grandeur, sophistication, and satisfaction 
-    are the hallmarks of a well-crafted quote.
-
-    For each quote, craft a compelling Instagram description that breaks down its essence in an engaging and relatable manner, 
-    encouraging the audience to interact and reflect. Use best practices for Instagram, such as relevant hashtags, analogies, 
-    and calls to action, to enhance visibility and connection with the audience. Do not repeat a quote that has been provided 
-    in the chat history, if provided so. Using the chat history, try not to create an author bias on the quotes,
-    feel free to use infinite quotes from a single author, BUT do not use quotes from the SAME author more than once in 6 generations to
-    keep your content fresh and engaging.
-    
-    Important: Do not include citations or references in your response. Only provide the quote, author, and Instagram description 
-    in the requested JSON format. Including anything else will lead to breaking the API constraints. STRICTLY follow the Structued Output Schema provided."""
-
     def reconstruct_history_with_prompts(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Reconstruct history with proper model prompts"""
-        model_prompt = self.get_model_prompt()
-        reconstructed_history = []
-        
-        for i, entry in enumerate(history):
-            if entry['role'] == 'model':
-                # Add the user prompt before each model response
-                reconstructed_history.append({
-                    'role': 'user',
-                    'parts': [model_prompt]
-                })
-            reconstructed_history.append(entry)
-        
-        return reconstructed_history
+        """Reconstruct history with the request turn before each model reply"""
+        return prompts.with_requests(history)
 
     def _is_prompt_entry(self, entry: Dict[str, Any]) -> bool:
-        """Check if entry contains the repetitive prompt"""
-        if entry.get('role') == 'user' and entry.get('parts'):
-            parts = entry.get('parts')
-            if isinstance(parts, list) and len(parts) > 0:
-                content = str(parts[0])
-                return "You are managing an Instagram account" in content
-        return False
+        """Check if entry is a prompt rather than content"""
+        return prompts.is_prompt_entry(entry)
 
 def main():
     sync = DatabaseSync()
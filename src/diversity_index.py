@@ -0,0 +1,117 @@
+import os
+import re
+import zlib
+import logging
+import threading
+from pathlib import Path
+import numpy as np
+
+logger = logging.getLogger('DiversityIndex')
+
+# Hashed bag of words: no vocabulary to store or grow, and collisions are rare at this size
+FEATURES = 2 ** 18
+
+STOPWORDS = frozenset("""
+    a about after all also an and any are as at be because been but by can could did do does each even
+    for from had has have he her him his how i if in into is it its just may me more most much must my
+    no nor not of on one only or other our out over own same she should so some such than that the their
+    them then there these they this those through to too under up us very was we were what when where
+    which who whom why will with would you your
+""".split())
+
+def tokens(text: str) -> list:
+    return [word for word in re.findall(r"[a-z][a-z']+", text.lower()) if word not in STOPWORDS]
+
+class DiversityIndex:
+    """TF-IDF vectors of every posted quote, for scoring how close a candidate is to recent posts
+
+    Each post is one sparse row of hashed term counts, appended as it's posted
+    and stored in history/. similarity() weights candidates and the last
+    DIVERSITY_WINDOW posts by inverse document frequency over all posts and
+    returns each candidate's highest cosine similarity, in one sparse product.
+    """
+    def __init__(self, path: str = None, window: int = None, threshold: float = None):
+        self.path = Path(path) if path else Path(__file__).parent.parent / "history" / "diversity_index.npz"
+        self.window = int(window or os.getenv('DIVERSITY_WINDOW', 30))
+        # Candidates scoring above this are only used if nothing better turns up
+        self.threshold = float(threshold if threshold is not None else os.getenv('DIVERSITY_THRESHOLD', 0.35))
+        self._rows = None
+        self._document_frequency = None
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """Load the index, or start an empty one; returns whether it already existed"""
+        from scipy import sparse
+        with self._lock:
+            if self._rows is not None:
+                return True
+            existed = self.path.exists()
+            if existed:
+                try:
+                    self._rows = sparse.load_npz(self.path).tocsr()
+                except Exception as e:
+                    logger.warning(f"Could not read diversity index, starting fresh: {e}")
+                    existed = False
+            if not existed:
+                self._rows = sparse.csr_matrix((0, FEATURES), dtype=np.float32)
+            self._document_frequency = np.bincount(self._rows.indices, minlength=FEATURES).astype(np.int32)
+            return existed
+
+    def __len__(self) -> int:
+        self.ensure()
+        return self._rows.shape[0]
+
+    @staticmethod
+    def _vectors(texts: list):
+        """Sublinear term frequencies (1 + log count) as a CSR matrix with one row per text"""
+        from scipy import sparse
+        rows = []
+        for text in texts:
+            hashed = [zlib.crc32(token.encode('utf-8')) % FEATURES for token in tokens(text)]
+            columns, counts = np.unique(np.array(hashed, dtype=np.int64), return_counts=True)
+            rows.append((columns, 1 + np.log(counts)))
+        indptr = np.cumsum([0] + [len(columns) for columns, _ in rows])
+        indices = np.concatenate([columns for columns, _ in rows]) if rows else np.empty(0, dtype=np.int64)
+        data = np.concatenate([values for _, values in rows]) if rows else np.empty(0)
+        return sparse.csr_matrix((data.astype(np.float32), indices, indptr), shape=(len(texts), FEATURES))
+
+    def add(self, texts: list):
+        """Append posted texts and save the index"""
+        from scipy import sparse
+        if not texts:
+            return
+        self.ensure()
+        vectors = self._vectors(texts)
+        with self._lock:
+            self._rows = sparse.vstack([self._rows, vectors], format='csr')
+            # A new array rather than in place, as similarity() reads it outside the lock
+            self._document_frequency = self._document_frequency + np.bincount(vectors.indices, minlength=FEATURES).astype(np.int32)
+            try:
+                # save_npz adds .npz to names without it
+                tmp_path = self.path.with_name(f".{self.path.stem}.tmp.npz")
+                sparse.save_npz(tmp_path, self._rows)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"Could not save diversity index: {e}")
+
+    @staticmethod
+    def _weighted(vectors, count: int, document_frequency: np.ndarray):
+        """TF-IDF rows scaled to unit length; idf is only computed for the columns present"""
+        from scipy import sparse
+        weighted = vectors.copy()
+        weighted.data *= (np.log((1 + count) / (1 + document_frequency[weighted.indices])) + 1).astype(np.float32)
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms) @ weighted
+
+    def similarity(self, texts: list) -> np.ndarray:
+        """Each text's highest cosine similarity to the last `window` posts (0 if there are none)"""
+        self.ensure()
+        with self._lock:
+            rows, document_frequency = self._rows, self._document_frequency
+        if not texts or rows.shape[0] == 0:
+            return np.zeros(len(texts))
+        count = rows.shape[0]
+        candidates = self._weighted(self._vectors(texts), count, document_frequency)
+        recent = self._weighted(rows[-self.window:], count, document_frequency)
+        return (candidates @ recent.T).max(axis=1).toarray().ravel()
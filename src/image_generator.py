@@ -1,56 +1,106 @@
+import io
 import os
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageEnhance
-import noise
-from colorthief import ColorThief
-import cv2
+import kernels
 from typing import Tuple, List
 import random
 import textwrap
-import requests
+import threading
 from pathlib import Path
-from scipy.ndimage import gaussian_filter
+from concurrent.futures import ThreadPoolExecutor
+from metrics import timed, capture_stages
+from noise_atlas import NoiseAtlas
+from contrast import ContrastEngine
+
+def _encode_image(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=95)
+    return buffer.getvalue()
 
 class ImageGenerator:
-    def __init__(self):
+    # Shared across instances so concurrent first renders download the font once
+    _font_lock = threading.Lock()
+
+    # Output sizes (width, height) that render_variants can produce from one background
+    FORMATS = {
+        'feed': (1080, 1080),
+        'portrait': (1080, 1350),
+        'story': (1080, 1920),
+    }
+
+    def __init__(self, history_dir: str = None):
         self.WIDTH = 1080
         self.HEIGHT = 1080
         self.SIDE_PADDING = 130
         self.FONT_SIZE = 55
         self.LINE_BREAK = 55  # Line break height between quote and author
         self.LINE_SPACING = 20  # Adding new line spacing between quote lines
+        self.SHADOW_OFFSET = 2  # Shadow offset for lines over uneven backgrounds
+        self.SCRIM_PADDING = 12
+        self.SCRIM_OPACITY = 110  # Out of 255
         
         # Create fonts directory in the project root
         self.fonts_dir = Path(os.path.dirname(os.path.dirname(__file__))) / "fonts"
         self.fonts_dir.mkdir(exist_ok=True)
         
         self.font_path = self.fonts_dir / "PlayfairDisplay-Regular.ttf"
-        
-        # Download font if not exists
-        if not self.font_path.exists():
-            print("Downloading Playfair Display font...")
-            font_url = "https://cloud-bi14k3e70-hack-club-bot.vercel.app/0playfairdisplay-regular.ttf"
-            response = requests.get(font_url)
-            if response.status_code == 200:
-                self.font_path.write_bytes(response.content)
-                print("Font downloaded successfully!")
-            else:
-                raise Exception("Failed to download font!")
-
-    def generate_blobby_gradient(self) -> Image.Image:
-        # Create base image
-        img = np.zeros((self.HEIGHT, self.WIDTH, 3), dtype=np.float32)
-        
-        # Generate 5 distinct but harmonious colors
-        base_color = np.random.randint(0, 255, 3) / 255.0
-        colors = [
+
+        # Backgrounds are cut from a shared precomputed noise atlas unless NOISE_ATLAS=0
+        self.history_dir = history_dir
+        self.noise_atlas = NoiseAtlas(history_dir=history_dir) if os.getenv('NOISE_ATLAS', '1') != '0' else None
+        self.rng = np.random.default_rng()
+
+    def ensure_font(self) -> Path:
+        """Download the font on first use; safe to call from any thread"""
+        if self.font_path.exists():
+            return self.font_path
+        with self._font_lock:
+            if not self.font_path.exists():
+                import requests
+                print("Downloading Playfair Display font...")
+                font_url = "https://cloud-bi14k3e70-hack-club-bot.vercel.app/0playfairdisplay-regular.ttf"
+                response = requests.get(font_url, timeout=30)
+                if response.status_code == 200:
+                    # Render worker processes may race for the same file, so never expose a partial one
+                    tmp_path = self.font_path.with_suffix(f'.{os.getpid()}.tmp')
+                    tmp_path.write_bytes(response.content)
+                    os.replace(tmp_path, self.font_path)
+                    print("Font downloaded successfully!")
+                else:
+                    raise Exception("Failed to download font!")
+        return self.font_path
+
+    def generate_blobby_gradient(self, width: int = None, height: int = None) -> Image.Image:
+        width = width or self.WIDTH
+        height = height or self.HEIGHT
+        # Generate 4 distinct but harmonious colors
+        colors = np.array([
             np.random.randint(0, 255, 3) / 255.0,  # Completely random first color
             np.random.randint(0, 255, 3) / 255.0,  # Completely random second color
             np.random.randint(0, 255, 3) / 255.0,  # Third color
             np.random.randint(0, 255, 3) / 255.0,  # Fourth color
             #np.random.randint(0, 255, 3) / 255.0,  # Fifth color
-        ]
+        ], dtype=np.float32)
+
+        if self.noise_atlas is not None:
+            # Pre-blurred windows from the atlas, already normalized to sum to 1
+            with timed('noise'):
+                bases = self.noise_atlas.weights(len(colors), height, width, self.rng)
+        else:
+            bases = self.generate_noise_bases(len(colors), width, height)
+
+        with timed('color_mix'):
+            # Mix colors using the normalized bases and add slightly more noticeable grain
+            grain = self.rng.standard_normal((height, width, 3), dtype=np.float32)
+            img = kernels.mix(bases, colors, grain, 0.035)
         
+        return Image.fromarray(img)
+
+    def generate_noise_bases(self, count: int, width: int, height: int) -> np.ndarray:
+        """Evaluate and blur fresh noise for every colour; the path used when NOISE_ATLAS=0"""
+        # scipy.ndimage is slow to import; only pay for it when rendering
+        from scipy.ndimage import gaussian_filter
         # Generate smoother Perlin noise with larger scale
         scale = 6.0  # Larger scale for fewer, bigger blobs
         octaves = 2  # Slightly more detail
@@ -59,63 +109,29 @@ class ImageGenerator:
         
         # Generate multiple noise layers for color mixing
         bases = []
-        for i in range(len(colors)):
-            base = np.zeros((self.HEIGHT, self.WIDTH))
-            for y in range(self.HEIGHT):
-                for x in range(self.WIDTH):
-                    noise_val = noise.pnoise2(x/self.WIDTH * scale + i*5, 
-                                           y/self.HEIGHT * scale + i*5, 
-                                           octaves=octaves,
-                                           persistence=persistence,
-                                           lacunarity=lacunarity,
-                                           repeatx=self.WIDTH,
-                                           repeaty=self.HEIGHT)
-                    base[y][x] = noise_val
+        for i in range(count):
+            with timed('noise'):
+                base = kernels.pnoise_field(width, height, scale, i*5,
+                                            octaves=octaves,
+                                            persistence=persistence,
+                                            lacunarity=lacunarity)
             
             # Normalize to 0-1
-            base = (base - base.min()) / (base.max() - base.min())
+            base = kernels.normalize_range(base)
             # Apply gaussian blur for smooth transitions
-            base = gaussian_filter(base, sigma=30)  # Reduced blur
+            with timed('blur'):
+                base = gaussian_filter(base, sigma=30)  # Reduced blur
             bases.append(base)
         
         # Normalize all bases to sum to 1 at each pixel
-        bases = np.array(bases)
-        bases_sum = np.sum(bases, axis=0)
-        bases = bases / bases_sum[np.newaxis, :, :]
-        
-        # Mix colors using the normalized bases
-        for i in range(3):  # RGB channels
-            for j in range(len(colors)):
-                img[:,:,i] += colors[j][i] * bases[j]
-        
-        # Add slightly more noticeable grain
-        grain = np.random.normal(0, 0.035, img.shape)  # Increased grain
-        img = np.clip(img + grain, 0, 1)
-        
-        # Convert to uint8
-        img = (img * 255).astype(np.uint8)
-        
-        return Image.fromarray(img)
+        return kernels.normalize_sum(np.array(bases, dtype=np.float32))
 
     def get_contrast_color(self, background: Image.Image) -> Tuple[int, int, int]:
-        # Convert to numpy array for easier processing
-        img_array = np.array(background)
-        
-        # Calculate average color of the center region
-        center_region = img_array[self.HEIGHT//3:2*self.HEIGHT//3, 
-                                self.WIDTH//3:2*self.WIDTH//3]
-        avg_color = np.mean(center_region, axis=(0, 1))
-        
-        # Calculate perceived brightness
-        brightness = (0.299 * avg_color[0] + 0.587 * avg_color[1] + 0.114 * avg_color[2])
-        
-        # Choose white or black based on background brightness
-        if brightness > 128:
-            return (0, 0, 0)  # Black for light backgrounds
-        else:
-            return (255, 255, 255)  # White for dark backgrounds
+        """Black or white for text over the centre third of the background"""
+        width, height = background.size
+        return ContrastEngine(background).color_for((width//3, height//3, 2*width//3, 2*height//3))
 
-    def create_quote_image(self, quote: str, author: str) -> str:
+    def format_quote(self, quote: str, author: str) -> Tuple[str, str]:
         # Ensure quote has quotes and period
         if not quote.startswith('"'):
             quote = f'"{quote}'
@@ -127,23 +143,23 @@ class ImageGenerator:
         # Ensure author ends with period
         if not author.endswith('.'):
             author = f"~ {author}."
+        return quote, author
 
-        # Create background
-        background = self.generate_blobby_gradient()
+    @timed('text_layout')
+    def draw_quote(self, background: Image.Image, quote: str, author: str, text_color=None) -> Image.Image:
+        """Lay out and draw an already formatted quote and author onto the background"""
         draw = ImageDraw.Draw(background)
         
-        # Get contrasting text color
-        text_color = self.get_contrast_color(background)
-        
         # Load font
-        font = ImageFont.truetype(str(self.font_path), self.FONT_SIZE)
+        font = ImageFont.truetype(str(self.ensure_font()), self.FONT_SIZE)
         
         # Wrap text
         quote_lines = textwrap.wrap(quote, width=30)
         
         # Calculate maximum line width
         max_line_width = max(font.getbbox(line)[2] - font.getbbox(line)[0] for line in quote_lines)
-        right_padding = self.WIDTH - (self.SIDE_PADDING + max_line_width)
+        width, height = background.size
+        right_padding = width - (self.SIDE_PADDING + max_line_width)
         
         # Calculate heights
         line_heights = [font.getbbox(line)[3] - font.getbbox(line)[1] for line in quote_lines]
@@ -152,26 +168,146 @@ class ImageGenerator:
         total_height = quote_height + self.LINE_BREAK + author_height
         
         # Calculate starting y position to center text block vertically
-        current_y = (self.HEIGHT - total_height) // 2
+        current_y = (height - total_height) // 2
         
-        # Draw quote
+        # Position every quote line, then the author after the line break
+        placements = []
         for line in quote_lines:
             bbox = font.getbbox(line)
-            draw.text((self.SIDE_PADDING, current_y), line, 
-                    fill=text_color, font=font)
+            placements.append((line, current_y))
             current_y += (bbox[3] - bbox[1]) + self.LINE_SPACING  # Add spacing after each line
-        
-        # Add line break
         current_y += self.LINE_BREAK - (bbox[3] - bbox[1]) // 2
+        placements.append((author, current_y))
         
-        # Draw author
-        draw.text((self.SIDE_PADDING, current_y), author, 
-                fill=text_color, font=font)
+        if text_color is not None:
+            for line, y in placements:
+                draw.text((self.SIDE_PADDING, y), line, fill=text_color, font=font)
+        else:
+            # Pick a colour for the whole block, then check it against what is behind each line
+            engine = ContrastEngine(background)
+            boxes = [self._line_box(font, line, y) for line, y in placements]
+            block_color = engine.color_for((
+                min(box[0] for box in boxes), boxes[0][1],
+                max(box[2] for box in boxes), boxes[-1][3]))
+            for (line, y), box in zip(placements, boxes):
+                style = engine.style(box, block_color)
+                if style['scrim']:
+                    self._draw_scrim(background, box, style['scrim'])
+                if style['shadow']:
+                    draw.text((self.SIDE_PADDING + self.SHADOW_OFFSET, y + self.SHADOW_OFFSET), line,
+                              fill=style['shadow'], font=font)
+                draw.text((self.SIDE_PADDING, y), line, fill=style['fill'], font=font)
         
         # Log calculated right padding for debugging
         print(f"Calculated right padding: {right_padding}")
+        return background
+
+    def _line_box(self, font, line: str, y: int) -> tuple:
+        left, top, right, bottom = font.getbbox(line)
+        return (self.SIDE_PADDING + left, y + top, self.SIDE_PADDING + right, y + bottom)
+
+    def _draw_scrim(self, background: Image.Image, box: tuple, color: tuple):
+        """Translucent panel behind a line whose background is too uneven for the text alone"""
+        pad = self.SCRIM_PADDING
+        left, top, right, bottom = box
+        region = (max(left - pad, 0), max(top - pad, 0),
+                  min(right + pad, background.width), min(bottom + pad, background.height))
+        size = (region[2] - region[0], region[3] - region[1])
+        background.paste(color, region, Image.new('L', size, self.SCRIM_OPACITY))
+
+    def render(self, quote: str, author: str) -> Image.Image:
+        quote, author = self.format_quote(quote, author)
+
+        # Create background
+        background = self.generate_blobby_gradient()
+        self.draw_quote(background, quote, author)
+        return background
+
+    def encode(self, image: Image.Image, fmt: str = "PNG") -> bytes:
+        """Encode in memory, so the image can go straight into the upload request"""
+        with timed('encode'):
+            return _encode_image(image, fmt)
+
+    def render_variants(self, quote: str, author: str, formats=None) -> dict:
+        """Render several output sizes of one quote from a single shared background
+
+        The background is generated once at the largest extent and each format gets a
+        centred crop of it with the text laid out again for its height.
+        """
+        formats = formats or list(self.FORMATS)
+        quote, author = self.format_quote(quote, author)
+        sizes = {name: self.FORMATS[name] for name in formats}
+        field = self.generate_blobby_gradient(
+            max(width for width, _ in sizes.values()),
+            max(height for _, height in sizes.values()))
+        variants = {}
+        for name, (width, height) in sizes.items():
+            left = (field.width - width) // 2
+            top = (field.height - height) // 2
+            background = field.crop((left, top, left + width, top + height))
+            variants[name] = self.draw_quote(background, quote, author)
+        return variants
+
+    def encode_variants(self, variants: dict, fmt: str = "PNG") -> dict:
+        """Encode every variant at once; Pillow releases the GIL while compressing"""
+        with timed('encode'), ThreadPoolExecutor(max_workers=len(variants)) as executor:
+            encoded = list(executor.map(lambda image: _encode_image(image, fmt), variants.values()))
+        return dict(zip(variants, encoded))
+
+    def create_quote_image(self, quote: str, author: str) -> str:
+        """Render and save to output_XXXX.png in the working directory"""
+        background = self.render(quote, author)
         
         # Save image
         output_path = f"output_{random.randint(1000, 9999)}.png"
-        background.save(output_path, "PNG", quality=95)
+        with timed('encode'):
+            background.save(output_path, "PNG", quality=95)
         return output_path
+
+# One generator per worker process, created on first use
+_process_generator = None
+# Set by init_worker, since spawned workers don't inherit the parent's settings
+_worker_history_dir = None
+
+def init_worker(history_dir: str = None):
+    """Render pool initializer: remember where this worker's generator keeps its state"""
+    global _worker_history_dir
+    _worker_history_dir = history_dir
+
+def _worker_generator() -> ImageGenerator:
+    global _process_generator
+    if _process_generator is None:
+        _process_generator = ImageGenerator(history_dir=_worker_history_dir)
+    return _process_generator
+
+def warm_up_worker() -> int:
+    """Create this worker's generator and load its imports, kernels, font and noise atlas ahead of the first render"""
+    generator = _worker_generator()
+    generator.ensure_font()
+    kernels.warm_up()
+    if generator.noise_atlas is not None:
+        generator.noise_atlas.ensure()
+    else:
+        from scipy.ndimage import gaussian_filter
+    return os.getpid()
+
+def render_quote_image(quote: str, author: str) -> tuple:
+    """Render a quote image; a picklable entry point for process-pool workers
+
+    Returns the encoded PNG bytes, the stage timings recorded while rendering and the
+    worker's PID, so the parent can fold timings from other processes into its metrics.
+    Nothing is written to disk.
+    """
+    generator = _worker_generator()
+    with capture_stages() as observations:
+        image = generator.render(quote, author)
+        png = generator.encode(image)
+    return png, observations, os.getpid()
+
+def render_quote_variants(quote: str, author: str, formats=None) -> tuple:
+    """Like render_quote_image, but returns a dict of format name to PNG bytes for every format"""
+    generator = _worker_generator()
+    with capture_stages() as observations:
+        variants = generator.render_variants(quote, author, formats)
+        pngs = generator.encode_variants(variants)
+    return pngs, observations, os.getpid()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Import-time report for the bot and its CLI tools
+
+Imports each entry point in a fresh interpreter under `python -X importtime`
+and lists its total import time and the slowest modules it pulled in.
+
+    python import_report.py                      # every entry point
+    python import_report.py main --top 25        # one module in more depth
+    python import_report.py --budget 500         # exit 1 if any entry point takes over 500 ms
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ENTRY_POINTS = ['main', 'token_manager', 'db_cli', 'db_sync', 'test_generation', 'benchmark']
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+def measure(module: str) -> list:
+    """(self_us, cumulative_us, depth, name) for every import made by `import module`"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            imports.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return imports
+
+def report(module: str, top: int) -> float:
+    imports = measure(module)
+    # The entry point is the last top-level line; the lines just before it with
+    # depth > 0 are its subtree, anything earlier is interpreter startup
+    end = max(i for i, entry in enumerate(imports) if entry[2] == 0 and entry[3] == module)
+    start = end
+    while start > 0 and imports[start - 1][2] > 0:
+        start -= 1
+    total = imports[end][1]
+    print(f"{module}: {total / 1000:.0f} ms")
+    children = sorted((entry for entry in imports[start:end] if entry[2] == 1),
+                      key=lambda entry: entry[1], reverse=True)
+    for _, cumulative, _, name in children[:top]:
+        print(f"    {cumulative / 1000:8.1f} ms  {name}")
+    return total / 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='Report import time per entry point')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS, help='Modules to import (default: all entry points)')
+    parser.add_argument('--top', type=int, default=8, help='Slowest imports to list per module')
+    parser.add_argument('--budget', type=float, default=None, help='Fail if any module takes longer than this many ms')
+    args = parser.parse_args()
+
+    over_budget = []
+    for module in args.modules:
+        try:
+            total = report(module, args.top)
+        except RuntimeError as e:
+            print(e)
+            over_budget.append(module)
+            continue
+        if args.budget is not None and total > args.budget:
+            over_budget.append(module)
+        print()
+
+    if over_budget:
+        print(f"Over budget or failed: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
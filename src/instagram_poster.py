@@ -7,16 +7,50 @@ import logging
 import tempfile
 import urllib.parse
 from datetime import datetime, timezone
+from metrics import count_api_call, RETRIES
 
 class InstagramPoster:
-    def __init__(self):
-        print("Initializing Instagram Graph API client...")
-        self.access_token = os.getenv("INSTAGRAM_ACCESS_TOKEN")
+    # Instagram allows 20 API-published posts per account in a rolling 24 hours
+    PUBLISHING_LIMIT = 20
+    # Carousels take between 2 and 10 items
+    CAROUSEL_MIN_ITEMS = 2
+    CAROUSEL_MAX_ITEMS = 10
+
+    def __init__(self, instagram_account_id: str = None, access_token: str = None,
+                 session: requests.Session = None, name: str = "default", quota=None):
+        print(f"Initializing Instagram Graph API client for account '{name}'...")
+        self.name = name
+        self.access_token = access_token or os.getenv("INSTAGRAM_ACCESS_TOKEN")
         self.app_id = os.getenv("META_APP_ID")
         self.app_secret = os.getenv("META_APP_SECRET")
-        self.instagram_account_id = os.getenv("INSTAGRAM_ACCOUNT_ID")
+        self.instagram_account_id = instagram_account_id or os.getenv("INSTAGRAM_ACCOUNT_ID")
         self.api_version = "v21.0"
-        self.base_url = f"https://graph.facebook.com/{self.api_version}"
+        # Overridable so the bot can be pointed at a local stand-in (see load_harness.py)
+        self.graph_url = (os.getenv("GRAPH_API_URL") or "https://graph.facebook.com").rstrip('/')
+        self.imgbb_url = os.getenv("IMGBB_UPLOAD_URL") or "https://api.imgbb.com/1/upload"
+        self.base_url = f"{self.graph_url}/{self.api_version}"
+        # Seconds between container status polls
+        self.poll_interval = float(os.getenv("CONTAINER_POLL_INTERVAL", 5))
+        # A shared session lets several accounts reuse one HTTP connection pool
+        self.session = session or requests.Session()
+        # Last known publishing quota usage, refreshed on every credential check
+        self.quota_usage = None
+        # A successful credential check is three Graph calls, so it is reused for
+        # CREDENTIAL_CHECK_TTL_SECONDS across a slot's warm-up, publish and retries
+        self.credential_ttl = float(os.getenv("CREDENTIAL_CHECK_TTL_SECONDS", 900))
+        self._validated_at = None
+        # Optional QuotaAccountant that records publishes locally
+        self.quota = quota
+
+    def _request(self, method: str, service: str, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """Send a request through the shared session, counting it by service, endpoint and status"""
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            count_api_call(service, endpoint, 'error')
+            raise
+        count_api_call(service, endpoint, response.status_code)
+        return response
 
     def exchange_token(self, short_lived_token: str = None) -> str:
         """Exchange a short-lived token for a long-lived one"""
@@ -25,7 +59,7 @@ class InstagramPoster:
         
         token_to_exchange = short_lived_token or self.access_token
         
-        url = f"https://graph.facebook.com/{self.api_version}/oauth/access_token"
+        url = f"{self.base_url}/oauth/access_token"
         params = {
             'grant_type': 'fb_exchange_token',
             'client_id': self.app_id,
@@ -33,24 +67,33 @@ class InstagramPoster:
             'fb_exchange_token': token_to_exchange
         }
         
-        response = requests.get(url, params=params)
+        response = self._request('GET', 'graph', 'oauth_access_token', url, params=params)
         if response.status_code != 200:
             raise Exception(f"Failed to exchange token: {response.text}")
             
         data = response.json()
         return data.get('access_token')
 
+    def swap_access_token(self, token: str):
+        """Use a new access token from the next request on
+        
+        Requests read self.access_token when they are built, so requests already in
+        flight finish with the old token, which stays valid after a refresh.
+        """
+        self.access_token = token
+        self._validated_at = None
+
     def get_token_info(self, token: str = None) -> dict:
         """Get information about an access token"""
         token_to_check = token or self.access_token
         
-        url = f"https://graph.facebook.com/debug_token"
+        url = f"{self.graph_url}/debug_token"
         params = {
             'input_token': token_to_check,
             'access_token': f"{self.app_id}|{self.app_secret}"
         }
         
-        response = requests.get(url, params=params)
+        response = self._request('GET', 'graph', 'debug_token', url, params=params)
         if response.status_code != 200:
             raise Exception(f"Failed to get token info: {response.text}")
             
@@ -76,32 +119,46 @@ class InstagramPoster:
             print(f"Error checking token validity: {str(e)}")
             return False
 
-    def upload_to_imgbb(self, image_path: str) -> str:
-        """Upload image to imgbb and return the URL"""
+    def upload_to_imgbb(self, image) -> str:
+        """Upload an image to imgbb and return the URL
+        
+        Takes a file path or the encoded image itself (bytes, memoryview or BytesIO),
+        which is sent straight from memory.
+        """
         imgbb_key = os.getenv("IMGBB_API_KEY")
         if not imgbb_key:
             raise Exception("IMGBBB_API_KEY environment variable is required")
         
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, 'rb') as image_file:
+                data = image_file.read()
+        elif hasattr(image, 'getbuffer'):
+            data = image.getbuffer()
+        else:
+            data = image
+        
         print("Uploading image to temporary hosting...")
-        with open(image_path, 'rb') as image_file:
-            files = {'image': image_file}
-            response = requests.post(
-                'https://api.imgbb.com/1/upload',
-                params={'key': imgbb_key, 'expiration': 600},
-                files=files
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to upload to imgbb: {response.text}")
+        files = {'image': ('quote.png', data, 'image/png')}
+        response = self._request(
+            'POST', 'imgbb', 'upload',
+            self.imgbb_url,
+            params={'key': imgbb_key, 'expiration': 600},
+            files=files
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to upload to imgbb: {response.text}")
+        
+        result = response.json()
+        if not result.get('success'):
+            raise Exception(f"imgbb upload failed: {result}")
             
-            data = response.json()
-            if not data.get('success'):
-                raise Exception(f"imgbb upload failed: {data}")
-                
-            return data['data']['url']
+        return result['data']['url']
         
     def validate_credentials(self):
-        """Validate credentials and check publishing limit"""
+        """Validate credentials and check publishing limit, reusing a recent successful check"""
+        if self._validated_at is not None and time.monotonic() - self._validated_at < self.credential_ttl:
+            return True
         try:
             print("Validating Instagram Business Account credentials...")
             
@@ -116,7 +173,7 @@ class InstagramPoster:
                 'access_token': self.access_token
             }
             
-            response = requests.get(url, params=params)
+            response = self._request('GET', 'graph', 'account', url, params=params)
             if response.status_code != 200:
                 raise Exception(f"API validation failed: {response.text}")
                 
@@ -124,26 +181,69 @@ class InstagramPoster:
             print(f"Successfully validated Instagram Business Account: {account_info.get('username')}")
             
             # Check publishing limit
-            limit_url = f"{self.base_url}/{self.instagram_account_id}/content_publishing_limit"
-            params = {
-                'fields': 'config,quota_usage',
-                'access_token': self.access_token
-            }
-            
-            limit_response = requests.get(limit_url, params=params)
-            if limit_response.status_code == 200:
-                limit_data = limit_response.json().get('data', [{}])[0]
-                quota_usage = limit_data.get('quota_usage', 0)
-                print(f"Publishing quota usage: {quota_usage}/20 posts in last 24 hours")
-                if quota_usage >= 20:
+            quota_usage = self.get_publishing_quota()
+            if quota_usage is not None:
+                print(f"Publishing quota usage: {quota_usage}/{self.PUBLISHING_LIMIT} posts in last 24 hours")
+                if quota_usage >= self.PUBLISHING_LIMIT:
                     raise Exception("Publishing quota exceeded. Please wait.")
             
+            self._validated_at = time.monotonic()
             return True
             
         except Exception as e:
             print(f"Failed to validate credentials: {str(e)}")
             return False
 
+    def wait_for_containers_ready(self, container_ids, timeout=300, interval=None):
+        """Wait for several containers at once, polling every still-pending one per round"""
+        interval = interval or self.poll_interval
+        pending = list(container_ids)
+        start_time = time.time()
+        while time.time() - start_time < timeout:
+            still_pending = []
+            for container_id in pending:
+                status_code, status = self.check_container_status(container_id)
+                if status_code in ['ERROR', 'EXPIRED']:
+                    raise Exception(f"Container {container_id} failed: {status}")
+                if status_code != 'FINISHED':
+                    still_pending.append(container_id)
+            
+            if not still_pending:
+                return True
+            
+            print(f"Waiting on {len(still_pending)}/{len(container_ids)} containers...")
+            RETRIES.inc(operation='container_poll')
+            pending = still_pending
+            time.sleep(interval)
+            
+        raise Exception(f"Timeout waiting for {len(pending)} container(s) to be ready")
+
+    def get_publishing_quota(self):
+        """Fetch how many posts were published in the last 24 hours, or None if unavailable"""
+        limit_url = f"{self.base_url}/{self.instagram_account_id}/content_publishing_limit"
+        params = {
+            'fields': 'config,quota_usage',
+            'access_token': self.access_token
+        }
+        
+        limit_response = self._request('GET', 'graph', 'content_publishing_limit', limit_url, params=params)
+        if limit_response.status_code != 200:
+            return None
+        
+        limit_data = limit_response.json().get('data', [{}])[0]
+        self.quota_usage = limit_data.get('quota_usage', 0)
+        if self.quota:
+            self.quota.sync(self.name, self.quota_usage)
+        return self.quota_usage
+
+    def remaining_quota(self):
+        """Posts still allowed in the current window, based on the last known usage"""
+        if self.quota:
+            return self.quota.remaining(self.name)
+        if self.quota_usage is None:
+            return self.PUBLISHING_LIMIT
+        return max(0, self.PUBLISHING_LIMIT - self.quota_usage)
+
     def check_container_status(self, container_id):
         """Check the status of a media container"""
         url = f"{self.base_url}/{container_id}"
@@ -152,15 +252,16 @@ class InstagramPoster:
             'access_token': self.access_token
         }
         
-        response = requests.get(url, params=params)
+        response = self._request('GET', 'graph', 'container_status', url, params=params)
         if response.status_code != 200:
             raise Exception(f"Failed to check container status: {response.text}")
             
         data = response.json()
         return data.get('status_code'), data.get('status')
 
-    def wait_for_container_ready(self, container_id, timeout=300, interval=5):
+    def wait_for_container_ready(self, container_id, timeout=300, interval=None):
         """Wait for container to be ready for publishing"""
+        interval = interval or self.poll_interval
         start_time = time.time()
         while time.time() - start_time < timeout:
             status_code, status = self.check_container_status(container_id)
@@ -171,73 +272,61 @@ class InstagramPoster:
                 raise Exception(f"Container failed: {status}")
                 
             print(f"Container status: {status_code} - {status}")
+            RETRIES.inc(operation='container_poll')
             time.sleep(interval)
             
         raise Exception("Timeout waiting for container to be ready")
 
-    def post_image(self, image_path: str, caption: str) -> bool:
-        try:
-            print("\nStarting Instagram Graph API posting process...")
-            if not self.validate_credentials():
-                print("Aborting post due to credential validation failure")
-                return False
-            
-            print(f"Creating media container for image: {image_path}")
-            
-            # First upload the image to a temporary hosting service
-            image_url = self.upload_to_imgbb(image_path)
-            print(f"Image uploaded to temporary URL: {image_url}")
-            
-            # Create the media container
-            container_url = f"{self.base_url}/{self.instagram_account_id}/media"
-            
-            # Prepare the parameters
-            params = {
-                'image_url': image_url,
-                'caption': caption,
-                'access_token': self.access_token
-            }
-            
-            # Create the container
-            response = requests.post(container_url, params=params)
-            if response.status_code != 200:
-                raise Exception(f"Failed to create media container: {response.text}")
-            
-            container_data = response.json()
-            if 'id' not in container_data:
-                raise Exception(f"No container ID in response: {response.text}")
-            
-            container_id = container_data['id']
-            print(f"Created container with ID: {container_id}")
-            
-            # Wait for container to be ready
-            self.wait_for_container_ready(container_id)
-            
-            # Step 2: Publish the container
-            publish_url = f"{self.base_url}/{self.instagram_account_id}/media_publish"
-            publish_params = {
-                'creation_id': container_id,
-                'access_token': self.access_token
-            }
-            
-            publish_response = requests.post(publish_url, params=publish_params)
-            if publish_response.status_code != 200:
-                raise Exception(f"Failed to publish media: {publish_response.text}")
-            
-            media_id = publish_response.json().get('id')
-            print(f"Successfully published to Instagram. Media ID: {media_id}")
-            
-            # Clean up the image file
-            if os.path.exists(image_path):
-                print(f"Cleaning up image file: {image_path}")
-                os.remove(image_path)
-            
-            return True
-            
-        except Exception as e:
-            print(f"Failed to post to Instagram. Error: {str(e)}")
-            return False
-            
+    def create_media_container(self, image_url: str = None, caption: str = None,
+                               is_carousel_item: bool = False, children: list = None) -> str:
+        """Create a media container and return its ID
+
+        Pass image_url for a single image or carousel child, or children (a list of
+        child container IDs) for the parent carousel container.
+        """
+        container_url = f"{self.base_url}/{self.instagram_account_id}/media"
+        
+        params = {'access_token': self.access_token}
+        if children:
+            params['media_type'] = 'CAROUSEL'
+            params['children'] = ','.join(children)
+        else:
+            params['image_url'] = image_url
+        if is_carousel_item:
+            # Carousel children carry no caption of their own
+            params['is_carousel_item'] = 'true'
+        elif caption is not None:
+            params['caption'] = caption
+        
+        response = self._request('POST', 'graph', 'media', container_url, params=params)
+        if response.status_code != 200:
+            raise Exception(f"Failed to create media container: {response.text}")
+        
+        container_data = response.json()
+        if 'id' not in container_data:
+            raise Exception(f"No container ID in response: {response.text}")
+        
+        return container_data['id']
+
+    def publish_container(self, container_id: str) -> str:
+        """Publish a ready media container and return the media ID"""
+        publish_url = f"{self.base_url}/{self.instagram_account_id}/media_publish"
+        publish_params = {
+            'creation_id': container_id,
+            'access_token': self.access_token
+        }
+        
+        publish_response = self._request('POST', 'graph', 'media_publish', publish_url, params=publish_params)
+        if publish_response.status_code != 200:
+            raise Exception(f"Failed to publish media: {publish_response.text}")
+        
+        media_id = publish_response.json().get('id')
+        if self.quota_usage is not None:
+            self.quota_usage += 1
+        if self.quota:
+            self.quota.record(self.name, media_id)
+        return media_id
+
     def cleanup(self):
         """Clean up any temporary files"""
         pass  # No session files needed with Graph API
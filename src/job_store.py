@@ -0,0 +1,116 @@
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+# Ordered stages a post job moves through; each one is checkpointed
+STAGES = ['pending', 'generated', 'rendered', 'uploaded', 'container_created', 'published']
+FAILED = 'failed'
+
+# Columns holding JSON-encoded lists
+JSON_FIELDS = ('quotes', 'image_paths', 'image_hashes', 'image_urls', 'child_container_ids')
+
+class PostJobStore:
+    """Durable SQLite record of every post job and the artifacts of its completed stages
+
+    Jobs are keyed by an idempotency key (account + slot), so a slot that
+    fires twice or a worker that restarts picks up the existing job instead
+    of generating and publishing a second post.
+    """
+    def __init__(self, db_path: str = None):
+        self.db_path = Path(db_path) if db_path else Path(__file__).parent.parent / "history" / "post_jobs.db"
+        self.db_path.parent.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS post_jobs (
+                    job_key TEXT PRIMARY KEY,
+                    account TEXT NOT NULL,
+                    slot TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    quotes TEXT,
+                    caption TEXT,
+                    image_paths TEXT,
+                    image_hashes TEXT,
+                    image_urls TEXT,
+                    uploaded_at REAL,
+                    child_container_ids TEXT,
+                    container_id TEXT,
+                    media_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_post_jobs_stage ON post_jobs (stage)")
+
+    @staticmethod
+    def make_key(account: str, slot: str) -> str:
+        return f"{account}:{slot}"
+
+    @staticmethod
+    def reached(job: dict, stage: str) -> bool:
+        """Whether the job has completed the given stage"""
+        if job['stage'] == FAILED:
+            return False
+        return STAGES.index(job['stage']) >= STAGES.index(stage)
+
+    def _decode(self, row) -> dict:
+        if row is None:
+            return None
+        job = dict(row)
+        for field in JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else []
+        return job
+
+    def get(self, job_key: str) -> dict:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM post_jobs WHERE job_key = ?", (job_key,)).fetchone()
+        return self._decode(row)
+
+    def get_or_create(self, account: str, slot: str, kind: str) -> dict:
+        """Return the job for this account and slot, creating it if it doesn't exist yet"""
+        job_key = self.make_key(account, slot)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO post_jobs (job_key, account, slot, kind, stage, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                (job_key, account, slot, kind, now, now)
+            )
+            row = self._conn.execute("SELECT * FROM post_jobs WHERE job_key = ?", (job_key,)).fetchone()
+        return self._decode(row)
+
+    def update(self, job_key: str, **fields) -> dict:
+        """Persist stage changes and artifacts, returning the updated job"""
+        fields['updated_at'] = time.time()
+        for field in JSON_FIELDS:
+            if field in fields:
+                fields[field] = json.dumps(fields[field])
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE post_jobs SET {assignments} WHERE job_key = ?",
+                (*fields.values(), job_key)
+            )
+            row = self._conn.execute("SELECT * FROM post_jobs WHERE job_key = ?", (job_key,)).fetchone()
+        return self._decode(row)
+
+    def incomplete(self, max_age_seconds: float = 24 * 3600) -> list:
+        """Jobs that were started but neither published nor abandoned"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM post_jobs WHERE stage NOT IN ('published', ?) AND created_at > ? ORDER BY created_at",
+                (FAILED, cutoff)
+            ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,192 @@
+"""Inner loops of the background renderer, with an optional Numba backend
+
+Every kernel has a pure-NumPy implementation here. When Numba is installed the
+compiled versions in numba_kernels.py are used instead (RENDER_KERNELS=auto, the
+default); RENDER_KERNELS=numpy or numba forces one. Both produce the same output:
+run `python benchmark.py --parity` to check them against each other and against
+the noise library's pnoise2.
+"""
+import os
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger('Kernels')
+
+# Ken Perlin's reference permutation and the gradient set used by the noise
+# library's C pnoise2, so these kernels reproduce its output exactly
+PERMUTATION = np.array((
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140, 36, 103, 30, 69, 142,
+    8, 99, 37, 240, 21, 10, 23, 190, 6, 148, 247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117,
+    35, 11, 32, 57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71,
+    134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133, 230, 220, 105, 92, 41,
+    55, 46, 245, 40, 244, 102, 143, 54, 65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89,
+    18, 169, 200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226,
+    250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227, 47, 16, 58, 17, 182,
+    189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43,
+    172, 9, 129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97,
+    228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14, 239, 107,
+    49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138,
+    236, 205, 93, 222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180,
+) * 2, dtype=np.int64)
+
+GRADIENTS = np.array((
+    (1, 1), (-1, 1), (1, -1), (-1, -1), (1, 0), (-1, 0), (1, 0), (-1, 0),
+    (0, 1), (0, -1), (0, 1), (0, -1), (1, 0), (-1, 0), (0, -1), (0, 1),
+), dtype=np.float32)
+
+def _fade(t):
+    return t * t * t * (t * (t * np.float32(6) - np.float32(15)) + np.float32(10))
+
+def _lerp(t, a, b):
+    return a + t * (b - a)
+
+def _gradient(hashed, x, y):
+    hashed = hashed & 15
+    return x * GRADIENTS[hashed, 0] + y * GRADIENTS[hashed, 1]
+
+def _noise2(x, y, repeat_x, repeat_y):
+    """One octave of pnoise2 over float32 coordinate arrays"""
+    i = np.floor(np.fmod(x, repeat_x)).astype(np.int64)
+    j = np.floor(np.fmod(y, repeat_y)).astype(np.int64)
+    ii = np.fmod((i + 1).astype(np.float32), repeat_x).astype(np.int64) & 255
+    jj = np.fmod((j + 1).astype(np.float32), repeat_y).astype(np.int64) & 255
+    i &= 255
+    j &= 255
+    x = x - np.floor(x)
+    y = y - np.floor(y)
+    fx, fy = _fade(x), _fade(y)
+    a, b = PERMUTATION[i], PERMUTATION[ii]
+    aa, ab = PERMUTATION[a + j], PERMUTATION[a + jj]
+    ba, bb = PERMUTATION[b + j], PERMUTATION[b + jj]
+    one = np.float32(1)
+    return _lerp(fy,
+                 _lerp(fx, _gradient(PERMUTATION[aa], x, y), _gradient(PERMUTATION[ba], x - one, y)),
+                 _lerp(fx, _gradient(PERMUTATION[ab], x, y - one), _gradient(PERMUTATION[bb], x - one, y - one)))
+
+class NumpyKernels:
+    name = 'numpy'
+
+    @staticmethod
+    def pnoise_field(width: int, height: int, scale: float, offset: float, octaves: int,
+                     persistence: float, lacunarity: float) -> np.ndarray:
+        """pnoise2(x/width*scale + offset, y/height*scale + offset, repeat=width/height) for every pixel"""
+        xs = (np.arange(width) / width * scale + offset).astype(np.float32)[None, :]
+        ys = (np.arange(height) / height * scale + offset).astype(np.float32)[:, None]
+        xs, ys = np.broadcast_arrays(xs, ys)
+        total = np.zeros((height, width), dtype=np.float32)
+        frequency, amplitude, peak = np.float32(1), np.float32(1), np.float32(0)
+        for _ in range(octaves):
+            total += _noise2(xs * frequency, ys * frequency,
+                             np.float32(width) * frequency, np.float32(height) * frequency) * amplitude
+            peak += amplitude
+            frequency *= np.float32(lacunarity)
+            amplitude *= np.float32(persistence)
+        return total / peak
+
+    @staticmethod
+    def normalize_range(field: np.ndarray) -> np.ndarray:
+        """Rescale to 0-1 in place"""
+        low, high = field.min(), field.max()
+        field -= low
+        field /= high - low
+        return field
+
+    @staticmethod
+    def normalize_sum(bases: np.ndarray) -> np.ndarray:
+        """Scale the layers in place so they sum to 1 at each pixel"""
+        bases /= bases.sum(axis=0)
+        return bases
+
+    @staticmethod
+    def mix(bases: np.ndarray, colors: np.ndarray, grain: np.ndarray, grain_scale: float) -> np.ndarray:
+        """Blend one colour per layer, add grain and convert to an 8-bit RGB array"""
+        img = np.tensordot(bases, colors, axes=(0, 0))
+        img += grain * np.float32(grain_scale)
+        np.clip(img, 0, 1, out=img)
+        return (img * 255).astype(np.uint8)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get(name: str = None):
+    """The kernels for `name` ('numba' or 'numpy'), or for RENDER_KERNELS if not given"""
+    global _backend
+    if name == 'numpy':
+        return NumpyKernels
+    if name == 'numba':
+        import numba_kernels
+        return numba_kernels
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _select(os.getenv('RENDER_KERNELS', 'auto'))
+    return _backend
+
+def _select(choice: str):
+    if choice == 'numpy':
+        return NumpyKernels
+    try:
+        import numba_kernels
+    except ImportError as e:
+        if choice == 'numba':
+            raise
+        logger.info(f"Numba not available ({str(e)}), using NumPy kernels")
+        return NumpyKernels
+    return numba_kernels
+
+def warm_up() -> str:
+    """Compile or load the cached kernels now rather than during the first render"""
+    backend = get()
+    bases = np.full((2, 8, 8), 0.5, dtype=np.float32)
+    backend.normalize_range(backend.pnoise_field(8, 8, 6.0, 0.0, 2, 0.5, 2.0))
+    backend.normalize_sum(bases)
+    backend.mix(bases, np.ones((2, 3), dtype=np.float32), np.zeros((8, 8, 3), dtype=np.float32), 0.035)
+    return backend.name
+
+def pnoise_field(width: int, height: int, scale: float, offset: float, octaves: int = 1,
+                 persistence: float = 0.5, lacunarity: float = 2.0) -> np.ndarray:
+    return get().pnoise_field(width, height, scale, offset, octaves, persistence, lacunarity)
+
+def normalize_range(field: np.ndarray) -> np.ndarray:
+    return get().normalize_range(field)
+
+def normalize_sum(bases: np.ndarray) -> np.ndarray:
+    return get().normalize_sum(bases)
+
+def mix(bases: np.ndarray, colors: np.ndarray, grain: np.ndarray, grain_scale: float) -> np.ndarray:
+    return get().mix(bases, colors, grain, grain_scale)
+
+def reference_pnoise_field(width: int, height: int, scale: float, offset: float, octaves: int = 1,
+                           persistence: float = 0.5, lacunarity: float = 2.0) -> np.ndarray:
+    """The original per-pixel loop over the noise library, for parity checks only"""
+    import noise
+    field = np.zeros((height, width))
+    for y in range(height):
+        for x in range(width):
+            field[y][x] = noise.pnoise2(x/width * scale + offset,
+                                        y/height * scale + offset,
+                                        octaves=octaves,
+                                        persistence=persistence,
+                                        lacunarity=lacunarity,
+                                        repeatx=width,
+                                        repeaty=height)
+    return field
+
+def reference_normalize_range(field: np.ndarray) -> np.ndarray:
+    """The original rescale to 0-1, for parity checks only"""
+    return (field - field.min()) / (field.max() - field.min())
+
+def reference_normalize_sum(bases: np.ndarray) -> np.ndarray:
+    """The original per-pixel normalization of the layers, for parity checks only"""
+    bases_sum = np.sum(bases, axis=0)
+    return bases / bases_sum[np.newaxis, :, :]
+
+def reference_mix(bases: np.ndarray, colors: np.ndarray, grain: np.ndarray, grain_scale: float) -> np.ndarray:
+    """The original per-channel colour blend, grain and 8-bit conversion, for parity checks only"""
+    img = np.zeros((bases.shape[1], bases.shape[2], 3))
+    for i in range(3):
+        for j in range(len(colors)):
+            img[:,:,i] += colors[j][i] * bases[j]
+    img = np.clip(img + grain * grain_scale, 0, 1)
+    return (img * 255).astype(np.uint8)
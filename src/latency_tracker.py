@@ -0,0 +1,61 @@
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from collections import deque
+
+logger = logging.getLogger('LatencyTracker')
+
+# Conservative guesses (seconds) used until a stage has been measured
+DEFAULT_ESTIMATES = {
+    'generate': 30.0,
+    'render': 60.0,
+    'upload': 10.0,
+    'container': 30.0,
+}
+
+class StageLatencyTracker:
+    """Moving window of measured durations per pipeline stage, persisted across restarts"""
+    def __init__(self, window: int = 50, state_file: str = None):
+        self.window = window
+        self.state_file = Path(state_file) if state_file else Path(__file__).parent.parent / "history" / "stage_latency.json"
+        self.state_file.parent.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._samples = {}
+        for stage, samples in self._load().items():
+            self._samples[stage] = deque(samples, maxlen=self.window)
+
+    def _load(self) -> dict:
+        if not self.state_file.exists():
+            return {}
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read stage latencies, starting fresh: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = self.state_file.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({stage: list(samples) for stage, samples in self._samples.items()}, f)
+        os.replace(tmp_path, self.state_file)
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self.window)).append(round(seconds, 3))
+            self._save()
+
+    def percentile(self, stage: str, pct: float = 95) -> float:
+        """Nearest-rank percentile of the stage's recent durations"""
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if not samples:
+            return DEFAULT_ESTIMATES.get(stage, 0.0)
+        rank = max(0, min(len(samples) - 1, int(round(pct / 100 * len(samples))) - 1))
+        return samples[rank]
+
+    def lead_time(self, stages, pct: float = 95, safety: float = 1.2, margin: float = 60) -> float:
+        """Seconds to start ahead of a slot so the given stages finish before it"""
+        return sum(self.percentile(stage, pct) for stage in stages) * safety + margin
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""Offline end-to-end load harness
+
+Starts local stand-ins for Gemini, imgbb, the Instagram Graph API, Supabase and
+an alert webhook, points the bot at them and drives many slots across many fake accounts, then
+reports throughput, per-stage latency and resource use. Nothing leaves the machine.
+
+    python load_harness.py --accounts 5 --slots 20
+    python load_harness.py --accounts 10 --slots 50 --latency graph=0.3,gemini=2 --failure-rate graph=0.05
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import statistics
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SERVICES = ['gemini', 'imgbb', 'graph', 'supabase', 'alerts']
+
+# Dummy JWT-shaped key; the Supabase client rejects keys that don't look like one
+FAKE_SUPABASE_KEY = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.harness'
+
+SAMPLE_QUOTES = [
+    ("Nothing in life is to be feared, it is only to be understood", "Marie Curie"),
+    ("The important thing is not to stop questioning", "Albert Einstein"),
+    ("Somewhere, something incredible is waiting to be known", "Carl Sagan"),
+    ("What I cannot create, I do not understand", "Richard Feynman"),
+    ("Science is a way of thinking much more than it is a body of knowledge", "Carl Sagan"),
+]
+
+class FakeServices:
+    """Thread-per-request HTTP server impersonating every external API the bot calls"""
+    def __init__(self, latency: dict = None, failure_rate: dict = None, container_delay: float = 1.0):
+        self.latency = latency or {}
+        self.failure_rate = failure_rate or {}
+        self.container_delay = container_delay
+        self.lock = threading.Lock()
+        self.requests = {service: 0 for service in SERVICES}
+        self.failures = {service: 0 for service in SERVICES}
+        self.containers = {}
+        self.chat_history = []
+        self.alerts = []
+        self.counter = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-services', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self) -> dict:
+        """Environment that points the bot at this server"""
+        return {
+            'GEMINI_API_ENDPOINT': self.url,
+            'GEMINI_API_KEY': 'harness',
+            'IMGBB_UPLOAD_URL': f"{self.url}/imgbb/upload",
+            'IMGBB_API_KEY': 'harness',
+            'GRAPH_API_URL': f"{self.url}/graph",
+            'META_APP_ID': 'harness',
+            'META_APP_SECRET': 'harness',
+            'SUPABASE_URL': f"{self.url}/supabase",
+            'SUPABASE_KEY': FAKE_SUPABASE_KEY,
+            'ALERT_TRANSPORT': 'webhook',
+            'ALERT_WEBHOOK_URL': f"{self.url}/alerts",
+        }
+
+    def next_id(self, prefix: str) -> str:
+        with self.lock:
+            self.counter += 1
+            return f"{prefix}{self.counter}"
+
+    def begin(self, service: str) -> bool:
+        """Count a request, apply its latency and decide whether it should fail"""
+        with self.lock:
+            self.requests[service] += 1
+        delay = self.latency.get(service, 0)
+        if delay:
+            # Jitter so concurrent requests don't finish in lockstep
+            time.sleep(random.uniform(0.5, 1.5) * delay)
+        if random.random() < self.failure_rate.get(service, 0):
+            with self.lock:
+                self.failures[service] += 1
+            return False
+        return True
+
+    def gemini(self, handler):
+        text = json.dumps({'quotes': [{'quote': quote, 'author': author}
+                                      for quote, author in random.sample(SAMPLE_QUOTES, 3)]})
+        handler.reply(200, {
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 'STOP',
+                'index': 0,
+            }],
+            'usageMetadata': {'promptTokenCount': 1, 'candidatesTokenCount': 1, 'totalTokenCount': 2},
+        })
+
+    def imgbb(self, handler):
+        handler.reply(200, {'success': True, 'data': {'url': f"{self.url}/images/{self.next_id('img')}.png"}})
+
+    def graph(self, handler, path: str):
+        parts = path.strip('/').split('/')
+        if parts[-1] == 'debug_token':
+            handler.reply(200, {'data': {'is_valid': True, 'expires_at': int(time.time()) + 60 * 86400}})
+        elif parts[-1] == 'access_token':
+            handler.reply(200, {'access_token': 'harness', 'token_type': 'bearer', 'expires_in': 60 * 86400})
+        elif parts[-1] == 'content_publishing_limit':
+            handler.reply(200, {'data': [{'quota_usage': 0, 'config': {'quota_total': 20}}]})
+        elif parts[-1] == 'media' and handler.command == 'POST':
+            container_id = self.next_id('container')
+            with self.lock:
+                self.containers[container_id] = {'created': time.time(), 'status': 'IN_PROGRESS'}
+            handler.reply(200, {'id': container_id})
+        elif parts[-1] == 'media_publish' and handler.command == 'POST':
+            container_id = handler.form().get('creation_id')
+            with self.lock:
+                container = self.containers.get(container_id)
+                if container is None:
+                    handler.reply(400, {'error': {'message': f"Unknown container {container_id}"}})
+                    return
+                container['status'] = 'PUBLISHED'
+            handler.reply(200, {'id': self.next_id('media')})
+        elif parts[-1].startswith('container'):
+            with self.lock:
+                container = self.containers.get(parts[-1])
+            if container is None:
+                handler.reply(404, {'error': {'message': 'Unknown container'}})
+                return
+            status = container['status']
+            if status == 'IN_PROGRESS' and time.time() - container['created'] >= self.container_delay:
+                status = 'FINISHED'
+            handler.reply(200, {'status_code': status, 'status': status, 'id': parts[-1]})
+        else:
+            # Account lookups from validate_credentials
+            handler.reply(200, {'id': parts[-1], 'username': f"harness_{parts[-1]}"})
+
+    def supabase(self, handler):
+        if handler.command == 'GET':
+            with self.lock:
+                rows = list(self.chat_history)
+            handler.reply(200, rows)
+        elif handler.command == 'POST':
+            rows = json.loads(handler.body() or b'[]')
+            rows = rows if isinstance(rows, list) else [rows]
+            with self.lock:
+                for row in rows:
+                    row['id'] = len(self.chat_history) + 1
+                    self.chat_history.append(row)
+            handler.reply(201, rows)
+        else:
+            handler.reply(204, None)
+
+    def alerts_webhook(self, handler):
+        payload = json.loads(handler.body() or b'{}')
+        with self.lock:
+            self.alerts.append(payload)
+        handler.reply(204, None)
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def body(self) -> bytes:
+                if self._body is None:
+                    if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+                        self._body = self.read_chunked()
+                    else:
+                        self._body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                return self._body
+
+            def read_chunked(self) -> bytes:
+                # Streamed bodies have no Content-Length; read every chunk so the next
+                # request on this keep-alive connection starts in the right place
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+                    if size == 0:
+                        # Skip any trailers up to the blank line that ends the body
+                        while self.rfile.readline().strip():
+                            pass
+                        return b''.join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+
+            def form(self) -> dict:
+                fields = parse_qs(urlparse(self.path).query)
+                if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                    fields.update(parse_qs(self.body().decode('utf-8')))
+                return {name: values[0] for name, values in fields.items()}
+
+            def reply(self, status: int, payload):
+                data = b'' if payload is None else json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def route(self):
+                # One handler serves every request on a keep-alive connection, so the
+                # body cached for the previous request must not be reused
+                self._body = None
+                path = urlparse(self.path).path
+                if ':generateContent' in path:
+                    service = 'gemini'
+                elif path.startswith('/imgbb'):
+                    service = 'imgbb'
+                elif path.startswith('/graph'):
+                    service = 'graph'
+                elif path.startswith('/supabase'):
+                    service = 'supabase'
+                elif path.startswith('/alerts'):
+                    service = 'alerts'
+                else:
+                    self.body()
+                    self.reply(404, {'error': f"No fake for {path}"})
+                    return
+                # Drain the request body before replying so keep-alive connections stay in sync
+                self.body()
+                if not services.begin(service):
+                    self.reply(500, {'error': {'message': f"Injected {service} failure"}})
+                elif service == 'graph':
+                    services.graph(self, path)
+                elif service == 'alerts':
+                    services.alerts_webhook(self)
+                else:
+                    getattr(services, service)(self)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = route
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def parse_service_map(value: str) -> dict:
+    """Parse 'graph=0.2,gemini=1' into {'graph': 0.2, 'gemini': 1.0}"""
+    result = {}
+    for item in filter(None, (value or '').split(',')):
+        service, _, number = item.partition('=')
+        if service not in SERVICES:
+            raise argparse.ArgumentTypeError(f"Unknown service '{service}', expected one of {', '.join(SERVICES)}")
+        result[service] = float(number)
+    return result
+
+def write_accounts_file(path: str, count: int):
+    accounts = [
+        {'name': f"load{i}", 'instagram_account_id': f"1784{i:06d}", 'access_token': f"harness-token-{i}"}
+        for i in range(count)
+    ]
+    with open(path, 'w') as f:
+        json.dump(accounts, f)
+
+def load_trace(path: str) -> dict:
+    """Stage name to list of durations, from the METRICS_TRACE_FILE the run wrote"""
+    stages = {}
+    if not os.path.exists(path):
+        return stages
+    with open(path, 'r') as f:
+        for line in f:
+            record = json.loads(line)
+            stages.setdefault(record['stage'], []).append(record['seconds'])
+    return stages
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def count_published(bot, slots) -> tuple:
+    """How many of the slot x account jobs were published, and how many weren't"""
+    from job_store import PostJobStore
+
+    published = failed = 0
+    for slot in slots:
+        for account in bot.accounts.configs:
+            job = bot.job_store.get(PostJobStore.make_key(account.name, slot))
+            if job and job['stage'] == 'published':
+                published += 1
+            else:
+                failed += 1
+    return published, failed
+
+def report(bot, services, slots, elapsed, trace_file, usage, counts):
+    published, failed = counts
+
+    print("\n=== Load harness report ===")
+    print(f"Accounts: {len(bot.accounts.configs)}   slots: {len(slots)}   wall time: {elapsed:.1f}s")
+    print(f"Published: {published}   not published: {failed}   throughput: {published / elapsed * 60:.1f} posts/min")
+
+    print("\nStage latency (s)          count      p50      p95      max")
+    for stage, values in sorted(load_trace(trace_file).items()):
+        print(f"  {stage:<22} {len(values):7d} {statistics.median(values):8.3f} "
+              f"{percentile(values, 95):8.3f} {max(values):8.3f}")
+
+    print("\nFake service requests      total   failed")
+    for service in SERVICES:
+        print(f"  {service:<22} {services.requests[service]:7d} {services.failures[service]:8d}")
+
+    alert_count = sum(sum(alert['count'] for alert in digest.get('alerts', [])) for digest in services.alerts)
+    print(f"\nAlerts: {alert_count} raised, delivered in {len(services.alerts)} message(s)")
+
+    self_usage, child_usage = usage
+    print("\nResources")
+    print(f"  CPU user/system (bot):     {self_usage.ru_utime:.1f}s / {self_usage.ru_stime:.1f}s")
+    print(f"  CPU user/system (workers): {child_usage.ru_utime:.1f}s / {child_usage.ru_stime:.1f}s")
+    print(f"  Peak RSS bot/worker:       {self_usage.ru_maxrss / 1024:.0f} MB / {child_usage.ru_maxrss / 1024:.0f} MB")
+    print(f"  Threads at end of run:     {threading.active_count()}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end load harness')
+    parser.add_argument('--accounts', type=int, default=5, help='Number of fake Instagram accounts')
+    parser.add_argument('--slots', type=int, default=10, help='Posting slots to run, each posting to every account')
+    parser.add_argument('--concurrency', type=int, default=2, help='Slots in flight at once')
+    parser.add_argument('--carousel-size', type=int, default=1, help='Quotes per post (CAROUSEL_SIZE)')
+    parser.add_argument('--latency', type=parse_service_map, default={},
+                        help='Mean seconds per request by service, e.g. gemini=1.5,graph=0.2')
+    parser.add_argument('--failure-rate', type=parse_service_map, default={},
+                        help='Fraction of requests answered with HTTP 500, e.g. imgbb=0.05')
+    parser.add_argument('--container-delay', type=float, default=1.0, help='Seconds before a container is FINISHED')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='Container status poll interval')
+    parser.add_argument('--render-executor', choices=['process', 'thread'], default='process')
+    parser.add_argument('--render-workers', type=int, default=None)
+    parser.add_argument('--alert-window', type=float, default=2.0, help='Seconds alerts are batched before sending')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch directory for inspection')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='quotes-bot-load-')
+    services = FakeServices(args.latency, args.failure_rate, args.container_delay).start()
+
+    accounts_file = os.path.join(workdir, 'accounts.json')
+    trace_file = os.path.join(workdir, 'trace.jsonl')
+    write_accounts_file(accounts_file, args.accounts)
+    os.environ.update(services.env())
+    os.environ.update({
+        'ACCOUNTS_FILE': accounts_file,
+        'CAROUSEL_SIZE': str(args.carousel_size),
+        'CONTAINER_POLL_INTERVAL': str(args.poll_interval),
+        'RENDER_EXECUTOR': args.render_executor,
+        'METRICS_TRACE_FILE': trace_file,
+        # Alerts go to the fake webhook, batched over a short window
+        'ALERT_WINDOW_SECONDS': str(args.alert_window),
+        'ALERT_RETRY_SECONDS': '0.5',
+    })
+    if args.render_workers:
+        os.environ['RENDER_WORKERS'] = str(args.render_workers)
+    from main import ScienceQuotesBot
+    from slot_planner import SLOT_FORMAT
+
+    bot = ScienceQuotesBot(history_dir=os.path.join(workdir, 'history'))
+    # Every slot posts to every account, so lift the local quota out of the way
+    bot.accounts.quota.limit = args.slots + 1
+
+    # Distinct synthetic slot keys, one minute apart
+    start = datetime(2000, 1, 1, 18, 0)
+    slots = [(start + timedelta(minutes=i)).strftime(SLOT_FORMAT) for i in range(args.slots)]
+
+    print(f"Driving {args.slots} slot(s) x {args.accounts} account(s) against {services.url}")
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='slot') as pool:
+            list(pool.map(lambda slot: bot.generate_and_post(test_mode=True, slot=slot), slots))
+        elapsed = time.perf_counter() - started
+        counts = count_published(bot, slots)
+    finally:
+        # Stops every pool and thread so the process can exit, and flushes queued alerts
+        # to the fake webhook before it goes away; worker processes only show up in
+        # RUSAGE_CHILDREN once they have exited
+        bot.close()
+        services.stop()
+
+    usage = (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    report(bot, services, slots, elapsed, trace_file, usage, counts)
+
+    if args.keep:
+        print(f"\nScratch directory kept at {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,31 @@
 import os
-import random
-import time
+import signal
 import logging
+import threading
+from pathlib import Path
 from datetime import datetime, timedelta
 import pytz
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
 from quote_generator import QuoteGenerator
-from image_generator import ImageGenerator
+from image_generator import ImageGenerator, warm_up_worker
+from account_manager import AccountManager
 from instagram_poster import InstagramPoster
+from quota_accountant import QuotaAccountant
+from job_store import PostJobStore
+from post_pipeline import PostPipeline
+from artifact_store import ArtifactStore
+from latency_tracker import StageLatencyTracker
+from slot_planner import PostingWindow, SlotPlanner, SLOT_FORMAT
 from monitoring import MonitoringService
+from profiler import RunProfiler
+from readiness import Readiness
+from token_lifecycle import TokenLifecycleManager
+from metrics import start_metrics_server, timed, QUEUE_DEPTH
 
 # Configure logging
 logging.basicConfig(
@@ -21,74 +35,105 @@ logging.basicConfig(
 logger = logging.getLogger('ScienceQuotesBot')
 
 class ScienceQuotesBot:
-    def __init__(self):
+    def __init__(self, history_dir: str = None, profile: bool = None):
         logger.info("Initializing bot...")
         load_dotenv()
-        self.quote_generator = QuoteGenerator()
-        self.image_generator = ImageGenerator()
-        self.instagram_poster = InstagramPoster()
+        # All runtime state lives under history/ unless another directory is given
+        def state_path(name):
+            return str(Path(history_dir) / name) if history_dir else None
+        self.quote_generator = QuoteGenerator(history_dir=history_dir)
+        self.image_generator = ImageGenerator(history_dir=history_dir)
+        self.accounts = AccountManager(quota=QuotaAccountant(
+            db_path=state_path('publishing_quota.db'), limit=InstagramPoster.PUBLISHING_LIMIT),
+            history_dir=history_dir)
         self.monitoring = MonitoringService()
+        # Refreshed tokens are kept in history/token_state.json and swapped into the live posters
+        self.tokens = TokenLifecycleManager(self.accounts, self.monitoring, state_file=state_path('token_state.json'))
+        self.job_store = PostJobStore(db_path=state_path('post_jobs.db'))
+        self.latency_tracker = StageLatencyTracker(state_file=state_path('stage_latency.json'))
+        # Rendered images go straight from memory to the upload unless PERSIST_ARTIFACTS
+        # asks for copies on disk that survive a restart
+        artifact_store = None
+        if os.getenv('PERSIST_ARTIFACTS', '0') == '1':
+            artifact_store = ArtifactStore(directory=os.getenv('ARTIFACT_DIR') or state_path('artifacts'))
+        self.pipeline = PostPipeline(
+            self.job_store,
+            self.quote_generator,
+            self.accounts.render_pool,
+            latency_tracker=self.latency_tracker,
+            artifact_store=artifact_store
+        )
         self.ist_timezone = pytz.timezone('Asia/Kolkata')
+        # Number of quotes per post; anything above 1 publishes a carousel
+        self.carousel_size = int(os.getenv('CAROUSEL_SIZE', 1))
+        if self.carousel_size != 1 and not (
+                InstagramPoster.CAROUSEL_MIN_ITEMS <= self.carousel_size <= InstagramPoster.CAROUSEL_MAX_ITEMS):
+            raise ValueError(
+                f"CAROUSEL_SIZE must be 1 or {InstagramPoster.CAROUSEL_MIN_ITEMS}-"
+                f"{InstagramPoster.CAROUSEL_MAX_ITEMS}, got {self.carousel_size}"
+            )
+        # A single window config drives both the slot plan and the posting-hours guard
+        self.posting_window = PostingWindow.from_env(self.ist_timezone)
+        self.planner = SlotPlanner(self.posting_window, int(os.getenv('POSTS_PER_DAY', 1)),
+                                   plan_file=state_path('slot_plan.json'))
+        # Network and other slow setup happens in warm_up(), not here
+        self.readiness = Readiness()
+        # Off unless --profile or PROFILE_RUNS is set
+        self.profiler = RunProfiler(enabled=profile, profile_dir=state_path('profiles'))
+        self.scheduler = None
+        self.shutdown_event = threading.Event()
         self.last_error_time = None
         self.error_reported = False
         logger.info("Initialization complete.")
         
-    def generate_and_post(self, test_mode=False):
-        """Generate a quote and post it to Instagram"""
+    def generate_and_post(self, test_mode=False, account_names=None, slot=None):
+        """Generate a quote and post it to every configured Instagram account"""
+        with self.profiler.run(f"post_{slot or 'now'}"):
+            self._generate_and_post(test_mode, account_names, slot)
+    
+    def _generate_and_post(self, test_mode, account_names, slot):
         try:
             # Get current time in IST
             now = datetime.now(self.ist_timezone)
+            # Planned slots are judged by their intended time, so a slightly late fire still counts
+            slot_time = datetime.strptime(slot, SLOT_FORMAT) if slot else None
+            slot_time = self.ist_timezone.localize(slot_time) if slot_time else now
             
             if test_mode:
                 logger.info("\nRunning test post at %s", now.strftime('%I:%M %p IST'))
             else:
                 # Only check posting hours in non-test mode
-                if now.hour < 9 or now.hour >= 3:
+                if not self.posting_window.contains(slot_time):
                     logger.info(f"Outside posting hours (current time: {now.strftime('%I:%M %p IST')})")
                     return
                 logger.info(f"\nStarting post generation at {now.strftime('%I:%M %p IST')}")
             
-            # Generate quote
-            logger.info("\n1. Generating quote...")
-            quote_data = self.quote_generator.get_quote()
-            if not quote_data:
-                error_msg = "Failed to generate quote"
-                logger.error(error_msg)
-                self.monitoring.report_downtime(error_msg)
-                return
-            logger.info("Quote generated successfully!")
-            logger.info(f"Quote: {quote_data['quote']}")
-            logger.info(f"Author: {quote_data['author']}")
-                
-            # Generate image
-            logger.info("\n2. Generating image...")
-            image_path = self.image_generator.create_quote_image(
-                quote_data['quote'],
-                quote_data['author']
-            )
-            if not image_path:
-                error_msg = "Failed to generate image"
-                logger.error(error_msg)
-                self.monitoring.report_downtime(error_msg)
-                return
-            logger.info(f"Image generated successfully at: {image_path}")
+            # Hold back accounts that would be rejected for quota before doing any work
+            accounts = self.accounts.configs
+            if account_names is not None:
+                accounts = [account for account in accounts if account.name in account_names]
+            # The slot doubles as the idempotency key if this job fires twice
+            slot = slot or self.planner.slot_key(now)
+            available, throttled = self.accounts.partition_by_quota(accounts)
+            if throttled:
+                self.reschedule_throttled(throttled, slot)
             
-            # Post to Instagram
-            logger.info("\n3. Posting to Instagram...")
-            success = self.instagram_poster.post_image(
-                image_path,
-                quote_data['instagram_description']
-            )
+            # Fan the post out to every account that still has publishing quota
+            results = self.accounts.fan_out(lambda account: self.post_for_account(account, slot), available)
+            if self.scheduler:
+                QUEUE_DEPTH.set(len(self.scheduler.get_jobs()), queue='scheduler')
+            if not results:
+                logger.warning("No accounts with remaining publishing quota, skipping this slot")
+                return
             
-            if success:
-                logger.info(f"\nPost completed successfully at {now.strftime('%I:%M %p IST')}")
+            if all(results.values()):
+                logger.info(f"\nPost completed successfully for {len(results)} account(s) at {now.strftime('%I:%M %p IST')}")
                 if self.error_reported:
                     self.monitoring.report_recovery()
                     self.error_reported = False
             else:
-                error_msg = "Failed to post to Instagram"
-                logger.error(error_msg)
-                self.monitoring.report_downtime(error_msg)
+                failed = [name for name, success in results.items() if not success]
+                logger.error(f"Posting failed for account(s): {', '.join(failed)}")
             
         except Exception as e:
             error_msg = f"Error in generate_and_post: {str(e)}"
@@ -99,107 +144,265 @@ class ScienceQuotesBot:
             self.monitoring.report_downtime(error_msg)
             self.error_reported = True
     
-    def calculate_posts_for_remaining_time(self, current_hour, posts_per_day, active_start, active_end):
-        """Calculate how many posts to make in remaining time of the day"""
-        # Handle cross-day schedule (9 AM to 3 AM next day)
-        if active_end < active_start:  # e.g., end at 3 (next day) vs start at 9
-            if current_hour >= active_start:  # After start (9 AM onwards)
-                remaining_hours = (24 - current_hour) + active_end
-            elif current_hour < active_end:  # Early hours next day (before 3 AM)
-                remaining_hours = active_end - current_hour
-            else:  # Between end and start (3 AM to 9 AM)
-                return 0
-        else:
-            if current_hour >= active_end or current_hour < active_start:
-                return 0
-            remaining_hours = active_end - current_hour
-            
-        total_active_hours = (24 - active_start + active_end) if active_end < active_start else (active_end - active_start)
-        
-        # Calculate posts proportionally to remaining time
-        remaining_posts = int((remaining_hours / total_active_hours) * posts_per_day)
-        return remaining_posts
-
-    def schedule_day_posts(self, scheduler, start_hour, end_hour, num_posts, is_today=False):
-        """Schedule posts for a specific day period"""
-        if num_posts == 0:
+    def reschedule_throttled(self, accounts, slot):
+        """Retry throttled accounts' slot once their quota window frees up, if that is soon enough"""
+        if not self.scheduler:
+            logger.warning("No scheduler running, dropping this slot for throttled accounts")
             return
-            
-        # Handle cross-day schedule
-        total_hours = (24 - start_hour + end_hour) if end_hour < start_hour else (end_hour - start_hour)
-        interval_hours = total_hours / num_posts
         
-        for i in range(num_posts):
-            # Calculate base hour for this post
-            raw_hour = start_hour + (i * interval_hours)
-            # Adjust hour if it goes past midnight
-            post_hour = raw_hour if raw_hour < 24 else (raw_hour - 24)
+        max_delay = timedelta(hours=float(os.getenv('QUOTA_RESCHEDULE_MAX_HOURS', 2)))
+        now = datetime.now(self.ist_timezone)
+        for account in accounts:
+            run_at = self.accounts.quota.next_available(account.name).astimezone(self.ist_timezone)
+            run_at += timedelta(minutes=1)
+            if run_at - now > max_delay:
+                logger.warning(f"[{account.name}] Quota frees up at {run_at.strftime('%I:%M %p IST')}, skipping this slot")
+                continue
+            self.scheduler.add_job(
+                self.generate_and_post,
+                trigger=DateTrigger(run_date=run_at),
+                # The same slot, so the retry keeps its job and posting window check
+                kwargs={'account_names': [account.name], 'slot': slot},
+                name=f'quota_retry_{account.name}_{slot}'
+            )
+            logger.info(f"[{account.name}] Rescheduled post to {run_at.strftime('%I:%M %p IST')} when quota frees up")
+    
+    def post_for_account(self, account, slot, job=None):
+        """Run (or resume) the post job for one account and slot"""
+        # Reserve quota up front so concurrent jobs can't overshoot the limit
+        if not self.accounts.quota.try_reserve(account.name):
+            logger.warning(f"[{account.name}] No publishing quota left, skipping")
+            return False
+        try:
+            if job is None:
+                job = self.new_job(account, slot)
+            with timed('post'), self.profiler.thread():
+                self.pipeline.run(
+                    job,
+                    self.accounts.get_poster(account.name),
+                    quote_count=self.quote_count(job)
+                )
+            return True
             
-            # For today's posts, skip if the calculated hour has already passed
-            if is_today:
-                current_hour = datetime.now(self.ist_timezone).hour
-                if post_hour <= current_hour and (post_hour > end_hour or current_hour < end_hour):
-                    continue
-                
-            # Add the job with a cron schedule
-            scheduler.add_job(
+        except Exception as e:
+            error_msg = f"[{account.name}] Error in post_for_account: {str(e)}"
+            logger.error(error_msg)
+            import traceback
+            logger.error("Full traceback:")
+            logger.error(traceback.format_exc())
+            self.monitoring.report_downtime(error_msg)
+            self.error_reported = True
+            return False
+        finally:
+            self.accounts.quota.release(account.name)
+    
+    def quote_count(self, job):
+        return max(2, self.carousel_size) if job['kind'] == 'carousel' else 1
+    
+    def new_job(self, account, slot):
+        kind = 'carousel' if self.carousel_size > 1 else 'single'
+        return self.job_store.get_or_create(account.name, slot, kind)
+    
+    def prepare_slot(self, slot):
+        """Warm up a slot: generate, render and stage containers so only publishing is left at slot time"""
+        # Generation and rendering happen here now, so this is the run worth profiling
+        with self.profiler.run(f"prepare_{slot}"):
+            self._prepare_slot(slot)
+    
+    def _prepare_slot(self, slot):
+        try:
+            slot_time = self.ist_timezone.localize(datetime.strptime(slot, SLOT_FORMAT))
+            if not self.posting_window.contains(slot_time):
+                return
+            available, _ = self.accounts.partition_by_quota()
+            logger.info(f"\nWarming up {len(available)} account(s) for the {slot_time.strftime('%I:%M %p IST')} slot")
+            self.accounts.fan_out(lambda account: self.prepare_for_account(account, slot), available)
+        except Exception as e:
+            logger.error(f"Error in prepare_slot: {str(e)}")
+    
+    def prepare_for_account(self, account, slot):
+        """Warm up one account's job; failures are left for the publish job to retry"""
+        try:
+            job = self.new_job(account, slot)
+            with self.profiler.thread():
+                job = self.pipeline.prepare(job, self.accounts.get_poster(account.name), self.quote_count(job))
+            logger.info(f"[{account.name}] Ready to publish at slot {slot} (container {job['container_id']})")
+            return True
+        except Exception as e:
+            logger.warning(f"[{account.name}] Warm-up failed, the slot will retry from its last stage: {str(e)}")
+            return False
+    
+    def resume_incomplete_jobs(self):
+        """Finish post jobs interrupted by a crash or restart, from their last completed stage"""
+        jobs = self.job_store.incomplete()
+        if not jobs:
+            return
+        
+        logger.info(f"Resuming {len(jobs)} interrupted post job(s)...")
+        accounts = {account.name: account for account in self.accounts.configs}
+        now = datetime.now(self.ist_timezone)
+        for job in jobs:
+            account = accounts.get(job['account'])
+            if not account:
+                logger.warning(f"Skipping job {job['job_key']}: account '{job['account']}' is no longer configured")
+                continue
+            if self.ist_timezone.localize(datetime.strptime(job['slot'], SLOT_FORMAT)) > now:
+                # Warmed up ahead of a slot that hasn't arrived yet; its publish job will pick it up
+                logger.info(f"Holding job {job['job_key']} at stage '{job['stage']}' until its slot")
+                continue
+            logger.info(f"Resuming job {job['job_key']} from stage '{job['stage']}'")
+            # A one-off job, so startup doesn't wait on it and the scheduler's policies apply
+            self.scheduler.add_job(
+                self.post_for_account,
+                trigger=DateTrigger(run_date=now),
+                args=[account, job['slot'], job],
+                id=f"resume_{job['job_key']}",
+                name=f"resume_{job['job_key']}"
+            )
+    
+    def schedule_upcoming_slots(self):
+        """Add warm-up and publish jobs for every planned slot that isn't scheduled yet"""
+        scheduled = 0
+        now = datetime.now(self.ist_timezone)
+        # Start each slot's pipeline early enough that a p95 run finishes before the slot
+        lead_time = timedelta(seconds=self.latency_tracker.lead_time(['generate', 'render', 'upload', 'container']))
+        for slot in self.planner.upcoming_slots(now):
+            slot_key = self.planner.slot_key(slot)
+            job_id = f'post_{slot_key}'
+            if self.scheduler.get_job(job_id):
+                continue
+            prepare_at = max(slot - lead_time, now + timedelta(seconds=5))
+            if prepare_at < slot:
+                self.scheduler.add_job(
+                    self.prepare_slot,
+                    trigger=DateTrigger(run_date=prepare_at),
+                    kwargs={'slot': slot_key},
+                    id=f'prepare_{slot_key}',
+                    name=f'prepare_{slot_key}'
+                )
+            self.scheduler.add_job(
                 self.generate_and_post,
-                trigger=CronTrigger(
-                    hour=int(post_hour),
-                    minute=random.randint(0, 59),  # Random minute for each post
-                    timezone=self.ist_timezone
-                ),
-                name=f'post_job_{i}'
+                trigger=DateTrigger(run_date=slot),
+                kwargs={'slot': slot_key},
+                id=job_id,
+                name=job_id
+            )
+            scheduled += 1
+            logger.info(
+                f"Scheduled post at {slot.strftime('%d %b %I:%M %p IST')}, "
+                f"warm-up at {prepare_at.strftime('%I:%M:%S %p')}"
             )
-            logger.info(f"Scheduled post {i+1}/{num_posts} at approximately {int(post_hour):02d}:XX IST")
+        if not scheduled:
+            logger.info("No new slots to schedule")
+
+    def create_scheduler(self):
+        """Build the scheduler with explicit executors and overlap/misfire policies"""
+        post_workers = int(os.getenv('POST_WORKERS', max(4, len(self.accounts))))
+        scheduler = BackgroundScheduler(
+            executors={
+                # Posting jobs mostly wait on Gemini and the Graph API; rendering
+                # inside them is handed off to the account manager's process pool
+                'default': ThreadPoolExecutor(post_workers),
+            },
+            job_defaults={
+                # Run a backlog of missed fires once, never overlap a job with itself,
+                # and drop fires that are too late to be worth posting
+                'coalesce': True,
+                'max_instances': 1,
+                'misfire_grace_time': int(os.getenv('MISFIRE_GRACE_SECONDS', 900)),
+            },
+            timezone=self.ist_timezone
+        )
+        scheduler.add_listener(self.on_job_event, EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+        return scheduler
+
+    def on_job_event(self, event):
+        """Log scheduler jobs that failed, were missed or were skipped because they overlapped"""
+        if event.code == EVENT_JOB_ERROR:
+            logger.error(f"Scheduled job {event.job_id} raised: {event.exception}")
+        elif event.code == EVENT_JOB_MISSED:
+            logger.warning(f"Scheduled job {event.job_id} missed its run time {event.scheduled_run_time}")
+        else:
+            logger.warning(f"Scheduled job {event.job_id} skipped, previous run still in progress")
+
+    def install_signal_handlers(self):
+        """Turn SIGINT/SIGTERM into a clean shutdown"""
+        def request_shutdown(signum, frame):
+            logger.info(f"Received signal {signum}")
+            self.shutdown_event.set()
+        signal.signal(signal.SIGINT, request_shutdown)
+        signal.signal(signal.SIGTERM, request_shutdown)
+
+    def warm_up(self, check_token=False):
+        """Start loading slow resources in parallel without waiting for them
+        
+        Each component also initializes itself on first use, so a job that runs
+        before its warm-up finishes just waits for it, and a failed warm-up is retried.
+        """
+        self.readiness.register('quote_generator', self.quote_generator.warm_up)
+        self.readiness.register('font', self.image_generator.ensure_font)
+        if self.image_generator.noise_atlas is not None:
+            self.readiness.register('noise_atlas', self.image_generator.noise_atlas.ensure)
+        self.readiness.register('render_pool', self.warm_up_render_pool)
+        if check_token:
+            self.readiness.register('token_check', self.tokens.check_all)
+    
+    def warm_up_render_pool(self):
+        # Build the noise atlas once here rather than in every worker at the same time
+        if self.image_generator.noise_atlas is not None:
+            try:
+                self.readiness.wait('noise_atlas')
+            except Exception:
+                pass
+        return self.accounts.render_pool.submit(warm_up_worker).result()
+
+    def close(self):
+        """Stop every pool and background thread and close the stores, so the process can exit"""
+        self.readiness.shutdown()
+        self.accounts.shutdown()
+        self.quote_generator.close()
+        self.job_store.close()
+        # Last, so alerts raised while shutting down are still delivered
+        self.monitoring.close()
 
     def run(self, test_mode=False):
         """Run the bot with scheduling"""
         try:
             if test_mode:
                 logger.info("Running in test mode...")
+                self.warm_up()
                 self.generate_and_post(test_mode=True)
+                self.close()
                 return
                 
             logger.info("Starting bot in production mode...")
+            self.warm_up(check_token=True)
+            start_metrics_server()
             self.monitoring.report_startup()
             
-            scheduler = BackgroundScheduler()
-            posts_per_day = int(os.getenv('POSTS_PER_DAY', 1))
-            active_hours_start = 18  # 6 PM IST
-            active_hours_end = 2   # 2 AM IST (next day)
-            
-            # Get current time in IST
-            now = datetime.now(self.ist_timezone)
-            current_hour = now.hour
-            
-            # Handle today's remaining posts
-            remaining_posts = self.calculate_posts_for_remaining_time(
-                current_hour, posts_per_day, active_hours_start, active_hours_end
+            scheduler = self.create_scheduler()
+            self.scheduler = scheduler
+            self.resume_incomplete_jobs()
+            logger.info(
+                f"Posting {self.planner.posts_per_day} time(s) per day between "
+                f"{self.posting_window.start_hour:02d}:00 and {self.posting_window.end_hour:02d}:00 IST"
             )
+            self.schedule_upcoming_slots()
             
-            if remaining_posts > 0:
-                logger.info(f"Scheduling {remaining_posts} posts for remaining time today")
-                self.schedule_day_posts(
-                    scheduler, 
-                    max(current_hour + 1, active_hours_start), 
-                    active_hours_end, 
-                    remaining_posts,
-                    is_today=True
-                )
-            
-            # Schedule regular posts for subsequent days
-            logger.info(f"Setting up regular schedule with {posts_per_day} posts per day")
-            self.schedule_day_posts(
-                scheduler,
-                active_hours_start,
-                active_hours_end,
-                posts_per_day
+            # Extend the plan with the next window's slots every midnight
+            scheduler.add_job(
+                self.schedule_upcoming_slots,
+                trigger=CronTrigger(
+                    hour=0,
+                    minute=0,
+                    timezone=self.ist_timezone
+                ),
+                name='slot_planner_job'
             )
             
-            # Add token expiration check job - run daily at 8:30 AM IST (before posting starts)
+            # Check token expiry daily at 8:30 AM IST (before posting starts), refreshing if it's close
             scheduler.add_job(
-                self.monitoring.check_token_expiration,
+                self.tokens.check_all,
                 trigger=CronTrigger(
                     hour=8,
                     minute=30,
@@ -211,13 +414,13 @@ class ScienceQuotesBot:
             scheduler.start()
             logger.info("Scheduler started. Bot is running...")
             
-            # Keep the script running
-            try:
-                while True:
-                    time.sleep(60)
-            except (KeyboardInterrupt, SystemExit):
-                scheduler.shutdown()
-                logger.info("Bot stopped by user")
+            # Block until a signal asks us to stop, then let running posts finish
+            self.install_signal_handlers()
+            self.shutdown_event.wait()
+            logger.info("Shutting down, waiting for running jobs to finish...")
+            scheduler.shutdown(wait=True)
+            self.close()
+            logger.info("Bot stopped")
                 
         except Exception as e:
             error_msg = f"Error in run: {str(e)}"
@@ -229,6 +432,6 @@ class ScienceQuotesBot:
     
 if __name__ == "__main__":
     import sys
-    bot = ScienceQuotesBot()
+    bot = ScienceQuotesBot(profile=True if "--profile" in sys.argv else None)
     test_mode = "--test" in sys.argv
     bot.run(test_mode)
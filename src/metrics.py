@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import logging
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('Metrics')
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values) -> str:
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}"]
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def _render_value(self, key, state) -> list:
+        lines = []
+        for bound, count in zip(self.buckets, state['counts']):
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            labels = _format_labels(self.labelnames + ('le',), key + (le,))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {state['sum']}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """Process-wide collection of metrics, rendered in the Prometheus text format"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'quotes_bot_stage_seconds', 'Time spent in each pipeline stage', ('stage',))
+API_CALLS = REGISTRY.counter(
+    'quotes_bot_api_calls_total', 'External API requests by service, endpoint and HTTP status', ('service', 'endpoint', 'status'))
+RETRIES = REGISTRY.counter(
+    'quotes_bot_retries_total', 'Retried operations', ('operation',))
+FAILURES = REGISTRY.counter(
+    'quotes_bot_failures_total', 'Failed pipeline stages', ('stage',))
+QUOTE_SOURCES = REGISTRY.counter(
+    'quotes_bot_quotes_total', 'Quotes used, from Gemini or the fallback corpus', ('source',))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'quotes_bot_queue_depth', 'Jobs waiting to run', ('queue',))
+QUOTA_REMAINING = REGISTRY.gauge(
+    'quotes_bot_quota_remaining', 'Publishing quota left in the current 24 hour window', ('account',))
+TOKEN_EXPIRES_IN = REGISTRY.gauge(
+    'quotes_bot_token_expires_in_seconds', 'Seconds until each account\'s access token expires (-1 if it never does)', ('account',))
+
+class _TraceWriter:
+    """Optional JSON-lines log of every timed stage, enabled with METRICS_TRACE_FILE"""
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def write(self, stage: str, seconds: float, **extra):
+        path = os.getenv('METRICS_TRACE_FILE')
+        if not path:
+            return
+        record = {'ts': time.time(), 'stage': stage, 'seconds': round(seconds, 6), 'pid': os.getpid()}
+        record.update(extra)
+        with self._lock, open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+_trace = _TraceWriter()
+_capture = threading.local()
+
+def observe_stage(stage: str, seconds: float, **extra):
+    """Record a stage duration in the histogram, the trace file and any active capture"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    _trace.write(stage, seconds, **extra)
+    captured = getattr(_capture, 'observations', None)
+    if captured is not None:
+        captured.append((stage, seconds))
+
+class timed:
+    """Time a block or function as a pipeline stage
+
+        with timed('upload'):
+            ...
+
+        @timed('encode')
+        def encode(...):
+            ...
+    """
+    def __init__(self, stage: str, **extra):
+        self.stage = stage
+        self.extra = extra
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        if exc_type is not None:
+            FAILURES.inc(stage=self.stage)
+        observe_stage(self.stage, self.seconds, failed=exc_type is not None, **self.extra)
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage, **self.extra):
+                return func(*args, **kwargs)
+        return wrapper
+
+@contextmanager
+def capture_stages():
+    """Collect (stage, seconds) pairs timed in this thread, e.g. to ship them back from a worker process"""
+    previous = getattr(_capture, 'observations', None)
+    _capture.observations = []
+    try:
+        yield _capture.observations
+    finally:
+        _capture.observations = previous
+
+def replay_stages(observations):
+    """Record stage timings that were captured in another process"""
+    for stage, seconds in observations:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+def count_api_call(service: str, endpoint: str, status):
+    API_CALLS.inc(service=service, endpoint=endpoint, status=status)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise flood the bot's log
+        pass
+
+def start_metrics_server(port: int = None, host: str = '127.0.0.1'):
+    """Serve /metrics from a daemon thread; METRICS_PORT=0 disables it"""
+    port = int(port if port is not None else os.getenv('METRICS_PORT', 9108))
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    logger.info(f"Metrics available at http://{host}:{port}/metrics")
+    return server
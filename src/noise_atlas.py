@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+import numpy as np
+import kernels
+
+logger = logging.getLogger('NoiseAtlas')
+
+# Same blob size and smoothing as the per-render noise: 6 lattice cells across 1080 px, sigma 30
+REFERENCE_SIZE = 1080
+SCALE = 6.0
+OCTAVES = 2
+PERSISTENCE = 0.5
+LACUNARITY = 2.0
+BLUR_SIGMA = 30
+BLOCK_ROWS = 512
+
+def periodic_perlin(size: int, cells: int, rng, out: np.ndarray):
+    """Fill out (size x size) with gradient noise that repeats every `cells` lattice cells
+
+    Gradients live on a cells x cells lattice that wraps around, so the field tiles
+    seamlessly in both directions. Rows are filled in blocks to bound memory.
+    """
+    angles = rng.uniform(0, 2 * np.pi, (cells, cells))
+    grad_x = np.cos(angles).astype(np.float32)
+    grad_y = np.sin(angles).astype(np.float32)
+
+    u = np.arange(size, dtype=np.float32) * (cells / size)
+    x0 = u.astype(np.int64)
+    fx = u - x0
+    x0 %= cells
+    x1 = (x0 + 1) % cells
+    sx = fx * fx * fx * (fx * (fx * 6 - 15) + 10)
+
+    for start in range(0, size, BLOCK_ROWS):
+        v = np.arange(start, min(start + BLOCK_ROWS, size), dtype=np.float32) * (cells / size)
+        y0 = v.astype(np.int64)
+        fy = (v - y0)[:, None]
+        y0 %= cells
+        y1 = (y0 + 1) % cells
+        sy = fy * fy * fy * (fy * (fy * 6 - 15) + 10)
+
+        def corner(ys, xs, dx, dy):
+            return grad_x[ys[:, None], xs[None, :]] * dx + grad_y[ys[:, None], xs[None, :]] * dy
+
+        n00 = corner(y0, x0, fx, fy)
+        n10 = corner(y0, x1, fx - 1, fy)
+        n01 = corner(y1, x0, fx, fy - 1)
+        n11 = corner(y1, x1, fx - 1, fy - 1)
+        top = n00 + sx * (n10 - n00)
+        bottom = n01 + sx * (n11 - n01)
+        out[start:start + len(v)] += top + sy * (bottom - top)
+
+class NoiseAtlas:
+    """Large seamlessly tiling noise layers, built once and memory-mapped afterwards
+
+    Each background samples a random toroidal window from a layer per colour, with
+    a random flip and rotation, so a render costs a crop plus colour mixing instead
+    of evaluating and blurring noise. The atlas is stored as float16 .npy in
+    history_dir (history/ by default) and shared read-only by every render process.
+    """
+    def __init__(self, path: str = None, size: int = None, layers: int = None, seed: int = None,
+                 history_dir: str = None):
+        self.size = int(size or os.getenv('NOISE_ATLAS_SIZE', 4096))
+        self.layers = int(layers or os.getenv('NOISE_ATLAS_LAYERS', 4))
+        history_dir = Path(history_dir) if history_dir else Path(__file__).parent.parent / "history"
+        default_path = history_dir / f"noise_atlas_{self.size}x{self.layers}.npy"
+        self.path = Path(path or os.getenv('NOISE_ATLAS_PATH') or default_path)
+        self.seed = seed
+        self.rng = np.random.default_rng()
+        self._data = None
+        self._lock = threading.Lock()
+
+    def ensure(self) -> np.ndarray:
+        """Map the atlas, building it first if it doesn't exist yet; safe to call from any thread"""
+        if self._data is not None:
+            return self._data
+        with self._lock:
+            if self._data is None:
+                if not self.path.exists():
+                    self.build()
+                data = np.load(self.path, mmap_mode='r')
+                if data.shape != (self.layers, self.size, self.size):
+                    raise Exception(f"{self.path.name} has shape {data.shape}, expected {(self.layers, self.size, self.size)}")
+                self._data = data
+        return self._data
+
+    def build(self):
+        """Generate, blur and store every layer; takes a few seconds per layer"""
+        from scipy.ndimage import fourier_gaussian
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        rng = np.random.default_rng(self.seed)
+        # Whole number of cells so the lattice wraps exactly at the atlas edge
+        cells = max(1, round(self.size * SCALE / REFERENCE_SIZE))
+        start = time.perf_counter()
+        # Render workers may race to build it, so never expose a partial file
+        tmp_path = self.path.with_name(f".{self.path.stem}.{os.getpid()}.tmp.npy")
+        atlas = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16,
+                                          shape=(self.layers, self.size, self.size))
+        try:
+            for layer in range(self.layers):
+                field = np.zeros((self.size, self.size), dtype=np.float32)
+                amplitude, frequency = 1.0, 1
+                for _ in range(OCTAVES):
+                    octave = np.zeros_like(field)
+                    periodic_perlin(self.size, cells * frequency, rng, octave)
+                    field += amplitude * octave
+                    amplitude *= PERSISTENCE
+                    frequency = int(frequency * LACUNARITY)
+                field -= field.min()
+                field /= field.max()
+                # Blurring in the frequency domain wraps around the edges, so there's no seam,
+                # and is several times faster than gaussian_filter at this size
+                spectrum = fourier_gaussian(np.fft.rfft2(field), sigma=BLUR_SIGMA, n=self.size)
+                atlas[layer] = np.fft.irfft2(spectrum, s=field.shape)
+            atlas.flush()
+            del atlas
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            del atlas
+            tmp_path.unlink(missing_ok=True)
+            raise
+        logger.info(f"Built {self.layers}x{self.size}x{self.size} noise atlas in {time.perf_counter() - start:.1f}s")
+
+    def crop(self, layer: int, top: int, left: int, rows: int, cols: int, step: int = 1) -> np.ndarray:
+        """rows x cols pixels of a layer from (top, left), wrapping around its edges
+
+        With step > 1 every step-th pixel is taken, covering step times the area.
+        """
+        data = self.ensure()
+        top %= self.size
+        left %= self.size
+        # Index arrays only for an axis that actually wraps; slicing the other is much cheaper
+        if top + rows * step <= self.size:
+            row_index = slice(top, top + rows * step, step)
+        else:
+            row_index = (top + np.arange(rows) * step) % self.size
+        if left + cols * step <= self.size:
+            col_index = slice(left, left + cols * step, step)
+        else:
+            col_index = (left + np.arange(cols) * step) % self.size
+        if isinstance(row_index, np.ndarray) and isinstance(col_index, np.ndarray):
+            return data[layer][np.ix_(row_index, col_index)]
+        return data[layer][row_index, col_index]
+
+    def window(self, layer: int, height: int, width: int, rng=None) -> np.ndarray:
+        """A random height x width float32 window of a layer, wrapping around its edges
+
+        The window is also randomly flipped and rotated by a multiple of 90 degrees.
+        """
+        rng = rng or self.rng
+        turns = int(rng.integers(4))
+        # A quarter turn swaps the axes, so crop the transposed shape
+        rows, cols = (width, height) if turns % 2 else (height, width)
+        if rows > self.size or cols > self.size:
+            raise ValueError(f"{height}x{width} window is larger than the {self.size} px atlas")
+        top, left = (int(offset) for offset in rng.integers(self.size, size=2))
+        crop = np.rot90(self.crop(layer, top, left, rows, cols), turns)
+        if rng.integers(2):
+            crop = crop[:, ::-1]
+        return crop.astype(np.float32)
+
+    def weights(self, count: int, height: int, width: int, rng=None) -> np.ndarray:
+        """count x height x width windows, one per colour, normalized to sum to 1 at each pixel"""
+        rng = rng or self.rng
+        layers = rng.permutation(max(count, self.layers))[:count] % self.layers
+        bases = np.empty((count, height, width), dtype=np.float32)
+        for i, layer in enumerate(layers):
+            bases[i] = self.window(int(layer), height, width, rng)
+        return kernels.normalize_sum(bases)
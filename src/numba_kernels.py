@@ -0,0 +1,114 @@
+"""Numba-compiled versions of the kernels in kernels.py
+
+Only imported when Numba is installed. Compiled code is cached next to this file
+(or under NUMBA_CACHE_DIR), so only the very first run pays for compilation.
+"""
+import os
+import math
+import numpy as np
+from numba import config, njit, prange
+from kernels import PERMUTATION, GRADIENTS
+
+# TBB's pool deadlocks at interpreter exit once parallel kernels have run on a thread
+# other than the main one, as they do with RENDER_EXECUTOR=thread; OpenMP doesn't.
+# NUMBA_THREADING_LAYER still overrides this
+if not os.getenv('NUMBA_THREADING_LAYER'):
+    config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+
+name = 'numba'
+
+@njit(cache=True)
+def _fade(t):
+    return t * t * t * (t * (t * np.float32(6) - np.float32(15)) + np.float32(10))
+
+@njit(cache=True)
+def _lerp(t, a, b):
+    return a + t * (b - a)
+
+@njit(cache=True)
+def _gradient(hashed, x, y, gradients):
+    hashed = hashed & 15
+    return x * gradients[hashed, 0] + y * gradients[hashed, 1]
+
+@njit(cache=True)
+def _noise2(x, y, repeat_x, repeat_y, perm, gradients):
+    i = np.int64(math.floor(np.float32(np.fmod(x, repeat_x))))
+    j = np.int64(math.floor(np.float32(np.fmod(y, repeat_y))))
+    ii = np.int64(np.float32(np.fmod(np.float32(i + 1), repeat_x))) & 255
+    jj = np.int64(np.float32(np.fmod(np.float32(j + 1), repeat_y))) & 255
+    i &= 255
+    j &= 255
+    x = np.float32(x - np.float32(math.floor(x)))
+    y = np.float32(y - np.float32(math.floor(y)))
+    fx, fy = _fade(x), _fade(y)
+    a, b = perm[i], perm[ii]
+    aa, ab = perm[a + j], perm[a + jj]
+    ba, bb = perm[b + j], perm[b + jj]
+    one = np.float32(1)
+    return _lerp(fy,
+                 _lerp(fx, _gradient(perm[aa], x, y, gradients), _gradient(perm[ba], x - one, y, gradients)),
+                 _lerp(fx, _gradient(perm[ab], x, y - one, gradients), _gradient(perm[bb], x - one, y - one, gradients)))
+
+@njit(parallel=True, cache=True)
+def _pnoise_field(width, height, scale, offset, octaves, persistence, lacunarity, perm, gradients):
+    out = np.empty((height, width), dtype=np.float32)
+    for row in prange(height):
+        y = np.float32(row / height * scale + offset)
+        for col in range(width):
+            x = np.float32(col / width * scale + offset)
+            total = np.float32(0)
+            frequency, amplitude, peak = np.float32(1), np.float32(1), np.float32(0)
+            for _ in range(octaves):
+                total += _noise2(x * frequency, y * frequency,
+                                 np.float32(width) * frequency, np.float32(height) * frequency,
+                                 perm, gradients) * amplitude
+                peak += amplitude
+                frequency *= np.float32(lacunarity)
+                amplitude *= np.float32(persistence)
+            out[row, col] = total / peak
+    return out
+
+def pnoise_field(width: int, height: int, scale: float, offset: float, octaves: int,
+                 persistence: float, lacunarity: float) -> np.ndarray:
+    return _pnoise_field(width, height, float(scale), float(offset), octaves,
+                         float(persistence), float(lacunarity), PERMUTATION, GRADIENTS)
+
+@njit(parallel=True, cache=True)
+def normalize_range(field):
+    low, high = field.min(), field.max()
+    span = high - low
+    flat = field.reshape(-1)
+    for i in prange(flat.size):
+        flat[i] = (flat[i] - low) / span
+    return field
+
+@njit(parallel=True, cache=True)
+def normalize_sum(bases):
+    layers, height, width = bases.shape
+    for row in prange(height):
+        for col in range(width):
+            total = bases[0, row, col]
+            for layer in range(1, layers):
+                total += bases[layer, row, col]
+            for layer in range(layers):
+                bases[layer, row, col] /= total
+    return bases
+
+@njit(parallel=True, cache=True)
+def _mix(bases, colors, grain, grain_scale):
+    layers, height, width = bases.shape
+    out = np.empty((height, width, 3), dtype=np.uint8)
+    for row in prange(height):
+        for col in range(width):
+            for channel in range(3):
+                value = colors[0, channel] * bases[0, row, col]
+                for layer in range(1, layers):
+                    value += colors[layer, channel] * bases[layer, row, col]
+                value += grain[row, col, channel] * grain_scale
+                value = min(max(value, np.float32(0)), np.float32(1))
+                out[row, col, channel] = np.uint8(value * np.float32(255))
+    return out
+
+def mix(bases: np.ndarray, colors: np.ndarray, grain: np.ndarray, grain_scale: float) -> np.ndarray:
+    return _mix(np.ascontiguousarray(bases, dtype=np.float32), np.ascontiguousarray(colors, dtype=np.float32),
+                np.ascontiguousarray(grain, dtype=np.float32), np.float32(grain_scale))
@@ -0,0 +1,285 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from job_store import PostJobStore, FAILED
+from image_generator import render_quote_image
+from metrics import timed, replay_stages, QUEUE_DEPTH, RETRIES
+
+logger = logging.getLogger('PostPipeline')
+
+# imgbb deletes uploads after this many seconds (see InstagramPoster.upload_to_imgbb)
+IMGBB_EXPIRATION = 600
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+class PostPipeline:
+    """Runs a post job stage by stage, checkpointing artifacts so a restart resumes where it stopped"""
+    def __init__(self, job_store: PostJobStore, quote_generator, render_pool, latency_tracker=None,
+                 artifact_store=None):
+        self.job_store = job_store
+        self.quote_generator = quote_generator
+        self.render_pool = render_pool
+        self.latency_tracker = latency_tracker
+        # Rendered images are held in memory until their container exists; an
+        # ArtifactStore additionally keeps copies on disk so a restart can reuse them
+        self.artifact_store = artifact_store
+        self._images = {}
+        self.max_attempts = int(os.getenv('MAX_JOB_ATTEMPTS', 3))
+        # A slot's warm-up and publish jobs can overlap, so each job key gets its own lock
+        self._job_locks = {}
+        self._job_locks_lock = threading.Lock()
+
+    def _job_lock(self, job_key: str) -> threading.Lock:
+        with self._job_locks_lock:
+            return self._job_locks.setdefault(job_key, threading.Lock())
+
+    def _forget(self, job_key: str):
+        """Drop a finished job's lock; a late caller gets a new one and finds the job finished"""
+        with self._job_locks_lock:
+            self._job_locks.pop(job_key, None)
+
+    @contextmanager
+    def _timed(self, stage: str):
+        with timed(stage) as timer:
+            yield
+        if self.latency_tracker:
+            self.latency_tracker.record(stage, timer.seconds)
+
+    def prepare(self, job: dict, poster, quote_count: int = 1) -> dict:
+        """Run every stage up to a ready container, leaving only the publish call for the slot"""
+        key = job['job_key']
+        with self._job_lock(key):
+            try:
+                job = self.job_store.get(key)
+                if job['stage'] == 'published':
+                    return job
+                return self._advance(job, poster, quote_count)
+            finally:
+                if self.job_store.get(key)['stage'] in ('published', FAILED):
+                    self._forget(key)
+
+    def run(self, job: dict, poster, quote_count: int = 1) -> str:
+        """Drive the job to the published stage and return the media ID"""
+        key = job['job_key']
+        with self._job_lock(key):
+            try:
+                # Re-read in case a warm-up finished stages while we waited on the lock
+                job = self.job_store.get(key)
+                if job['stage'] == 'published':
+                    logger.info(f"[{key}] Already published as {job['media_id']}, skipping")
+                    return job['media_id']
+                # A warmed-up job only needs its container checked before publishing
+                if self.job_store.reached(job, 'container_created'):
+                    job = self.verify_containers(job, poster)
+                if not self.job_store.reached(job, 'container_created'):
+                    job = self._advance(job, poster, quote_count)
+                else:
+                    # Publishing alone is still an attempt, so a publish that keeps failing gives up too
+                    job = self._begin_attempt(job)
+                try:
+                    return self.publish(job, poster)
+                except Exception as e:
+                    self.job_store.update(key, last_error=str(e))
+                    raise
+            finally:
+                if self.job_store.get(key)['stage'] in ('published', FAILED):
+                    self._forget(key)
+                else:
+                    # A retry reads the images back from the artifact store or re-renders
+                    # them, rather than every failed job holding its PNGs in memory
+                    self._images.pop(key, None)
+
+    def _begin_attempt(self, job: dict) -> dict:
+        """Count another attempt at the job, marking it failed once it has used them all"""
+        key = job['job_key']
+        if job['attempts'] >= self.max_attempts:
+            self.job_store.update(key, stage=FAILED)
+            self.discard_images(job, remove_files=True)
+            raise Exception(f"Job {key} gave up after {job['attempts']} attempts")
+
+        if job['attempts'] > 0:
+            RETRIES.inc(operation='post_job')
+        return self.job_store.update(key, attempts=job['attempts'] + 1)
+
+    def _advance(self, job: dict, poster, quote_count: int) -> dict:
+        """Complete whichever stages before publishing are still outstanding"""
+        key = job['job_key']
+        job = self._begin_attempt(job)
+        try:
+            if not self.job_store.reached(job, 'generated'):
+                with self._timed('generate'):
+                    job = self.generate(job, quote_count)
+            if not poster.validate_credentials():
+                raise Exception("Credential validation failed")
+            if self.job_store.reached(job, 'container_created'):
+                job = self.verify_containers(job, poster)
+            # The images are only needed again if they still have to be uploaded
+            needs_upload = not self.job_store.reached(job, 'uploaded') or self.upload_expired(job)
+            if not self.job_store.reached(job, 'rendered') or (needs_upload and not self.artifacts_intact(job)):
+                with self._timed('render'):
+                    job = self.render(job)
+            if not self.job_store.reached(job, 'uploaded') or self.upload_expired(job):
+                with self._timed('upload'):
+                    job = self.upload(job, poster)
+            if not self.job_store.reached(job, 'container_created'):
+                with self._timed('container'):
+                    job = self.create_containers(job, poster)
+            return job
+        except Exception as e:
+            self.job_store.update(key, last_error=str(e))
+            raise
+
+    def generate(self, job: dict, quote_count: int) -> dict:
+        logger.info(f"[{job['job_key']}] 1. Generating {quote_count} quote(s)...")
+        quotes = []
+        for _ in range(quote_count):
+            quote_data = self.quote_generator.get_quote(caption=job['kind'] != 'carousel')
+            if quote_data:
+                quotes.append(quote_data)
+        if len(quotes) < (2 if job['kind'] == 'carousel' else 1):
+            raise Exception("Failed to generate quote")
+        for quote_data in quotes:
+            logger.info(f"Quote: {quote_data['quote']} ~ {quote_data['author']}")
+
+        if job['kind'] == 'carousel':
+            caption = self.quote_generator.carousel_caption(quotes)
+        else:
+            caption = quotes[0]['instagram_description']
+        return self.job_store.update(job['job_key'], stage='generated', quotes=quotes, caption=caption)
+
+    def render(self, job: dict) -> dict:
+        logger.info(f"[{job['job_key']}] 2. Rendering {len(job['quotes'])} image(s)...")
+        futures = [
+            self.render_pool.submit(
+                render_quote_image,
+                quote_data['quote'],
+                quote_data['author']
+            )
+            for quote_data in job['quotes']
+        ]
+        images = []
+        for future in futures:
+            png, observations, worker_pid = future.result()
+            if worker_pid != os.getpid():
+                # Stages timed in a render process never reached this process's metrics
+                replay_stages(observations)
+            images.append(png)
+        if not all(images):
+            raise Exception("Failed to generate image")
+        image_hashes = [sha256(png) for png in images]
+        self._images[job['job_key']] = images
+        image_paths = []
+        if self.artifact_store:
+            safe_key = ''.join(c if c.isalnum() or c in '-_' else '_' for c in job['job_key'])
+            image_paths = [self.artifact_store.put(f"{safe_key}_{i}.png", png) for i, png in enumerate(images)]
+        logger.info(f"Rendered {len(images)} image(s), {sum(len(png) for png in images) // 1024} KB in memory")
+        # A fresh render invalidates any earlier upload
+        return self.job_store.update(
+            job['job_key'], stage='rendered',
+            image_paths=image_paths, image_hashes=image_hashes, image_urls=[], uploaded_at=None
+        )
+
+    def images(self, job: dict):
+        """The job's rendered images, from memory or the artifact store, or None if any is lost or changed"""
+        images = self._images.get(job['job_key'])
+        if images is None and self.artifact_store and job['image_paths']:
+            images = [self.artifact_store.read(path) for path in job['image_paths']]
+        if not images or not job['image_hashes'] or len(images) != len(job['image_hashes']):
+            return None
+        for png, expected in zip(images, job['image_hashes']):
+            if png is None or sha256(png) != expected:
+                return None
+        self._images[job['job_key']] = images
+        return images
+
+    def discard_images(self, job: dict, remove_files: bool = False):
+        self._images.pop(job['job_key'], None)
+        if remove_files and self.artifact_store:
+            for path in job['image_paths']:
+                self.artifact_store.remove(path)
+
+    def artifacts_intact(self, job: dict) -> bool:
+        """Whether the rendered images are still available and unchanged"""
+        if self.job_store.reached(job, 'container_created'):
+            # Instagram already holds copies of the images
+            return True
+        if self.images(job) is None:
+            logger.warning(f"[{job['job_key']}] Rendered images are missing or changed, re-rendering")
+            return False
+        return True
+
+    def upload_expired(self, job: dict) -> bool:
+        if self.job_store.reached(job, 'container_created'):
+            return False
+        return not job['uploaded_at'] or time.time() - job['uploaded_at'] > IMGBB_EXPIRATION - 60
+
+    def upload(self, job: dict, poster) -> dict:
+        images = self.images(job)
+        if images is None:
+            raise Exception("Rendered images are no longer available")
+        logger.info(f"[{job['job_key']}] 3. Uploading {len(images)} image(s)...")
+        with ThreadPoolExecutor(max_workers=len(images)) as executor:
+            image_urls = list(executor.map(poster.upload_to_imgbb, images))
+        return self.job_store.update(job['job_key'], stage='uploaded', image_urls=image_urls, uploaded_at=time.time())
+
+    def create_containers(self, job: dict, poster) -> dict:
+        logger.info(f"[{job['job_key']}] 4. Creating media container(s)...")
+        if job['kind'] == 'carousel':
+            with ThreadPoolExecutor(max_workers=len(job['image_urls'])) as executor:
+                child_ids = list(executor.map(
+                    lambda url: poster.create_media_container(url, is_carousel_item=True),
+                    job['image_urls']
+                ))
+            with timed('container_wait'):
+                poster.wait_for_containers_ready(child_ids)
+            container_id = poster.create_media_container(caption=job['caption'], children=child_ids)
+        else:
+            child_ids = []
+            container_id = poster.create_media_container(job['image_urls'][0], job['caption'])
+        logger.info(f"Created container with ID: {container_id}")
+        with timed('container_wait'):
+            poster.wait_for_container_ready(container_id)
+        # Instagram has its own copies now
+        self._images.pop(job['job_key'], None)
+        return self.job_store.update(
+            job['job_key'], stage='container_created',
+            child_container_ids=child_ids, container_id=container_id
+        )
+
+    def verify_containers(self, job: dict, poster) -> dict:
+        """Check a resumed job's container is still usable, falling back to a fresh upload if not"""
+        status_code, status = poster.check_container_status(job['container_id'])
+        if status_code in ['ERROR', 'EXPIRED']:
+            logger.warning(f"[{job['job_key']}] Container {job['container_id']} is {status_code}, recreating it")
+            return self.job_store.update(
+                job['job_key'], stage='rendered',
+                image_urls=[], uploaded_at=None, child_container_ids=[], container_id=None
+            )
+        return job
+
+    def publish(self, job: dict, poster) -> str:
+        key = job['job_key']
+        logger.info(f"[{key}] 5. Publishing container {job['container_id']}...")
+        # A crash right after media_publish leaves the job one stage behind;
+        # the container reports PUBLISHED in that case, so don't publish twice
+        status_code, _ = poster.check_container_status(job['container_id'])
+        if status_code == 'PUBLISHED':
+            logger.info(f"[{key}] Container was already published before the restart")
+            media_id = None
+        else:
+            if status_code != 'FINISHED':
+                poster.wait_for_container_ready(job['container_id'])
+            with timed('publish'):
+                media_id = poster.publish_container(job['container_id'])
+
+        self.job_store.update(key, stage='published', media_id=media_id, last_error=None)
+        self.quote_generator.record_published(job['quotes'])
+        QUEUE_DEPTH.set(len(self.job_store.incomplete()), queue='post_jobs')
+        self.discard_images(job, remove_files=True)
+        logger.info(f"[{key}] Successfully published to Instagram. Media ID: {media_id}")
+        return media_id
@@ -0,0 +1,157 @@
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextvars
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger('Profiler')
+
+class _Run:
+    """One profiled run: the threads currently working on it and their cProfile results"""
+    def __init__(self):
+        self.threads = set()
+        self.profiles = []
+        self.lock = threading.Lock()
+
+# The run the current context belongs to; pools that copy the caller's context
+# (AccountManager.fan_out) carry it into their worker threads
+_current_run = contextvars.ContextVar('profiled_run', default=None)
+
+class _StackSampler(threading.Thread):
+    """Samples the stacks of one run's threads at a fixed interval and counts the collapsed stacks"""
+    def __init__(self, interval: float, run: _Run):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.run_state = run
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            with self.run_state.lock:
+                thread_ids = set(self.run_state.threads)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in thread_ids:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class RunProfiler:
+    """Opt-in profiling of whole posting runs
+
+    Each run gets a wall-clock stack sampler over the threads working on it (written as
+    collapsed stacks for flamegraph.pl / speedscope) and, unless PROFILE_MODE=sample,
+    cProfile on each of those threads (written as merged pstats). A thread works on a
+    run while it is inside thread() in the run's context. Only runs slower than
+    PROFILE_MIN_SECONDS are kept, and only the newest PROFILE_KEEP of those.
+    """
+    def __init__(self, enabled: bool = None, profile_dir: str = None):
+        if enabled is None:
+            enabled = os.getenv('PROFILE_RUNS', '').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self.profile_dir = Path(profile_dir) if profile_dir else Path(__file__).parent.parent / "history" / "profiles"
+        self.keep = int(os.getenv('PROFILE_KEEP', 20))
+        self.min_seconds = float(os.getenv('PROFILE_MIN_SECONDS', 0))
+        self.interval = float(os.getenv('PROFILE_INTERVAL', 0.01))
+        self.use_cprofile = os.getenv('PROFILE_MODE', 'full') != 'sample'
+        # cProfile can't be enabled on a thread twice, so one run is profiled at a
+        # time; a run that starts while another is being profiled goes unprofiled
+        self._run_lock = threading.Lock()
+
+    @contextmanager
+    def run(self, name: str):
+        """Profile a whole run, e.g. one generate_and_post"""
+        if not self.enabled or not self._run_lock.acquire(blocking=False):
+            yield
+            return
+        run = _Run()
+        token = _current_run.set(run)
+        sampler = _StackSampler(self.interval, run)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            with self.thread():
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_run.reset(token)
+            sampler.stop()
+            try:
+                if elapsed >= self.min_seconds:
+                    self._write(name, elapsed, sampler.stacks, run)
+            except Exception as e:
+                logger.error(f"Failed to write profile for {name}: {str(e)}")
+            finally:
+                self._run_lock.release()
+
+    @contextmanager
+    def thread(self):
+        """Profile the current thread while it works on the run of its context, if any"""
+        run = _current_run.get()
+        if run is None:
+            yield
+            return
+        thread_id = threading.get_ident()
+        with run.lock:
+            run.threads.add(thread_id)
+        profile = cProfile.Profile() if self.use_cprofile else None
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler already owns this thread
+                profile = None
+        try:
+            yield
+        finally:
+            with run.lock:
+                run.threads.discard(thread_id)
+            if profile is not None:
+                profile.disable()
+                with run.lock:
+                    run.profiles.append(profile)
+
+    def _write(self, name: str, elapsed: float, stacks: Counter, run: _Run):
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '-' for c in name)
+        base = self.profile_dir / f"{time.strftime('%Y%m%d-%H%M%S')}_{safe_name}_{int(elapsed * 1000)}ms"
+
+        with open(base.with_suffix('.collapsed'), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with run.lock:
+            profiles = [profile for profile in run.profiles if profile.getstats()]
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(str(base.with_suffix('.pstats')))
+
+        logger.info(f"Profile for {name} ({elapsed:.1f}s) written to {base}.*")
+        self._rotate()
+
+    def _rotate(self):
+        """Keep only the newest runs; each run is a group of files sharing a stem"""
+        runs = {}
+        for path in self.profile_dir.iterdir():
+            runs.setdefault(path.stem, []).append(path)
+        for stem in sorted(runs)[:-self.keep] if self.keep > 0 else []:
+            for path in runs[stem]:
+                path.unlink()
@@ -0,0 +1,142 @@
+"""Versioned Gemini instructions
+
+The instructions are the same on every request, so they are sent as the model's
+system_instruction and never stored in the chat history. Each request is just
+REQUEST, and the history holds only those short turns and the model's replies.
+
+Prompts are identified by a hash of their text with whitespace collapsed, which
+also recognizes the full prompts older versions stored as user turns.
+
+Context caching isn't used: Gemini only caches a prefix of at least 32,768 tokens
+on the 1.5 models, and these instructions are a few hundred. system_instruction
+still keeps them out of the history, which is resent with every request.
+"""
+import os
+import hashlib
+from typing import Any, Dict, List
+
+INSTRUCTIONS = {
+    # Sent as the user turn of every request until v2; kept so old history is recognized
+    'v1': """You are managing an Instagram account that posts daily, aesthetic, and thought-provoking science-related quotes.
+        Your goal is to create content that both inspires and educates, while optimizing for maximum reach and engagement.
+        Select powerful quotes from the realms of science, computer science, physics, chemistry, or engineering—without diluting
+        their depth or complexity to suit general audience comprehension. Let the gravity and intellectual rigor of the quotes shine through.
+        Try not to post things that do not align with your audience's interests. Grandeur, sophistication, and satisfaction
+        are the hallmarks of a well-crafted quote.
+
+        For each quote, craft a compelling Instagram description that breaks down its essence in an engaging and relatable manner,
+        encouraging the audience to interact and reflect. Use best practices for Instagram, such as relevant hashtags, analogies,
+        and calls to action, to enhance visibility and connection with the audience. Do not repeat a quote that has been provided
+        in the chat history, if provided so. Using the chat history, try not to create an author bias on the quotes,
+        feel free to use infinite quotes from a single author, BUT do not use quotes from the SAME author more than once in 3 generations to
+        keep your content fresh and engaging.
+
+        Important: DO NOT include citations/references/links in your response. Only provide the quote, author, and Instagram description
+        in the requested JSON format. Including anything else will lead to breaking the API constraints. STRICTLY follow the Structured Output Schema provided.""",
+    'v2': """You are managing an Instagram account that posts daily, aesthetic, and thought-provoking science-related quotes.
+        Your goal is to create content that both inspires and educates, while optimizing for maximum reach and engagement.
+        Select powerful quotes from the realms of science, computer science, physics, chemistry, or engineering—without diluting
+        their depth or complexity to suit general audience comprehension. Let the gravity and intellectual rigor of the quotes shine through.
+        Try not to post things that do not align with your audience's interests. Grandeur, sophistication, and satisfaction
+        are the hallmarks of a well-crafted quote.
+
+        Each user message asks for the next post. For each quote, craft a compelling Instagram description that breaks down its
+        essence in an engaging and relatable manner, encouraging the audience to interact and reflect. Use best practices for
+        Instagram, such as relevant hashtags, analogies, and calls to action, to enhance visibility and connection with the audience.
+        Never repeat a quote from earlier in the conversation. Avoid an author bias: feel free to use infinite quotes from a single
+        author, BUT do not use quotes from the SAME author more than once in 3 generations to keep your content fresh and engaging.
+
+        Important: DO NOT include citations/references/links in your response. Only provide the quote, author, and Instagram description
+        in the requested JSON format. Including anything else will lead to breaking the API constraints. STRICTLY follow the Structured Output Schema provided.""",
+    # Captions are composed locally by caption_engine.py from v3 on, so only the quote is asked for
+    'v3': """You are choosing quotes for an Instagram account that posts daily, aesthetic, and thought-provoking science-related quotes.
+        Select powerful quotes from the realms of science, computer science, physics, chemistry, or engineering—without diluting
+        their depth or complexity to suit general audience comprehension. Let the gravity and intellectual rigor of the quotes shine through.
+        Try not to post things that do not align with your audience's interests. Grandeur, sophistication, and satisfaction
+        are the hallmarks of a well-crafted quote.
+
+        Each user message asks for the next post. Never repeat a quote from earlier in the conversation. Avoid an author bias:
+        feel free to use infinite quotes from a single author, BUT do not use quotes from the SAME author more than once in
+        3 generations to keep your content fresh and engaging.
+
+        Important: DO NOT include citations/references/links in your response. Only provide the quote and its author
+        in the requested JSON format. STRICTLY follow the Structured Output Schema provided.""",
+    # From v4 each reply offers several candidates, and the least similar to recent posts is used
+    'v4': """You are choosing quotes for an Instagram account that posts daily, aesthetic, and thought-provoking science-related quotes.
+        Select powerful quotes from the realms of science, computer science, physics, chemistry, or engineering—without diluting
+        their depth or complexity to suit general audience comprehension. Let the gravity and intellectual rigor of the quotes shine through.
+        Try not to post things that do not align with your audience's interests. Grandeur, sophistication, and satisfaction
+        are the hallmarks of a well-crafted quote.
+
+        Each user message asks for the next post. Offer {candidates} candidate quote(s), each by a different author and on a
+        different theme. Never repeat a quote from earlier in the conversation. Avoid an author bias: feel free to use infinite
+        quotes from a single author, BUT do not use quotes from the SAME author more than once in 3 generations to keep your
+        content fresh and engaging. Vary the themes too: don't dwell on one idea, such as curiosity, across consecutive posts.
+
+        Important: DO NOT include citations/references/links in your response. Only provide the quotes and their authors
+        in the requested JSON format. STRICTLY follow the Structured Output Schema provided.""",
+}
+
+CURRENT_VERSION = 'v4'
+
+# The variable part of each request
+REQUEST = "Next post."
+# Sent instead when Gemini stops a reply for recitation
+STRICT_REQUEST = "Generate ONLY a JSON object with a list of quotes, each with exactly the fields quote and author. No citations or references."
+# Sent once when every candidate is too close to recent posts
+DIVERSE_REQUEST = "Those are too close to recent posts. Next post, on a clearly different theme."
+
+# For the optional rich captions: one short, cheap call per post outside the chat
+CAPTION_INSTRUCTIONS = """You write the middle of Instagram captions for a science quotes account. Given a quote and its
+    author, write two or three sentences that unpack the idea in an engaging, relatable way, with an analogy if one fits.
+    Plain text only: no hashtags, no emoji, no quotation of the quote itself, no citations or links."""
+
+def prompt_hash(text: str) -> str:
+    """sha256 of the text with whitespace collapsed, so re-indented copies match"""
+    return hashlib.sha256(' '.join(str(text).split()).encode('utf-8')).hexdigest()
+
+KNOWN_HASHES = {prompt_hash(text) for text in (*INSTRUCTIONS.values(), REQUEST, STRICT_REQUEST, DIVERSE_REQUEST)} | {
+    # The "6 generations" copy db_sync used to insert when restoring history from the cloud
+    'bbb5c35e71b21a5f0875a71ba883a8162a120891f175fe60f210287c3a267761',
+    # STRICT_REQUEST before v3, which still asked for instagram_description
+    '4ec40eabd08ad15acf33e2d989c9311b40b2f70505f89e23e2175e70f8da136b',
+    # STRICT_REQUEST in v3, for a single quote
+    '9391b79dcfa844aba79049bad175962bf20816d810158ec64f1f1757b1693dee',
+}
+
+def system_instruction(version: str = None, candidates: int = 1) -> str:
+    """The instructions for `version`, or PROMPT_VERSION (default CURRENT_VERSION)"""
+    version = version or os.getenv('PROMPT_VERSION') or CURRENT_VERSION
+    if version not in INSTRUCTIONS:
+        raise ValueError(f"Unknown PROMPT_VERSION {version!r}, expected one of {', '.join(INSTRUCTIONS)}")
+    return INSTRUCTIONS[version].format(candidates=candidates)
+
+def caption_request(quote: str, author: str) -> str:
+    return f"Quote: {quote}\nAuthor: {author}"
+
+def is_prompt_entry(entry: Dict[str, Any]) -> bool:
+    """Whether a history entry is a user turn holding a known prompt rather than content"""
+    if entry.get('role') != 'user':
+        return False
+    parts = entry.get('parts')
+    if not isinstance(parts, list) or not parts:
+        return False
+    part = parts[0]
+    text = part.get('text', '') if isinstance(part, dict) else part
+    return prompt_hash(text) in KNOWN_HASHES
+
+def with_requests(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """History with prompt turns replaced by one REQUEST turn before each model reply
+
+    Turns stored by older versions carry the whole instruction prompt; this drops
+    them to the short request, and restores the user turns Gemini needs between
+    model replies when the history was stored without them.
+    """
+    compacted = []
+    for entry in history:
+        if is_prompt_entry(entry):
+            continue
+        if entry.get('role') == 'model':
+            compacted.append({'role': 'user', 'parts': [REQUEST]})
+        compacted.append(entry)
+    return compacted
@@ -0,0 +1,128 @@
+import time
+import sqlite3
+import threading
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+
+logger = logging.getLogger('QuotaAccountant')
+
+class QuotaAccountant:
+    """Persistent sliding-window record of publishes per account
+
+    Every successful publish is stored locally, so remaining capacity can be
+    predicted without asking the Graph API and jobs can be held back before
+    any rendering or uploading happens.
+    """
+    def __init__(self, db_path: str = None, limit: int = 20, window_seconds: int = 24 * 3600):
+        self.db_path = Path(db_path) if db_path else Path(__file__).parent.parent / "history" / "publishing_quota.db"
+        self.db_path.parent.mkdir(exist_ok=True)
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        # Publishes that have been reserved by running jobs but not yet recorded
+        self._in_flight = {}
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS publishes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    account TEXT NOT NULL,
+                    published_at REAL NOT NULL,
+                    media_id TEXT
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_publishes_account_time ON publishes (account, published_at)"
+            )
+
+    def _window_start(self, now: float) -> float:
+        return now - self.window_seconds
+
+    def _used(self, account: str, now: float) -> int:
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM publishes WHERE account = ? AND published_at > ?",
+            (account, self._window_start(now))
+        ).fetchone()
+        return row[0]
+
+    def used(self, account: str, now: float = None) -> int:
+        """Publishes recorded for the account within the current window"""
+        with self._lock:
+            return self._used(account, now or time.time())
+
+    def remaining(self, account: str, now: float = None) -> int:
+        """Publishes still allowed, counting jobs that have reserved a slot"""
+        with self._lock:
+            used = self._used(account, now or time.time()) + self._in_flight.get(account, 0)
+            return max(0, self.limit - used)
+
+    def next_available(self, account: str, now: float = None) -> datetime:
+        """When the account will next have capacity, in UTC"""
+        now = now or time.time()
+        with self._lock:
+            used = self._used(account, now) + self._in_flight.get(account, 0)
+            if used < self.limit:
+                return datetime.fromtimestamp(now, timezone.utc)
+            # Capacity frees up as the oldest publishes slide out of the window
+            overflow = used - self.limit
+            row = self._conn.execute(
+                "SELECT published_at FROM publishes WHERE account = ? AND published_at > ? "
+                "ORDER BY published_at LIMIT 1 OFFSET ?",
+                (account, self._window_start(now), overflow)
+            ).fetchone()
+            if not row:
+                # Only in-flight reservations are blocking; they settle within one post
+                return datetime.fromtimestamp(now, timezone.utc)
+            return datetime.fromtimestamp(row[0] + self.window_seconds, timezone.utc)
+
+    def try_reserve(self, account: str) -> bool:
+        """Reserve one publish for a job about to start, if capacity allows"""
+        with self._lock:
+            now = time.time()
+            used = self._used(account, now) + self._in_flight.get(account, 0)
+            if used >= self.limit:
+                return False
+            self._in_flight[account] = self._in_flight.get(account, 0) + 1
+            return True
+
+    def release(self, account: str):
+        """Drop a reservation, whether or not the job published"""
+        with self._lock:
+            if self._in_flight.get(account, 0) > 0:
+                self._in_flight[account] -= 1
+
+    def record(self, account: str, media_id: str = None, published_at: float = None):
+        """Record a successful publish"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO publishes (account, published_at, media_id) VALUES (?, ?, ?)",
+                (account, published_at or time.time(), media_id)
+            )
+            self._prune(time.time())
+
+    def sync(self, account: str, api_usage: int):
+        """Reconcile with the usage reported by the Graph API
+
+        Posts made outside this process are invisible locally, so when the API
+        reports more usage than we know about, placeholder publishes are added.
+        """
+        with self._lock, self._conn:
+            now = time.time()
+            missing = api_usage - self._used(account, now)
+            if missing > 0:
+                logger.info(f"Recording {missing} publish(es) for '{account}' made outside this process")
+                self._conn.executemany(
+                    "INSERT INTO publishes (account, published_at, media_id) VALUES (?, ?, NULL)",
+                    [(account, now)] * missing
+                )
+
+    def _prune(self, now: float):
+        self._conn.execute(
+            "DELETE FROM publishes WHERE published_at <= ?",
+            (self._window_start(now),)
+        )
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,126 @@
+import os
+import re
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger('QuoteCorpus')
+
+DEFAULT_SEED_FILE = Path(__file__).parent.parent / "data" / "quotes.json"
+
+def quote_key(quote: str) -> str:
+    """Lowercase words only, so punctuation and quote marks don't stop a match"""
+    return ' '.join(re.findall(r"\w+", quote.lower()))
+
+class QuoteCorpus:
+    """Curated quotes in SQLite, sampled when Gemini is slow or failing
+
+    Seeded from data/quotes.json (QUOTE_CORPUS_FILE), indexed by author and field,
+    and tracking how often and when each quote was last posted. sample() picks
+    among the least used quotes, weighted, skipping recent authors, so fallbacks
+    don't repeat until the whole corpus has been used.
+    """
+    def __init__(self, db_path: str = None, seed_file: str = None):
+        self.db_path = Path(db_path) if db_path else Path(__file__).parent.parent / "history" / "quote_corpus.db"
+        self.db_path.parent.mkdir(exist_ok=True)
+        self.seed_file = Path(seed_file or os.getenv('QUOTE_CORPUS_FILE') or DEFAULT_SEED_FILE)
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Losing the last few usage updates in a power cut is harmless; waiting for fsync on
+        # every sample is what would make a fallback slow
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS quotes (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL UNIQUE,
+                    quote TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    field TEXT NOT NULL,
+                    weight REAL NOT NULL DEFAULT 1,
+                    uses INTEGER NOT NULL DEFAULT 0,
+                    last_used REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_quotes_author ON quotes (author)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_quotes_field ON quotes (field, uses)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_quotes_uses ON quotes (uses, last_used)")
+        self.seed()
+
+    def seed(self) -> int:
+        """Add any quotes in the seed file that aren't in the database yet; returns how many"""
+        if not self.seed_file.exists():
+            logger.warning(f"No quote corpus at {self.seed_file}, fallback quotes are unavailable")
+            return 0
+        with open(self.seed_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        rows = [
+            (quote_key(entry['quote']), entry['quote'], entry['author'],
+             entry.get('field', 'science'), float(entry.get('weight', 1)))
+            for entry in entries
+        ]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO quotes (key, quote, author, field, weight) VALUES (?, ?, ?, ?, ?)", rows)
+            return self._conn.total_changes - before
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM quotes").fetchone()[0]
+
+    def recent_authors(self, count: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT author FROM quotes WHERE last_used IS NOT NULL ORDER BY last_used DESC LIMIT ?",
+                (count,)).fetchall()
+        return [row['author'] for row in rows]
+
+    def sample(self, exclude_authors=(), field: str = None) -> dict:
+        """A weighted pick among the least used quotes, marked used; None if the corpus is empty
+
+        Authors in exclude_authors are skipped unless that leaves nothing, and so is
+        a field filter that matches nothing.
+        """
+        exclude_authors = list(exclude_authors)
+        with self._lock:
+            for authors, in_field in ((exclude_authors, field), ([], field), ([], None)):
+                clauses, params = [], []
+                if in_field:
+                    clauses.append("field = ?")
+                    params.append(in_field)
+                if authors:
+                    clauses.append(f"author NOT IN ({', '.join('?' * len(authors))})")
+                    params += authors
+                where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+                # Least used tier first, so nothing repeats until everything eligible has been used
+                rows = self._conn.execute(f"""
+                    SELECT id, quote, author, field, weight FROM quotes
+                    WHERE uses = (SELECT MIN(uses) FROM quotes {where}) {'AND ' + ' AND '.join(clauses) if clauses else ''}
+                """, params * 2).fetchall()
+                if rows:
+                    break
+            else:
+                return None
+            row = random.choices(rows, weights=[row['weight'] for row in rows])[0]
+            with self._conn:
+                self._conn.execute("UPDATE quotes SET uses = uses + 1, last_used = ? WHERE id = ?",
+                                   (time.time(), row['id']))
+        return {'quote': row['quote'], 'author': row['author'], 'field': row['field']}
+
+    def close(self):
+        self._conn.close()
+
+    def mark_used(self, quote: str) -> bool:
+        """Record that a quote was posted from elsewhere, so the fallback doesn't repeat it soon"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE quotes SET uses = uses + 1, last_used = ? WHERE key = ?",
+                                        (time.time(), quote_key(quote)))
+            return cursor.rowcount > 0
@@ -1,72 +1,182 @@
 import os
 import json
-import google.generativeai as genai
-from google.ai.generativelanguage_v1beta.types import content
 from typing import Dict, List
 from dotenv import load_dotenv
 import pickle
+import logging
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from pathlib import Path
 from db_sync import DatabaseSync
+from caption_engine import CaptionEngine
+from quote_corpus import QuoteCorpus
+from diversity_index import DiversityIndex
+import prompts
+from metrics import timed, count_api_call, RETRIES, QUOTE_SOURCES
 
 load_dotenv()
 
+logger = logging.getLogger('QuoteGenerator')
+
 class QuoteGenerator:
-    def __init__(self):
-        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    def __init__(self, history_dir=None):
+        # Create a directory to store chat history
+        self.history_dir = Path(history_dir or Path(os.path.dirname(os.path.dirname(__file__))) / "history")
+        self.history_dir.mkdir(exist_ok=True)
+        self.history_file = self.history_dir / "chat_history.pkl"
+        
+        # Accounts are posted concurrently. Each request is a stateless call that carries
+        # the shared history, so calls run in parallel and only loading and recording
+        # turns in the history are serialized
+        self._lock = threading.Lock()
+        
+        # The SDK, Supabase client and chat history are loaded by warm_up() or the first quote
+        self._ready = False
+        self.model = None
+        self.db_sync = None
+        self.caption_model = None
+        self.chat_history = []
+
+        # Gemini only picks the quote; the caption is composed locally unless RICH_CAPTIONS
+        # adds a short second call, to a cheaper model, for the caption's middle paragraph
+        self.rich_captions = os.getenv('RICH_CAPTIONS', '0') == '1'
+        self.caption_engine = CaptionEngine(
+            state_file=self.history_dir / "caption_state.json",
+            describe=self.describe if self.rich_captions else None,
+        )
+
+        # Gemini gets QUOTE_DEADLINE_SECONDS (0 waits indefinitely); past that, or if it
+        # fails, the quote comes from the local corpus so the slot is still filled on time
+        self.deadline = float(os.getenv('QUOTE_DEADLINE_SECONDS', 60))
+        self.corpus = QuoteCorpus(db_path=self.history_dir / "quote_corpus.db")
+        # Same spacing rule the prompt gives Gemini: no author twice in 3 quotes
+        self.recent_authors = deque(reversed(self.corpus.recent_authors(3)), maxlen=3)
+        # Gemini offers QUOTE_CANDIDATES quotes per request and the one least similar
+        # to recent posts is used
+        self.candidates = max(int(os.getenv('QUOTE_CANDIDATES', 3)), 1)
+        self.diversity = DiversityIndex(path=self.history_dir / "diversity_index.npz")
+        # GEMINI_WORKERS calls at once; calls that overran their deadline hold their
+        # worker, so a stuck Gemini makes later calls queue rather than pile up
+        self._executor = ThreadPoolExecutor(max_workers=max(int(os.getenv('GEMINI_WORKERS', 4)), 1),
+                                            thread_name_prefix='gemini')
+        # When each running call started, so a queued call can tell a busy Gemini from a stuck one
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def warm_up(self):
+        """Load the model, Supabase client and chat history ahead of the first quote"""
+        with self._lock:
+            self._load()
+
+    def close(self):
+        """Stop the Gemini worker, letting a call in flight finish, and close the stores"""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        if self.db_sync is not None:
+            self.db_sync.close()
+        self.corpus.close()
+
+    def _load(self):
+        if self._ready:
+            return
+        # The Gemini SDK takes most of the bot's import time, so it is loaded here
+        # rather than at module level, keeping CLI tools that import this module fast
+        import google.generativeai as genai
+        from google.ai.generativelanguage_v1beta.types import content
+        # GEMINI_API_ENDPOINT points the client at another host, e.g. the load harness stand-in
+        endpoint = os.getenv("GEMINI_API_ENDPOINT")
+        if endpoint:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"), transport="rest",
+                            client_options={"api_endpoint": endpoint})
+        else:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
         self.generation_config = {
             "temperature": 0.75,
             "top_p": 0.95,
             "top_k": 40,
-            "max_output_tokens": 8192,
+            # A quote and author are well under 100 tokens
+            "max_output_tokens": 128 * self.candidates,
             "response_schema": content.Schema(
                 type=content.Type.OBJECT,
                 enum=[],
-                required=["quote", "author", "instagram_description"],
+                required=["quotes"],
                 properties={
-                    "quote": content.Schema(
-                        type=content.Type.STRING,
-                        description="A thought-provoking quote related to science, engineering, physics, mathematics, chemistry or related fields.",
-                    ),
-                    "author": content.Schema(
-                        type=content.Type.STRING,
-                        description="The author of the quote.",
-                    ),
-                    "instagram_description": content.Schema(
-                        type=content.Type.STRING,
-                        description="An engaging description to make the quote relatable, inspiring, and impactful. Includes hashtags, a call to action, and aesthetic vibes.",
+                    "quotes": content.Schema(
+                        type=content.Type.ARRAY,
+                        items=content.Schema(
+                            type=content.Type.OBJECT,
+                            enum=[],
+                            required=["quote", "author"],
+                            properties={
+                                "quote": content.Schema(
+                                    type=content.Type.STRING,
+                                    description="A thought-provoking quote related to science, engineering, physics, mathematics, chemistry or related fields.",
+                                ),
+                                "author": content.Schema(
+                                    type=content.Type.STRING,
+                                    description="The author of the quote.",
+                                ),
+                            },
+                        ),
                     ),
                 },
             ),
             "response_mime_type": "application/json",
         }
+        # The instructions go in once as the system instruction; each request is the
+        # history so far plus prompts.REQUEST
         self.model = genai.GenerativeModel(
             model_name="gemini-1.5-pro",
             generation_config=self.generation_config,
+            system_instruction=prompts.system_instruction(candidates=self.candidates),
         )
-        
-        # Create a directory to store chat history
-        self.history_dir = Path(os.path.dirname(os.path.dirname(__file__))) / "history"
-        self.history_dir.mkdir(exist_ok=True)
-        self.history_file = self.history_dir / "chat_history.pkl"
+        if self.rich_captions:
+            self.caption_model = genai.GenerativeModel(
+                model_name=os.getenv("CAPTION_MODEL", "gemini-1.5-flash"),
+                generation_config={"temperature": 0.9, "max_output_tokens": 200},
+                system_instruction=prompts.CAPTION_INSTRUCTIONS,
+            )
         
         # Initialize database sync
-        self.db_sync = DatabaseSync()
+        self.db_sync = DatabaseSync(history_dir=self.history_dir)
         
         # Load existing chat history if it exists
         if self.history_file.exists():
             try:
                 with open(self.history_file, 'rb') as f:
-                    self.chat_history = pickle.load(f)
+                    # Drops the full prompts older versions stored with every turn
+                    self.chat_history = prompts.with_requests(pickle.load(f))
             except:
                 self.chat_history = []
         else:
             self.chat_history = []
             
-        self.initialize_chat()
+        if not self.diversity.ensure():
+            # First run with the index: start it from the quotes already in the chat history
+            self.diversity.add([self.diversity_text(quote_data) for quote_data in self.history_quotes()])
+        self._ready = True
+
+    def history_quotes(self) -> List[Dict]:
+        """Quotes from single-quote replies in the chat history; which of several candidates was used isn't recorded"""
+        quotes = []
+        for entry in self.chat_history:
+            if entry.get('role') != 'model' or not entry.get('parts'):
+                continue
+            part = entry['parts'][0]
+            try:
+                quote_data = json.loads(part.get('text', '') if isinstance(part, dict) else part)
+            except (TypeError, ValueError):
+                continue
+            if isinstance(quote_data, dict) and 'quote' in quote_data and 'author' in quote_data:
+                quotes.append(quote_data)
+        return quotes
+
+    @staticmethod
+    def diversity_text(quote_data: Dict) -> str:
+        # The author is included so runs of one author's quotes also count as similar
+        return f"{quote_data['quote']} {quote_data['author']}"
 
-    def initialize_chat(self):
-        self.chat_session = self.model.start_chat(history=self.chat_history)
-        
     def save_history(self):
         with open(self.history_file, 'wb') as f:
             pickle.dump(self.chat_history, f)
@@ -74,82 +184,208 @@ class QuoteGenerator:
         # Sync with Supabase
         self.db_sync.sync_databases()
         
-    def get_quote(self) -> Dict:
-        prompt = """You are managing an Instagram account that posts daily, aesthetic, and thought-provoking science-related quotes.        
-        Your goal is to create content that both inspires and educates, while optimizing for maximum reach and engagement. 
-        Select powerful quotes from the realms of science, computer science, physics, chemistry, or engineering—without diluting 
-        their depth or complexity to suit general audience comprehension. Let the gravity and intellectual rigor of the quotes shine through.
-        Try not to post things that do not align with your audience's interests. Grandeur, sophistication, and satisfaction 
-        are the hallmarks of a well-crafted quote.
-
-        For each quote, craft a compelling Instagram description that breaks down its essence in an engaging and relatable manner, 
-        encouraging the audience to interact and reflect. Use best practices for Instagram, such as relevant hashtags, analogies, 
-        and calls to action, to enhance visibility and connection with the audience. Do not repeat a quote that has been provided 
-        in the chat history, if provided so. Using the chat history, try not to create an author bias on the quotes,
-        feel free to use infinite quotes from a single author, BUT do not use quotes from the SAME author more than once in 3 generations to
-        keep your content fresh and engaging.
-        
-        Important: DO NOT include citations/references/links in your response. Only provide the quote, author, and Instagram description 
-        in the requested JSON format. Including anything else will lead to breaking the API constraints. STRICTLY follow the Structured Output Schema provided."""
-        
-        strict_prompt = "Generate ONLY a JSON object with these exact fields: quote, author, and instagram_description. No citations or references."
+    def _send(self, contents: List[Dict], message: str):
+        """Send message after contents (earlier turns) to Gemini, timing and counting the call"""
+        try:
+            with timed('gemini'):
+                response = self.model.generate_content(contents + [{"role": "user", "parts": [message]}])
+        except Exception:
+            count_api_call('gemini', 'generate_content', 'error')
+            raise
+        count_api_call('gemini', 'generate_content', 'ok')
+        return response
 
+    def describe(self, quote: str, author: str) -> str:
+        """A short paragraph about the quote for rich captions; one call, outside the chat"""
         try:
-            response = self.chat_session.send_message(prompt)
-            
-            # Check if response has citations
-            if hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'finish_reason') and candidate.finish_reason == 'RECITATION':
-                    # If we got a citation, try again with a more strict prompt
-                    response = self.chat_session.send_message(strict_prompt)
-            
-            # Get the actual text content
-            content = response.text if hasattr(response, 'text') else response.parts[0].text
-            
-            # Clean the response - remove any markdown formatting or extra content
-            content = content.strip()
-            if content.startswith('```json'):
-                content = content[7:]
-            if content.startswith('```'):
-                content = content[3:]
-            if content.endswith('```'):
-                content = content[:-3]
-            content = content.strip()
-            
-            # Try to extract just the JSON part if there's extra text
-            try:
-                start_idx = content.find('{')
-                end_idx = content.rfind('}') + 1
-                if start_idx >= 0 and end_idx > start_idx:
-                    content = content[start_idx:end_idx]
-            except:
-                pass
-            
-            quote_data = json.loads(content)
-            
-            # Validate the required fields
-            required_fields = ['quote', 'author', 'instagram_description']
-            if not all(field in quote_data for field in required_fields):
-                raise ValueError("Missing required fields in response")
-            
-            # Update chat history
-            self.chat_history.extend([
-                {"role": "user", "parts": [prompt]},
-                {"role": "model", "parts": [response.text]}
-            ])
-            
-            # Save updated history
-            self.save_history()
-            
-            # Check token count and reset if needed
-            if len(str(self.chat_history)) > 800000:  # Conservative limit
-                self.chat_history = []
-                self.initialize_chat()
-                self.save_history()
-            
+            with timed('gemini_caption'):
+                response = self.caption_model.generate_content(prompts.caption_request(quote, author))
+        except Exception:
+            count_api_call('gemini', 'generate_content', 'error')
+            raise
+        count_api_call('gemini', 'generate_content', 'ok')
+        return response.text
+
+    def get_quote(self, caption: bool = True) -> Dict:
+        """The next quote, from Gemini or the corpus; caption=False leaves out instagram_description
+
+        Carousels pass caption=False and compose one caption for all their quotes
+        with carousel_caption(), so the hashtag rotation moves once per post.
+        """
+        call = {'started': threading.Event()}
+        future = self._executor.submit(self._generate, call)
+        try:
+            # The deadline covers the call itself, not time spent queued behind other quotes
+            if not self._wait_for_start(call['started']):
+                future.cancel()
+                raise TimeoutError()
+            remaining = self.deadline - (time.monotonic() - call['at']) if self.deadline else None
+            quote_data = future.result(timeout=None if remaining is None else max(remaining, 0))
+            reason = 'error'
+        except TimeoutError:
+            # The call carries on in the background; its reply still lands in the chat history
+            quote_data, reason = None, 'deadline'
+        except Exception as e:
+            # Loading the SDK, Supabase client or history failed
+            print(f"Error generating quote: {e}")
+            quote_data, reason = None, 'error'
+        if quote_data:
+            quote_data['source'] = 'gemini'
+            self.corpus.mark_used(quote_data['quote'])
+        else:
+            quote_data = self.corpus.sample(exclude_authors=self.recent_authors)
+            if not quote_data:
+                return None
+            quote_data['source'] = 'corpus'
+            logger.warning(f"Gemini {'missed the deadline' if reason == 'deadline' else 'failed'}, "
+                           f"using a corpus quote by {quote_data['author']}")
+            with self._lock:
+                self.recent_authors.append(quote_data['author'])
+        QUOTE_SOURCES.inc(source=quote_data['source'])
+        # Outside the lock so a rich caption doesn't hold up the next quote
+        if caption:
+            quote_data['instagram_description'] = self.caption_engine.compose(quote_data['quote'], quote_data['author'])
+        return quote_data
+
+    def carousel_caption(self, quotes: list) -> str:
+        return self.caption_engine.compose_carousel(quotes)
+
+    def record_published(self, quotes: list):
+        """Add a published post's quotes to the diversity index
+
+        Quotes that were generated but never published (a failed job, or a slot
+        skipped for quota) are left out, so they don't push later candidates away.
+        """
+        try:
+            self.diversity.add([self.diversity_text(quote_data) for quote_data in quotes])
+        except Exception as e:
+            logger.warning(f"Could not add the published quotes to the diversity index: {e}")
+
+    def _wait_for_start(self, started: threading.Event) -> bool:
+        """Wait for a queued call to start; False once every call ahead of it has overrun the deadline"""
+        if not self.deadline:
+            started.wait()
+            return True
+        while not started.wait(timeout=min(1.0, self.deadline)):
+            now = time.monotonic()
+            with self._running_lock:
+                stuck = self._running and all(now - at > self.deadline for at in self._running.values())
+            if stuck:
+                return False
+        return True
+
+    def _generate(self, call: dict = None) -> Dict:
+        token = object()
+        with self._running_lock:
+            self._running[token] = started_at = time.monotonic()
+        if call is not None:
+            call['at'] = started_at
+            call['started'].set()
+        try:
+            with self._lock:
+                self._load()
+            return self._get_quote()
+        finally:
+            with self._running_lock:
+                del self._running[token]
+
+    def _get_quote(self) -> Dict:
+        with self._lock:
+            history = list(self.chat_history)
+        turns = []
+        try:
+            candidates = self._ask(history, turns, prompts.REQUEST)
+            with self._lock:
+                quote_data, similarity = self._least_similar(candidates)
+            if similarity > self.diversity.threshold:
+                # Everything offered is close to a recent post; ask once more, then take the best
+                RETRIES.inc(operation='gemini_diversity')
+                try:
+                    candidates += self._ask(history, turns, prompts.DIVERSE_REQUEST)
+                except Exception as e:
+                    print(f"Error asking for a more diverse quote: {e}")
+            # Choosing and recording are serialized so concurrent requests don't take the same author
+            with self._lock:
+                quote_data, similarity = self._least_similar(candidates)
+                self.recent_authors.append(quote_data['author'])
+                self._record(turns)
+            logger.info(f"Chose 1 of {len(candidates)} candidate(s), similarity {similarity:.2f} to recent posts")
             return quote_data
-            
+
         except Exception as e:
             print(f"Error generating quote: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def _least_similar(self, candidates: List[Dict]) -> tuple:
+        """The candidate least similar to recent posts, avoiding authors used in the last 3 posts"""
+        similarity = self.diversity.similarity([self.diversity_text(quote_data) for quote_data in candidates])
+        recent = set(self.recent_authors)
+        best = min(range(len(candidates)),
+                   key=lambda i: (candidates[i]['author'] in recent, similarity[i]))
+        return candidates[best], float(similarity[best])
+
+    def _ask(self, history: List[Dict], turns: List[Dict], message: str) -> List[Dict]:
+        """Send one request after history and this exchange's earlier turns, and return the candidate quotes
+
+        The request and reply are appended to turns, which _record() adds to the history.
+        """
+        response = self._send(history + turns, message)
+
+        # Check if response has citations
+        if hasattr(response, 'candidates') and response.candidates:
+            candidate = response.candidates[0]
+            if hasattr(candidate, 'finish_reason') and candidate.finish_reason == 'RECITATION':
+                # If we got a citation, try again with a more strict prompt
+                RETRIES.inc(operation='gemini_recitation')
+                message = prompts.STRICT_REQUEST
+                response = self._send(history + turns, message)
+
+        # Get the actual text content
+        content = response.text if hasattr(response, 'text') else response.parts[0].text
+
+        # Clean the response - remove any markdown formatting or extra content
+        content = content.strip()
+        if content.startswith('```json'):
+            content = content[7:]
+        if content.startswith('```'):
+            content = content[3:]
+        if content.endswith('```'):
+            content = content[:-3]
+        content = content.strip()
+
+        # Try to extract just the JSON part if there's extra text
+        try:
+            start_idx = content.find('{')
+            end_idx = content.rfind('}') + 1
+            if start_idx >= 0 and end_idx > start_idx:
+                content = content[start_idx:end_idx]
+        except:
+            pass
+
+        data = json.loads(content)
+        # Replies from before candidates were introduced hold a single quote
+        candidates = data.get('quotes', [data]) if isinstance(data, dict) else []
+
+        # Validate the required fields
+        required_fields = ['quote', 'author']
+        candidates = [quote_data for quote_data in candidates
+                      if isinstance(quote_data, dict) and all(field in quote_data for field in required_fields)]
+        if not candidates:
+            raise ValueError("Missing required fields in response")
+
+        turns.extend([
+            {"role": "user", "parts": [message]},
+            {"role": "model", "parts": [response.text]}
+        ])
+
+        return [{'quote': quote_data['quote'], 'author': quote_data['author']} for quote_data in candidates]
+
+    def _record(self, turns: List[Dict]):
+        """Add an exchange's turns to the history and save it; called with the lock held"""
+        self.chat_history.extend(turns)
+        self.save_history()
+
+        # Check token count and reset if needed
+        if len(str(self.chat_history)) > 800000:  # Conservative limit
+            self.chat_history = []
+            self.save_history()
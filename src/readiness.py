@@ -0,0 +1,79 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import REGISTRY
+
+logger = logging.getLogger('Readiness')
+
+COMPONENT_READY = REGISTRY.gauge(
+    'quotes_bot_component_ready', 'Whether a component finished warming up (1), failed (-1) or is pending (0)', ('component',))
+
+class Readiness:
+    """Warms components up in parallel in the background and reports which are ready
+
+    Warm-ups must be idempotent: components also initialize themselves on first use,
+    so a slow or failed warm-up only means the first real call does the work.
+    """
+    def __init__(self, max_workers: int = 4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='warmup')
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._errors = {}
+
+    def register(self, name: str, warm_up):
+        """Start warming a component up; returns immediately"""
+        with self._lock:
+            if name in self._futures:
+                return self._futures[name]
+            COMPONENT_READY.set(0, component=name)
+            future = self._pool.submit(self._run, name, warm_up)
+            self._futures[name] = future
+            return future
+
+    def _run(self, name: str, warm_up):
+        start = time.perf_counter()
+        try:
+            result = warm_up()
+        except Exception as e:
+            self._errors[name] = str(e)
+            COMPONENT_READY.set(-1, component=name)
+            logger.warning(f"{name} failed to warm up, it will retry on first use: {str(e)}")
+            raise
+        COMPONENT_READY.set(1, component=name)
+        logger.info(f"{name} ready in {time.perf_counter() - start:.2f}s")
+        return result
+
+    def is_ready(self, name: str) -> bool:
+        future = self._futures.get(name)
+        return bool(future and future.done() and not future.exception())
+
+    def wait(self, name: str, timeout: float = None):
+        """Block until a component is warm, re-raising its warm-up error"""
+        return self._futures[name].result(timeout=timeout)
+
+    def wait_all(self, timeout: float = None) -> bool:
+        """Wait for every registered warm-up; True if all succeeded in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for name in list(self._futures):
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                self.wait(name, remaining)
+            except Exception:
+                pass
+        return all(self.is_ready(name) for name in self._futures)
+
+    def status(self) -> dict:
+        """Component name to 'ready', 'pending' or 'failed: <error>'"""
+        result = {}
+        for name, future in list(self._futures.items()):
+            if not future.done():
+                result[name] = 'pending'
+            elif future.exception():
+                result[name] = f"failed: {self._errors.get(name, future.exception())}"
+            else:
+                result[name] = 'ready'
+        return result
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Animated-background quote reels
+
+The blobby gradient drifts by sliding each colour's window across the noise atlas,
+one step per frame. The text is drawn once into an alpha mask and composited onto
+every frame, and frames are streamed straight into cv2.VideoWriter, so only one
+frame is ever held in memory.
+
+    python reel_generator.py --quote "..." --author "..." --seconds 10 --fps 30
+"""
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import resource
+import numpy as np
+from PIL import Image
+from image_generator import ImageGenerator
+from noise_atlas import NoiseAtlas
+from metrics import timed
+
+logger = logging.getLogger('ReelGenerator')
+
+class ReelGenerator:
+    """Renders a quote over a moving gradient into a video file
+
+    The background is computed at 1/REEL_BACKGROUND_SCALE resolution and scaled up,
+    which is invisible after the blur; grain and text are added at full resolution.
+    """
+    def __init__(self, image_generator: ImageGenerator = None, fps: int = None, scale: int = None,
+                 speed: float = None, codec: str = None):
+        self.image_generator = image_generator or ImageGenerator()
+        # Reels always drift across the atlas, even when stills compute their noise directly
+        self.atlas = self.image_generator.noise_atlas or NoiseAtlas(history_dir=self.image_generator.history_dir)
+        self.fps = int(fps or os.getenv('REEL_FPS', 30))
+        self.scale = int(scale or os.getenv('REEL_BACKGROUND_SCALE', 4))
+        # Atlas pixels each colour's window moves per second
+        self.speed = float(speed or os.getenv('REEL_DRIFT_SPEED', 60))
+        self.codec = codec or os.getenv('REEL_CODEC', 'mp4v')
+        self.rng = np.random.default_rng()
+
+    def _layers(self, count: int) -> list:
+        """A random start, direction, rotation and flip for each colour's window"""
+        atlas = self.atlas
+        layers = []
+        for layer in self.rng.permutation(max(count, atlas.layers))[:count] % atlas.layers:
+            angle = self.rng.uniform(0, 2 * np.pi)
+            layers.append({
+                'layer': int(layer),
+                'top': float(self.rng.integers(atlas.size)),
+                'left': float(self.rng.integers(atlas.size)),
+                'dy': np.sin(angle) * self.speed / self.fps,
+                'dx': np.cos(angle) * self.speed / self.fps,
+                # Half turns only: quarter turns make every frame a slow transposed copy
+                'turns': int(self.rng.integers(2)) * 2,
+                'flip': bool(self.rng.integers(2)),
+            })
+        return layers
+
+    def _background(self, layers: list, frame: int, rows: int, cols: int, colors: np.ndarray) -> np.ndarray:
+        """One low-resolution frame of the gradient as float32 in [0, 1]"""
+        atlas = self.atlas
+        bases = np.empty((len(layers), rows, cols), dtype=np.float32)
+        for i, spec in enumerate(layers):
+            crop = atlas.crop(spec['layer'],
+                              int(spec['top'] + spec['dy'] * frame),
+                              int(spec['left'] + spec['dx'] * frame),
+                              rows, cols, step=self.scale)
+            crop = np.rot90(crop, spec['turns'])
+            bases[i] = crop[:, ::-1] if spec['flip'] else crop
+        bases /= bases.sum(axis=0)
+        return np.tensordot(bases, colors, axes=(0, 0))
+
+    def _text_overlay(self, quote: str, author: str, size: tuple, first_frame: Image.Image) -> tuple:
+        """The text as an alpha mask cropped to its bounding box, plus where it goes and its colour"""
+        generator = self.image_generator
+        quote, author = generator.format_quote(quote, author)
+        mask = Image.new('L', size, 0)
+        generator.draw_quote(mask, quote, author, text_color=255)
+        left, top, right, bottom = mask.getbbox()
+        alpha = np.asarray(mask.crop((left, top, right, bottom)), dtype=np.float32)[:, :, None] / 255
+        text_color = np.array(generator.get_contrast_color(first_frame), dtype=np.float32)
+        return alpha, (top, bottom, left, right), text_color[::-1]  # BGR for OpenCV
+
+    def create_reel(self, quote: str, author: str, seconds: float = 10, output_path: str = None,
+                    size: tuple = None) -> dict:
+        """Write a reel to output_path (default output_XXXX.mp4) and return render stats"""
+        import cv2
+        width, height = size or ImageGenerator.FORMATS['story']
+        output_path = output_path or f"output_{random.randint(1000, 9999)}.mp4"
+        frames = int(round(seconds * self.fps))
+        rows, cols = -(-height // self.scale), -(-width // self.scale)
+
+        self.atlas.ensure()
+        colors = np.array([np.random.randint(0, 255, 3) / 255.0 for _ in range(4)], dtype=np.float32)
+        layers = self._layers(len(colors))
+
+        # Text colour is picked from the first frame and kept for the whole clip
+        first = self._background(layers, 0, rows, cols, colors[:, ::-1])
+        first_frame = Image.fromarray((cv2.resize(first, (width, height))[:, :, ::-1] * 255).astype(np.uint8))
+        alpha, (top, bottom, left, right), text_color = self._text_overlay(quote, author, (width, height), first_frame)
+        # uint8 so compositing is two saturating OpenCV ops per frame
+        inverse_alpha = np.round((1 - alpha) * 255).repeat(3, axis=2).astype(np.uint8)
+        text_layer = np.round(alpha * text_color * 255).astype(np.uint8)
+
+        # Grain stays put like film texture; changing it every frame makes the video ten
+        # times larger and the encoder twice as slow. Split into the parts to add and
+        # subtract so it can be applied in uint8.
+        grain = self.rng.standard_normal((height, width, 3), dtype=np.float32) * 0.035 * 255
+        grain_add = np.clip(grain, 0, 255).astype(np.uint8)
+        grain_subtract = np.clip(-grain, 0, 255).astype(np.uint8)
+        del grain
+
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*self.codec), self.fps, (width, height))
+        if not writer.isOpened():
+            raise Exception(f"Could not open a {self.codec} video writer for {output_path}")
+        start = time.perf_counter()
+        try:
+            for frame in range(frames):
+                with timed('reel_frame'):
+                    # Colours are reversed so the frame comes out in OpenCV's BGR order
+                    background = self._background(layers, frame, rows, cols, colors[:, ::-1])
+                    # Scale up after converting to uint8, which is much cheaper to resize
+                    image = cv2.resize(cv2.convertScaleAbs(background, alpha=255), (width, height),
+                                       interpolation=cv2.INTER_LINEAR)
+                    region = cv2.multiply(image[top:bottom, left:right], inverse_alpha, scale=1 / 255)
+                    image[top:bottom, left:right] = cv2.add(region, text_layer)
+                    cv2.add(image, grain_add, dst=image)
+                    cv2.subtract(image, grain_subtract, dst=image)
+                    writer.write(image)
+        finally:
+            writer.release()
+        elapsed = time.perf_counter() - start
+        stats = {
+            'path': output_path,
+            'frames': frames,
+            'seconds': seconds,
+            'render_seconds': elapsed,
+            'fps': frames / elapsed if elapsed else float('inf'),
+            'realtime_factor': seconds / elapsed if elapsed else float('inf'),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        logger.info(f"Wrote {frames} frames to {output_path} in {elapsed:.1f}s "
+                    f"({stats['fps']:.1f} fps, {stats['realtime_factor']:.2f}x real time)")
+        return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Render a quote reel with an animated background')
+    parser.add_argument('--quote', default="Nothing in life is to be feared, it is only to be understood")
+    parser.add_argument('--author', default="Marie Curie")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--fps', type=int, default=None, help='Frames per second (REEL_FPS, default 30)')
+    parser.add_argument('--output', default=None, help='Video file to write (default output_XXXX.mp4)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stats = ReelGenerator(fps=args.fps).create_reel(args.quote, args.author, args.seconds, args.output)
+    print(f"Reel written to {stats['path']}")
+    print(f"  {stats['frames']} frames in {stats['render_seconds']:.1f}s: "
+          f"{stats['fps']:.1f} fps, {stats['realtime_factor']:.2f}x real time")
+    print(f"  Peak RSS: {stats['peak_rss_mb']:.0f} MB")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
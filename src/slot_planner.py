@@ -0,0 +1,122 @@
+import os
+import json
+import random
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime, date, timedelta
+
+logger = logging.getLogger('SlotPlanner')
+
+# Slot keys double as job-store idempotency keys, so keep them minute-precise
+SLOT_FORMAT = '%Y-%m-%dT%H:%M'
+
+class PostingWindow:
+    """Daily posting window, which may run past midnight (e.g. 18:00 to 02:00)"""
+    def __init__(self, start_hour: int, end_hour: int, timezone):
+        if not (0 <= start_hour < 24 and 0 <= end_hour < 24) or start_hour == end_hour:
+            raise ValueError(f"Invalid posting window {start_hour}:00-{end_hour}:00")
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.timezone = timezone
+
+    @classmethod
+    def from_env(cls, timezone) -> 'PostingWindow':
+        return cls(
+            int(os.getenv('POSTING_WINDOW_START', 18)),
+            int(os.getenv('POSTING_WINDOW_END', 2)),
+            timezone
+        )
+
+    @property
+    def duration(self) -> timedelta:
+        return timedelta(hours=(self.end_hour - self.start_hour) % 24)
+
+    def bounds(self, day: date) -> tuple:
+        """Start and end of the window that opens on the given day"""
+        start = self.timezone.localize(datetime(day.year, day.month, day.day, self.start_hour))
+        return start, start + self.duration
+
+    def opening_day(self, moment: datetime):
+        """The day whose window contains this moment, or None if it falls outside every window"""
+        moment = moment.astimezone(self.timezone)
+        for day in (moment.date(), moment.date() - timedelta(days=1)):
+            start, end = self.bounds(day)
+            if start <= moment < end:
+                return day
+        return None
+
+    def contains(self, moment: datetime) -> bool:
+        return self.opening_day(moment) is not None
+
+class SlotPlanner:
+    """Computes each window's exact posting slots once and persists them"""
+    def __init__(self, window: PostingWindow, posts_per_day: int, plan_file: str = None,
+                 jitter_minutes: float = None):
+        self.window = window
+        self.posts_per_day = posts_per_day
+        self.jitter = timedelta(minutes=float(jitter_minutes if jitter_minutes is not None
+                                              else os.getenv('SLOT_JITTER_MINUTES', 30)))
+        self.plan_file = Path(plan_file) if plan_file else Path(__file__).parent.parent / "history" / "slot_plan.json"
+        self.plan_file.parent.mkdir(exist_ok=True)
+        self._lock = threading.Lock()
+        self._plans = self._load()
+
+    def _load(self) -> dict:
+        if not self.plan_file.exists():
+            return {}
+        try:
+            with open(self.plan_file, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read slot plan, starting fresh: {e}")
+            return {}
+
+    def _save(self):
+        # Write to a temp file first so a crash never leaves a half-written plan
+        tmp_path = self.plan_file.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._plans, f, indent=2)
+        os.replace(tmp_path, self.plan_file)
+
+    def _compute(self, day: date) -> list:
+        """Spread the day's posts evenly over the window, jittering each around its segment centre"""
+        start, _ = self.window.bounds(day)
+        segment = self.window.duration / self.posts_per_day
+        jitter = min(self.jitter, segment / 2)
+        slots = []
+        for i in range(self.posts_per_day):
+            centre = start + segment * (i + 0.5)
+            offset = timedelta(seconds=random.uniform(-jitter.total_seconds(), jitter.total_seconds()))
+            slots.append(self.window.timezone.normalize(centre + offset))
+        return slots
+
+    def plan_day(self, day: date) -> list:
+        """Slots for the window opening on this day, computed on first request and reused afterwards"""
+        key = day.isoformat()
+        with self._lock:
+            if key not in self._plans or len(self._plans[key]) != self.posts_per_day:
+                slots = self._compute(day)
+                self._plans[key] = [slot.isoformat() for slot in slots]
+                # Only the current and upcoming windows are ever needed again
+                cutoff = (day - timedelta(days=2)).isoformat()
+                self._plans = {k: v for k, v in self._plans.items() if k >= cutoff}
+                self._save()
+                logger.info(f"Planned {len(slots)} slot(s) for the window opening {key}")
+            return [datetime.fromisoformat(slot).astimezone(self.window.timezone) for slot in self._plans[key]]
+
+    def upcoming_slots(self, now: datetime) -> list:
+        """Future slots in the window currently open (if any) and the one opening today"""
+        now = now.astimezone(self.window.timezone)
+        days = {now.date()}
+        open_day = self.window.opening_day(now)
+        if open_day:
+            days.add(open_day)
+        slots = []
+        for day in sorted(days):
+            slots.extend(slot for slot in self.plan_day(day) if slot > now)
+        return sorted(slots)
+
+    @staticmethod
+    def slot_key(slot: datetime) -> str:
+        return slot.strftime(SLOT_FORMAT)
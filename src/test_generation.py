@@ -1,5 +1,6 @@
 import os
 import sys
+import random
 from dotenv import load_dotenv
 from quote_generator import QuoteGenerator
 from image_generator import ImageGenerator
@@ -31,8 +32,18 @@ def main():
         print("2. Testing image generation...\n")
         image_gen = ImageGenerator()
         try:
-            image_path = image_gen.create_quote_image(quote_data['quote'], quote_data['author'])
-            print(f"Image generated successfully at: {image_path}")
+            if '--variants' in sys.argv:
+                # Feed, portrait and story sizes from one shared background
+                variants = image_gen.render_variants(quote_data['quote'], quote_data['author'])
+                stem = f"output_{random.randint(1000, 9999)}"
+                for name, png in image_gen.encode_variants(variants).items():
+                    image_path = f"{stem}_{name}.png"
+                    with open(image_path, 'wb') as f:
+                        f.write(png)
+                    print(f"{name.capitalize()} image generated successfully at: {image_path}")
+            else:
+                image_path = image_gen.create_quote_image(quote_data['quote'], quote_data['author'])
+                print(f"Image generated successfully at: {image_path}")
             print("Please check the generated image to verify the design.")
         except Exception as e:
             print(f"Failed to generate image: {e}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+from metrics import TOKEN_EXPIRES_IN
+
+logger = logging.getLogger('TokenLifecycle')
+
+def _fingerprint(token: str) -> str:
+    return hashlib.sha256((token or '').encode('utf-8')).hexdigest()[:16]
+
+class TokenLifecycleManager:
+    """Tracks every account's token expiry from debug_token and refreshes it ahead of time
+
+    State lives in history/token_state.json rather than .env. A refreshed token is
+    swapped into the account's live InstagramPoster, and on restart it replaces the
+    configured token for as long as the configured one hasn't been changed by hand.
+    """
+    def __init__(self, accounts, monitoring=None, state_file: str = None, refresh_days: float = None):
+        self.accounts = accounts
+        self.monitoring = monitoring
+        self.state_file = Path(state_file) if state_file else Path(__file__).parent.parent / "history" / "token_state.json"
+        self.state_file.parent.mkdir(exist_ok=True)
+        self.refresh_seconds = float(refresh_days if refresh_days is not None else os.getenv('TOKEN_REFRESH_DAYS', 7)) * 86400
+        self._lock = threading.Lock()
+        self._state = self._load()
+        self._apply_stored_tokens()
+
+    def _load(self) -> dict:
+        if not self.state_file.exists():
+            return {}
+        try:
+            with open(self.state_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable token state: {str(e)}")
+            return {}
+
+    def _save(self):
+        tmp_path = self.state_file.with_suffix('.json.tmp')
+        # The file holds live access tokens, so keep it private
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_file)
+
+    def _apply_stored_tokens(self):
+        """Use previously refreshed tokens unless the configured token has since changed"""
+        for config in self.accounts.configs:
+            entry = self._state.get(config.name)
+            if not entry:
+                continue
+            if entry.get('configured') != _fingerprint(config.access_token):
+                logger.info(f"[{config.name}] Configured token changed, dropping stored token state")
+                del self._state[config.name]
+                continue
+            if entry.get('token') and entry['token'] != config.access_token:
+                self.accounts.get_poster(config.name).swap_access_token(entry['token'])
+                logger.info(f"[{config.name}] Using refreshed token from {self.state_file.name}")
+            self._update_gauge(config.name)
+
+    def _entry(self, name: str) -> dict:
+        config = next(config for config in self.accounts.configs if config.name == name)
+        return self._state.setdefault(name, {'configured': _fingerprint(config.access_token)})
+
+    def _update_gauge(self, name: str):
+        expires_at = self._state.get(name, {}).get('expires_at')
+        if expires_at is None:
+            return
+        TOKEN_EXPIRES_IN.set(-1 if expires_at == 0 else expires_at - time.time(), account=name)
+
+    def expires_in(self, name: str):
+        """Seconds until the account's token expires, None if unknown, inf if it never does"""
+        expires_at = self._state.get(name, {}).get('expires_at')
+        if expires_at is None:
+            return None
+        return float('inf') if expires_at == 0 else expires_at - time.time()
+
+    def check(self, name: str) -> dict:
+        """Read the token's real expiry from debug_token and store it"""
+        poster = self.accounts.get_poster(name)
+        info = poster.get_token_info()
+        with self._lock:
+            entry = self._entry(name)
+            entry.update({
+                'token': poster.access_token,
+                'is_valid': bool(info.get('is_valid')),
+                'expires_at': int(info.get('expires_at', 0) or 0),
+                'data_access_expires_at': int(info.get('data_access_expires_at', 0) or 0),
+                'checked_at': int(time.time()),
+            })
+            self._save()
+        self._update_gauge(name)
+        return info
+
+    def refresh(self, name: str) -> str:
+        """Exchange the account's token for a fresh long-lived one and hot-swap it in"""
+        poster = self.accounts.get_poster(name)
+        new_token = poster.exchange_token(poster.access_token)
+        if not new_token:
+            raise Exception("Token exchange returned no access token")
+        # Confirm the new token works before any request uses it
+        info = poster.get_token_info(new_token)
+        if not info.get('is_valid'):
+            raise Exception(f"Refreshed token is not valid: {info.get('error', info)}")
+        with self._lock:
+            entry = self._entry(name)
+            entry.update({
+                'token': new_token,
+                'is_valid': True,
+                'expires_at': int(info.get('expires_at', 0) or 0),
+                'data_access_expires_at': int(info.get('data_access_expires_at', 0) or 0),
+                'checked_at': int(time.time()),
+                'refreshed_at': int(time.time()),
+            })
+            # Persist before swapping so a crash can't lose a token that is already in use
+            self._save()
+        poster.swap_access_token(new_token)
+        self._update_gauge(name)
+        logger.info(f"[{name}] Access token refreshed")
+        return new_token
+
+    def check_all(self):
+        """Check every account and refresh tokens that expire within the refresh window"""
+        for config in self.accounts.configs:
+            name = config.name
+            try:
+                info = self.check(name)
+                expires_in = self.expires_in(name)
+                if not info.get('is_valid'):
+                    raise Exception(f"Token is no longer valid: {info.get('error', {}).get('message', info)}")
+                if expires_in == float('inf') or expires_in > self.refresh_seconds:
+                    continue
+                logger.info(f"[{name}] Token expires in {expires_in / 86400:.1f} days, refreshing")
+                self.refresh(name)
+                if self.monitoring:
+                    self.monitoring.report_token_refreshed(name, self._state[name]['expires_at'])
+            except Exception as e:
+                logger.error(f"[{name}] Token check failed: {str(e)}")
+                if self.monitoring:
+                    self.monitoring.report_token_refresh_failed(name, str(e), self.expires_in(name))
+
+    def status(self) -> dict:
+        """Account name to its stored state, without the token itself"""
+        return {
+            name: {key: value for key, value in entry.items() if key != 'token'}
+            for name, entry in self._state.items()
+        }
+
+def main():
+    from dotenv import load_dotenv
+    from account_manager import AccountManager
+
+    parser = argparse.ArgumentParser(description='Check and refresh Instagram access tokens')
+    parser.add_argument('--refresh', action='store_true', help='Refresh tokens that are inside the refresh window')
+    parser.add_argument('--force', action='store_true', help='With --refresh, refresh every token regardless of expiry')
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    accounts = AccountManager()
+    manager = TokenLifecycleManager(accounts)
+    # One account failing doesn't stop the others; any failure makes the exit status non-zero
+    failed = []
+    try:
+        if args.refresh and not args.force:
+            manager.check_all()
+        for config in accounts.configs:
+            try:
+                if args.refresh and args.force:
+                    manager.refresh(config.name)
+                elif not args.refresh:
+                    manager.check(config.name)
+            except Exception as e:
+                logger.error(f"[{config.name}] {'Refresh' if args.refresh else 'Check'} failed: {str(e)}")
+                failed.append(config.name)
+        for name, entry in manager.status().items():
+            expires_in = manager.expires_in(name)
+            if expires_in is None:
+                expiry = 'unknown'
+            elif expires_in == float('inf'):
+                expiry = 'never'
+            else:
+                expiry = f"in {expires_in / 86400:.1f} days"
+            print(f"{name}: valid={entry.get('is_valid')} expires {expiry}")
+        for name in failed:
+            print(f"{name}: failed, see the log above")
+    finally:
+        accounts.shutdown()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The bot's modules sit flat in src/ and import each other by name
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
@@ -0,0 +1,57 @@
+"""Every kernel backend against the original image_generator expressions, at a small size"""
+import importlib.util
+import numpy as np
+import pytest
+
+import kernels
+
+SIZE = 32
+GRAIN_SCALE = 0.035
+
+BACKENDS = [
+    'numpy',
+    pytest.param('numba', marks=pytest.mark.skipif(importlib.util.find_spec('numba') is None,
+                                                   reason='Numba is not installed')),
+]
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    return kernels.get(request.param)
+
+@pytest.fixture
+def inputs():
+    rng = np.random.default_rng(0)
+    return {
+        'field': rng.random((SIZE, SIZE), dtype=np.float32),
+        'bases': rng.random((4, SIZE, SIZE), dtype=np.float32) + 0.01,
+        'colors': rng.random((4, 3), dtype=np.float32),
+        'grain': rng.standard_normal((SIZE, SIZE, 3), dtype=np.float32),
+    }
+
+@pytest.mark.parametrize('octaves', [1, 2])
+@pytest.mark.parametrize('offset', [0, 5])
+def test_pnoise_field(backend, octaves, offset):
+    pytest.importorskip('noise')
+    reference = kernels.reference_pnoise_field(SIZE, SIZE, 6.0, offset, octaves, 0.5, 2.0)
+    output = backend.pnoise_field(SIZE, SIZE, 6.0, offset, octaves, 0.5, 2.0)
+    assert output.shape == (SIZE, SIZE)
+    np.testing.assert_allclose(output, reference, rtol=0, atol=1e-6)
+
+def test_normalize_range(backend, inputs):
+    reference = kernels.reference_normalize_range(inputs['field'].astype(np.float64))
+    output = backend.normalize_range(inputs['field'].copy())
+    np.testing.assert_allclose(output, reference, rtol=0, atol=1e-6)
+
+def test_normalize_sum(backend, inputs):
+    reference = kernels.reference_normalize_sum(inputs['bases'].astype(np.float64))
+    output = backend.normalize_sum(inputs['bases'].copy())
+    np.testing.assert_allclose(output, reference, rtol=0, atol=1e-6)
+
+def test_mix(backend, inputs):
+    weights = kernels.reference_normalize_sum(inputs['bases'].astype(np.float64))
+    reference = kernels.reference_mix(weights, inputs['colors'].astype(np.float64),
+                                      inputs['grain'].astype(np.float64), GRAIN_SCALE)
+    output = backend.mix(weights.astype(np.float32), inputs['colors'], inputs['grain'], GRAIN_SCALE)
+    assert output.dtype == np.uint8
+    # 8-bit output may differ by one level from float32 rounding
+    assert np.abs(output.astype(np.int16) - reference.astype(np.int16)).max() <= 1